@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+"""
+Import time budget of the command line client (resources/client.py).
+The client is started with `python3 -X importtime` for a client action (the wrapper does not need to run)
+and the time spent importing the modules that are not already imported by the interpreter startup is summed.
+Fails if this time is over the budget or if a module of the server side is imported.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+RESOURCES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "resources")
+# modules only needed by the server side, the client must never import them
+FORBIDDEN = [ "argparse", "distutils", "tarfile", "gzip", "shutil", "subprocess", "hashlib", "http", "minecraft", "snapshot", "transport", "pgzip", "backupcodecs", "metrics" ]
+
+def importTimes(command):
+    """The imports of command: a list of (module, self us, cumulative us, depth)"""
+    res = subprocess.run([sys.executable, "-X", "importtime"] + command, cwd=RESOURCES, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    imports = []
+    for line in res.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        selfUs, cumulativeUs, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((name.strip(), int(selfUs), int(cumulativeUs), depth))
+    return imports
+
+def measure(action):
+    baseline = set(name for name, selfUs, cumulativeUs, depth in importTimes(["-c", "pass"]))
+    imports = importTimes(["client.py", "--rcon-port", "1"] + action)
+    extra = [ i for i in imports if i[0] not in baseline ]
+    total = sum(selfUs for name, selfUs, cumulativeUs, depth in extra)
+    return total / 1000.0, extra
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", default=50, type=float, help="the maximum import time of the client in milliseconds")
+    parser.add_argument("--runs", default=5, type=int, help="the median of RUNS runs is compared to the budget")
+    parser.add_argument("--top", default=10, type=int, help="the number of slowest imports to display")
+    parser.add_argument("action", nargs="*", default=["status"], help="the client action to measure")
+    args = parser.parse_args()
+
+    runs = [ measure(args.action) for i in range(args.runs) ]
+    median = statistics.median(total for total, extra in runs)
+    total, extra = runs[-1]
+    print("client import time: median {0:.1f}ms over {1} runs (budget {2:.1f}ms)".format(median, args.runs, args.budget))
+    for name, selfUs, cumulativeUs, depth in sorted(extra, key=lambda i: -i[1])[:args.top]:
+        print("  {0:>8.1f}ms  {1}".format(selfUs / 1000.0, name))
+
+    failed = False
+    forbidden = sorted(set(name for name, selfUs, cumulativeUs, depth in extra if name.split(".")[0] in FORBIDDEN))
+    if forbidden:
+        print("FAIL: server side modules imported by the client: {0}".format(", ".join(forbidden)))
+        failed = True
+    if median > args.budget:
+        print("FAIL: import time over budget")
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,347 @@
+#!/usr/bin/python3
+"""
+Benchmark suite of the wrapper.
+A synthetic world is generated (see worldgen.py) and the following operations are timed:
+    - backup: _backup with and without the staging copy, then after a few chunks were modified, in archive and snapshot mode
+    - load: _load of the latest archive
+    - upload and download: _uploadNow and _download with a local directory as the remote
+    - world: world.optimize in dry run with a threshold of InhabitedTime (every chunk is read), then the compaction
+      of the region files after a few chunks were modified
+    - rcon: round-trips, pipelined commands and a pool of connections against a fake JVM built on rcon.RCONServer
+    - cli: the cold start of the minecraft command (client.py) and of minecraft.py
+Each operation runs --runs times, the median, min and max are reported. The results are written as JSON (--output)
+and can be compared to the results of a previous release (--compare).
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+RESOURCES = os.path.join(BENCHMARKS, "..", "resources")
+sys.path.insert(0, RESOURCES)
+import minecraft
+import rcon
+import world
+import worldgen
+
+RCON_PASSWORD = "benchmark"
+PLAYERS = [ "Steve", "Alex", "Notch" ]
+# half of the chunks of worldgen are inhabited less than this number of ticks
+MIN_INHABITED = 50000
+
+class FakeJvm(rcon.RCONServerHandler):
+    """Answers the RCON commands like a minecraft server, after delay seconds (the game runs the commands on its main thread)"""
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.commands = 0
+
+    def handleRequest(self, command):
+        self.commands += 1
+        if self.delay:
+            time.sleep(self.delay)
+        name = command.split(" ", 1)[0].lower()
+        if name == "list":
+            return "There are {0} of a max of 20 players online: {1}".format(len(PLAYERS), ", ".join(PLAYERS))
+        if command == "tick query":
+            return "The game is running normally\nTarget tick rate: 20.0 per second.\nAverage time per tick: 12.5ms (Target: 50.0ms)\nPercentiles: P50: 12.1ms P95: 18.3ms P99: 22.0ms, sample: 100"
+        if name == "save-all":
+            return "Saving the game (this may take a moment!)Saved the game"
+        if name == "save-off":
+            return "Automatic saving is now disabled"
+        if name == "save-on":
+            return "Automatic saving is now enabled"
+        if name == "say":
+            return ""
+        if name == "minecraft":
+            return json.dumps({ "code": 200, "status": "RUNNING" })
+        return "Unknown or incomplete command, see below for error"
+
+def startFakeJvm(delay=0):
+    """Start a fake JVM listening on a free port. Returns the server and its port"""
+    server = rcon.RCONServer("127.0.0.1", 0, RCON_PASSWORD, FakeJvm(delay))
+    threading.Thread(target=server.run, name="fake-jvm", daemon=True).start()
+    return server, server.s.getsockname()[1]
+
+def attachJvm(server, port):
+    """Make the MinecraftServer send its RCON commands to the fake JVM as if the JVM was running. Returns the event to set to stop it"""
+    stopped = threading.Event()
+    server.thread = threading.Thread(target=stopped.wait, name="fake-jvm-thread", daemon=True)
+    server.thread.start()
+    server.rcon = rcon.RCONClientPool("127.0.0.1", port, RCON_PASSWORD)
+    return stopped
+
+def serverArgs(root, *options):
+    """The arguments of a MinecraftServer working in root"""
+    return minecraft.parser.parse_args([
+        "--workdir", os.path.join(root, "server"),
+        "--backup-dir", os.path.join(root, "backup"),
+        "--remote-url", os.path.join(root, "remote"),
+        "--jar", os.path.join(root, "minecraft_server.{0}.jar".format(worldgen.VERSION_NAME)),
+        "--cds-dir", os.path.join(root, "cds"),
+        "--perf-interval", "0",
+    ] + list(options) + [ "serve" ])
+
+def measure(function, runs, setup=None):
+    """Run function runs times (setup before each run, not timed). Returns the durations and the result of the last run"""
+    durations = []
+    result = None
+    for i in range(runs):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - start)
+    return durations, result
+
+def summary(durations, size=None, **extra):
+    res = { "runs": len(durations), "median": round(statistics.median(durations), 4), "min": round(min(durations), 4), "max": round(max(durations), 4) }
+    if size:
+        res["size"] = size
+        res["mb_per_s"] = round(size / 1048576 / max(res["median"], 1e-6), 1)
+    res.update(extra)
+    return res
+
+def latencies(samples):
+    ordered = sorted(samples)
+    pick = lambda p: round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 3)
+    return { "runs": len(samples), "median": round(statistics.median(samples), 6), "p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "max_ms": round(ordered[-1] * 1000, 3) }
+
+def resetDir(path):
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+class Suite:
+
+    def __init__(self, args):
+        self.args = args
+        self.root = args.workdir or tempfile.mkdtemp(prefix="mc-bench-")
+        self.results = {}
+        self.generator = worldgen.WorldGenerator(args.seed)
+
+    def log(self, name, result):
+        self.results[name] = result
+        if "p50_ms" in result:
+            print("  {0:<28} p50 {1:.3f}ms p95 {2:.3f}ms p99 {3:.3f}ms".format(name, result["p50_ms"], result["p95_ms"], result["p99_ms"]), flush=True)
+        else:
+            print("  {0:<28} {1:>10.4f}s{2}".format(name, result["median"], "  {0:>8.1f} MB/s".format(result["mb_per_s"]) if "mb_per_s" in result else ""), flush=True)
+
+    def worldSize(self):
+        return worldgen.describe(os.path.join(self.root, "server"))["size"]
+
+    def generate(self):
+        serverDir = os.path.join(self.root, "server")
+        resetDir(serverDir)
+        for d in [ "backup", "remote", "cds" ]:
+            resetDir(os.path.join(self.root, d))
+        print("generating a world of {0} regions of {1} chunks and {2} players in {3}".format(self.args.regions, self.args.chunks, self.args.players, self.root), flush=True)
+        start = time.perf_counter()
+        world = self.generator.generate(serverDir, self.args.regions, self.args.chunks, self.args.players)
+        world["seconds"] = round(time.perf_counter() - start, 3)
+        print("  {0} files, {1:.1f} MB in {2:.1f}s".format(world["files"], world["size"] / 1048576, world["seconds"]), flush=True)
+        return world
+
+    def touch(self):
+        self.generator.touch(os.path.join(self.root, "server"), self.args.touch_regions, self.args.touch_chunks)
+
+    def benchBackup(self, port):
+        print("backup ({0}, {1} threads)".format(self.args.codec, self.args.threads), flush=True)
+        codecOptions = [ "--backup-codec", self.args.codec, "--backup-threads", str(self.args.threads) ]
+        size = self.worldSize()
+        for name, options in [ ("backup_direct", [ "--no-backup-staging" ]), ("backup_staging", []) ]:
+            server = minecraft.MinecraftServer(serverArgs(self.root, *(codecOptions + options)))
+            stopped = attachJvm(server, port)
+            durations, backup = measure(server._backup, self.args.runs, setup=lambda: shutil.rmtree(server._stagingDir(), ignore_errors=True))
+            self.log(name, summary(durations, size, readonly_seconds=backup["readonly_seconds"], archive_size=backup["size"], compression_ratio=backup["compression_ratio"]))
+            stopped.set()
+
+        # a running server: a few chunks modified between two backups, the staging copy is up to date
+        server = minecraft.MinecraftServer(serverArgs(self.root, *codecOptions))
+        stopped = attachJvm(server, port)
+        server._backup()
+        durations, backup = measure(server._backup, self.args.runs, setup=self.touch)
+        self.log("backup_staging_incremental", summary(durations, size, readonly_seconds=backup["readonly_seconds"]))
+        stopped.set()
+
+        snapshotDir = os.path.join(self.root, "snapshot")
+        resetDir(snapshotDir)
+        server = minecraft.MinecraftServer(serverArgs(self.root, "--backup-mode", "snapshot", "--backup-dir", snapshotDir, "--backup-threads", str(self.args.threads)))
+        stopped = attachJvm(server, port)
+        durations, backup = measure(server._backup, 1)
+        self.log("backup_snapshot", summary(durations, size))
+        durations, backup = measure(server._backup, self.args.runs, setup=self.touch)
+        self.log("backup_snapshot_incremental", summary(durations, size, readonly_seconds=backup["readonly_seconds"]))
+        stopped.set()
+        shutil.rmtree(snapshotDir)
+
+    def benchLoad(self):
+        print("load", flush=True)
+        server = minecraft.MinecraftServer(serverArgs(self.root, "--backup-codec", self.args.codec))
+        durations, result = measure(server._load, self.args.runs)
+        self.log("load", summary(durations, self.worldSize()))
+
+    def benchTransfer(self):
+        print("upload and download (local directory)", flush=True)
+        remoteDir = os.path.join(self.root, "remote")
+        options = [ "--backup-codec", self.args.codec, "--backup-threads", str(self.args.threads) ]
+        server = minecraft.MinecraftServer(serverArgs(self.root, *options))
+        backup = server._backup()
+        size = backup["size"]
+        durations, stats = measure(lambda: server._uploadNow(backup), self.args.runs, setup=lambda: resetDir(remoteDir))
+        self.log("upload", summary(durations, size))
+
+        # a new backup of the same name after a few changes: only the blocks that changed are sent
+        def newBackup():
+            self.touch()
+            backup.update(server._backup())
+        durations, stats = measure(lambda: server._uploadNow(backup), self.args.runs, setup=newBackup)
+        self.log("upload_delta", summary(durations, backup["size"], sent=stats["sent"], reused=stats["reused"]))
+
+        downloadDir = os.path.join(self.root, "download")
+        server = minecraft.MinecraftServer(serverArgs(self.root, "--backup-dir", downloadDir, *options))
+        durations, restored = measure(server._download, self.args.runs, setup=lambda: resetDir(downloadDir))
+        if not restored:
+            raise minecraft.InternalError("the download did not restore the world")
+        self.log("download", summary(durations, backup["size"]))
+        shutil.rmtree(downloadDir)
+
+    def benchWorld(self):
+        print("world optimize", flush=True)
+        worldDir = os.path.join(self.root, "server", "world")
+        size = self.worldSize()
+        durations, report = measure(lambda: world.optimize(worldDir, MIN_INHABITED, dryRun=True), self.args.runs)
+        self.log("world_optimize_scan", summary(durations, size, chunks_dropped=report["chunks_dropped"]))
+        durations, report = measure(lambda: world.optimize(worldDir), self.args.runs, setup=self.touch)
+        self.log("world_optimize_compact", summary(durations, size, bytes_reclaimed=report["bytes_reclaimed"]))
+
+    def benchRcon(self, port):
+        print("rcon (fake jvm, {0} commands)".format(self.args.commands), flush=True)
+        client = rcon.RCONClient("127.0.0.1", port, RCON_PASSWORD)
+        samples, result = measure(lambda: client.send("list"), self.args.commands)
+        self.log("rcon_roundtrip", latencies(samples))
+
+        commands = [ "list" ] * self.args.commands
+        durations, responses = measure(lambda: client.sendMany(commands), self.args.runs)
+        self.log("rcon_pipelined", summary(durations, commands_per_s=round(len(commands) / statistics.median(durations))))
+        client.close()
+
+        # the wrapper side: asRcon on the pool of persistent connections, from several threads
+        mcServer = minecraft.MinecraftServer(serverArgs(self.root))
+        stopped = attachJvm(mcServer, port)
+        samples, result = measure(lambda: mcServer.asRcon("tick query"), self.args.commands)
+        self.log("rcon_asrcon", latencies(samples))
+
+        def concurrent():
+            perThread = self.args.commands // self.args.rcon_threads
+            threads = [ threading.Thread(target=lambda: [ mcServer.asRcon("list") for i in range(perThread) ]) for t in range(self.args.rcon_threads) ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        durations, result = measure(concurrent, self.args.runs)
+        self.log("rcon_pool_concurrent", summary(durations, threads=self.args.rcon_threads, commands_per_s=round(self.args.commands // self.args.rcon_threads * self.args.rcon_threads / statistics.median(durations))))
+        stopped.set()
+        mcServer.rcon.close()
+
+    def benchCli(self, port):
+        print("cli cold start", flush=True)
+        for name, command in [ ("cli_client_status", [ "client.py", "--rcon-port", str(port), "--rcon-pswd", RCON_PASSWORD, "status" ]),
+                               ("cli_minecraft_help", [ "minecraft.py", "--help" ]) ]:
+            durations, result = measure(lambda: subprocess.run([ sys.executable ] + command, cwd=RESOURCES, stdout=subprocess.DEVNULL, check=True), self.args.runs)
+            self.log(name, summary(durations))
+
+    def run(self):
+        selected = set(self.args.only.split(",")) if self.args.only else None
+        jvm, port = startFakeJvm(self.args.jvm_delay / 1000.0)
+        try:
+            world = None
+            if not selected or selected & { "backup", "load", "transfer", "world" }:
+                world = self.generate()
+                if not selected or "backup" in selected:
+                    self.benchBackup(port)
+                if not selected or "load" in selected:
+                    self.benchLoad()
+                if not selected or "transfer" in selected:
+                    self.benchTransfer()
+                if not selected or "world" in selected:
+                    self.benchWorld()
+            if not selected or "rcon" in selected:
+                self.benchRcon(port)
+            if not selected or "cli" in selected:
+                self.benchCli(port)
+        finally:
+            jvm.shutdown()
+            if not self.args.keep and not self.args.workdir:
+                shutil.rmtree(self.root, ignore_errors=True)
+        return {
+            "date": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "version": gitVersion(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "params": { "regions": self.args.regions, "chunks": self.args.chunks, "players": self.args.players, "seed": self.args.seed, "runs": self.args.runs,
+                        "codec": self.args.codec, "threads": self.args.threads, "commands": self.args.commands, "jvm_delay_ms": self.args.jvm_delay },
+            "world": world,
+            "results": self.results,
+        }
+
+def gitVersion():
+    try:
+        return subprocess.run([ "git", "describe", "--always", "--dirty", "--tags" ], cwd=BENCHMARKS, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(baseline, current):
+    """Print the change of the median of each benchmark. A positive change is slower"""
+    print("comparison with {0} ({1})".format(baseline.get("version"), baseline.get("date")))
+    for name, result in current["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if not before:
+            continue
+        change = (result["median"] - before["median"]) / before["median"] * 100 if before["median"] else 0
+        print("  {0:<28} {1:>10.4f}s -> {2:>10.4f}s  {3:+7.1f}%".format(name, before["median"], result["median"], change))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--regions", default=8, type=int, help="the number of region files of the world")
+    parser.add_argument("--chunks", default=1024, type=int, help="the number of chunks per region file")
+    parser.add_argument("--players", default=20, type=int, help="the number of players of the world")
+    parser.add_argument("--seed", default=1, type=int, help="the seed of the world")
+    parser.add_argument("--runs", default=3, type=int, help="the number of runs of each benchmark")
+    parser.add_argument("--codec", default="gzip", help="the compression of the archives")
+    parser.add_argument("--threads", default=os.cpu_count() or 1, type=int, help="the number of compression threads")
+    parser.add_argument("--touch-regions", default=2, type=int, help="incremental benchmarks: the number of region files modified before each run")
+    parser.add_argument("--touch-chunks", default=32, type=int, help="incremental benchmarks: the number of chunks modified per region file")
+    parser.add_argument("--commands", default=1000, type=int, help="rcon: the number of commands")
+    parser.add_argument("--rcon-threads", default=4, type=int, help="rcon: the number of threads sharing the pool of connections")
+    parser.add_argument("--jvm-delay", default=0, type=float, help="rcon: the time taken by the fake jvm to run a command, in milliseconds")
+    parser.add_argument("--only", default="", help="a comma separated list of benchmarks to run: backup, load, transfer, world, rcon, cli")
+    parser.add_argument("--workdir", default="", help="where to generate the world. A temporary directory (removed at the end) by default")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary directory")
+    parser.add_argument("--output", default="", help="write the results to this JSON file")
+    parser.add_argument("--compare", default="", help="compare the results to this JSON file of a previous run")
+    args = parser.parse_args()
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+
+    results = Suite(args).run()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print("results written to {0}".format(args.output))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,282 @@
+#!/usr/bin/python3
+"""
+Synthetic minecraft worlds for the benchmarks.
+The world looks like a world of a 1.20 server: region files (.mca) of zlib compressed NBT chunks with 24 sections
+of paletted block states, a level.dat and the playerdata, stats and advancements of the players.
+The chunks are built from a few templates of sections that are slightly modified for each chunk, so the chunks
+compress like real ones (~10KB each, 3 sectors) while being generated quickly (~3s per region file of 1024 chunks).
+The same seed always generates the same world.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import random
+import struct
+import sys
+import time
+import uuid
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "resources"))
+import anvil
+import nbt
+
+DATA_VERSION = 3465
+VERSION_NAME = "1.20.1"
+# sections -4 to 19 (y -64 to 319)
+MIN_SECTION = -4
+MAX_SECTION = 19
+SURFACE_SECTION = 4
+TEMPLATES_PER_LEVEL = 6
+
+def _pack(indexes, bits):
+    """Pack the palette indexes in longs like the game: no value spans two longs"""
+    perLong = 64 // bits
+    packed = []
+    for i in range(0, len(indexes), perLong):
+        value = 0
+        for j, index in enumerate(indexes[i:i + perLong]):
+            value |= index << (j * bits)
+        packed.append(value - (1 << 64) if value >= (1 << 63) else value)
+    return packed
+
+class WorldGenerator:
+
+    def __init__(self, seed=1):
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.templates = { y: [ self._section(y) for i in range(TEMPLATES_PER_LEVEL) ] for y in range(MIN_SECTION, MAX_SECTION + 1) }
+
+    def _section(self, y):
+        """
+        A template of section: its encoded payload and the offset and count of the longs of its block states
+        (modified for each chunk). The count is 0 for a section of air.
+        """
+        rng = self.random
+        section = { "Y": nbt.byte(y), "biomes": { "palette": [ "minecraft:plains" ] } }
+        if y > SURFACE_SECTION:
+            section["block_states"] = { "palette": [ { "Name": "minecraft:air" } ] }
+            section["SkyLight"] = b"\xff" * 2048
+            return nbt.encodePayload(section), 0, 0
+        if y == SURFACE_SECTION:
+            palette = [ "minecraft:air", "minecraft:grass_block", "minecraft:dirt", "minecraft:stone", "minecraft:grass", "minecraft:oak_log", "minecraft:oak_leaves", "minecraft:water" ]
+            heights = [ 6 + rng.randint(-2, 2) for i in range(256) ]
+            indexes = []
+            for by in range(16):
+                for column in range(256):
+                    h = heights[column]
+                    if by < h - 3:
+                        indexes.append(3)
+                    elif by < h:
+                        indexes.append(2)
+                    elif by == h:
+                        indexes.append(1)
+                    elif by == h + 1 and rng.random() < 0.1:
+                        indexes.append(4)
+                    elif by > h and column % 37 == 0 and by < h + 6:
+                        indexes.append(5)
+                    else:
+                        indexes.append(0)
+        else:
+            base = "minecraft:deepslate" if y < 0 else "minecraft:stone"
+            ores = [ "minecraft:coal_ore", "minecraft:iron_ore", "minecraft:copper_ore", "minecraft:gold_ore", "minecraft:redstone_ore", "minecraft:diamond_ore", "minecraft:lapis_ore" ]
+            palette = [ base, "minecraft:cave_air", "minecraft:andesite", "minecraft:granite", "minecraft:diorite", "minecraft:gravel", "minecraft:tuff" ] + rng.sample(ores, 3)
+            indexes = [ 0 ] * 4096
+            # blobs of stone variants and ores, and a few caves
+            for i in range(rng.randint(20, 40)):
+                block = rng.randint(1, len(palette) - 1)
+                size = rng.randint(2, 6) if block > 1 else rng.randint(3, 9)
+                cx, cy, cz = rng.randrange(16), rng.randrange(16), rng.randrange(16)
+                for bx in range(max(0, cx - size // 2), min(16, cx + size // 2 + 1)):
+                    for by in range(max(0, cy - size // 2), min(16, cy + size // 2 + 1)):
+                        for bz in range(max(0, cz - size // 2), min(16, cz + size // 2 + 1)):
+                            if rng.random() < 0.7:
+                                indexes[(by * 16 + bz) * 16 + bx] = block
+        bits = max(4, (len(palette) - 1).bit_length())
+        data = _pack(indexes, bits)
+        section["block_states"] = { "palette": [ { "Name": name } for name in palette ], "data": nbt.longs(data) }
+        section["BlockLight"] = bytes(2048)
+        if y == SURFACE_SECTION:
+            section["SkyLight"] = bytes(b & 0xf0 for b in rng.randbytes(2048))
+        payload = nbt.encodePayload(section)
+        packed = struct.pack(">{0}q".format(len(data)), *data)
+        return payload, payload.index(packed), len(data)
+
+    def chunk(self, x, z, rng=None):
+        """The NBT of the chunk x, z"""
+        rng = rng or self.random
+        sections = bytearray(struct.pack(">bi", nbt.TAG_COMPOUND, MAX_SECTION - MIN_SECTION + 1))
+        for y in range(MIN_SECTION, MAX_SECTION + 1):
+            payload, offset, count = rng.choice(self.templates[y])
+            start = len(sections)
+            sections += payload
+            # the changes of the players and the differences between the chunks
+            for i in range(rng.randint(4, 16) if count else 0):
+                pos = start + offset + 8 * rng.randrange(count)
+                sections[pos:pos + 8] = rng.randbytes(8)
+        heights = _pack([ 128 + rng.randint(-3, 3) for i in range(256) ], 9)
+        return nbt.encode({
+            "DataVersion": DATA_VERSION,
+            "xPos": x,
+            "yPos": MIN_SECTION,
+            "zPos": z,
+            "Status": "minecraft:full",
+            "LastUpdate": nbt.long(rng.randint(100000, 10000000)),
+            "InhabitedTime": nbt.long(rng.randint(0, 100000)),
+            "isLightOn": nbt.byte(1),
+            "sections": nbt.Raw(nbt.TAG_LIST, bytes(sections)),
+            "Heightmaps": { "MOTION_BLOCKING": nbt.longs(heights), "WORLD_SURFACE": nbt.longs(heights), "OCEAN_FLOOR": nbt.longs(heights) },
+            "block_entities": [],
+            "block_ticks": [],
+            "fluid_ticks": [],
+            "PostProcessing": [],
+            "structures": { "References": {}, "starts": {} },
+        })
+
+    def rawChunk(self, x, z, rng=None):
+        """The chunk x, z as stored in a region file: length, compression type (zlib) and data"""
+        data = zlib.compress(self.chunk(x, z, rng))
+        return struct.pack(">ib", len(data) + 1, 2) + data
+
+    def region(self, path, rx, rz, chunks=anvil.CHUNK_COUNT):
+        """Write the region rx, rz with its first chunks (in the generation order of a spiral)"""
+        now = int(time.time())
+        with anvil.RegionWriter(path) as region:
+            for index in _spiral()[:chunks]:
+                x, z = rx * 32 + index % 32, rz * 32 + index // 32
+                region.writeChunk(index, self.rawChunk(x, z), now - self.random.randint(0, 30 * 86400))
+
+    def levelDat(self, path, levelName):
+        rng = self.random
+        data = nbt.encode({ "Data": {
+            "DataVersion": DATA_VERSION,
+            "LevelName": levelName,
+            "Version": { "Id": DATA_VERSION, "Name": VERSION_NAME, "Series": "main", "Snapshot": nbt.byte(0) },
+            "GameType": 0,
+            "Difficulty": nbt.byte(2),
+            "SpawnX": rng.randint(-200, 200),
+            "SpawnY": 64,
+            "SpawnZ": rng.randint(-200, 200),
+            "Time": nbt.long(rng.randint(0, 10000000)),
+            "DayTime": nbt.long(rng.randint(0, 24000)),
+            "LastPlayed": nbt.long(int(time.time() * 1000)),
+            "WorldGenSettings": { "seed": nbt.long(self.seed), "generate_features": nbt.byte(1), "bonus_chest": nbt.byte(0), "dimensions": {} },
+            "GameRules": { "doDaylightCycle": "true", "keepInventory": "false", "randomTickSpeed": "3" },
+            "DataPacks": { "Enabled": [ "vanilla" ], "Disabled": [] },
+            "version": 19133,
+            "initialized": nbt.byte(1),
+        } })
+        with gzip.open(path, "wb") as f:
+            f.write(data)
+
+    def player(self, worldDir, playerId):
+        rng = self.random
+        items = [ "minecraft:diamond_pickaxe", "minecraft:torch", "minecraft:cobblestone", "minecraft:bread", "minecraft:oak_planks", "minecraft:iron_ingot" ]
+        data = nbt.encode({
+            "DataVersion": DATA_VERSION,
+            "Pos": [ rng.uniform(-500, 500), rng.uniform(60, 120), rng.uniform(-500, 500) ],
+            "Motion": [ 0.0, 0.0, 0.0 ],
+            "Rotation": [ nbt.Tag(nbt.TAG_FLOAT, rng.uniform(0, 360)), nbt.Tag(nbt.TAG_FLOAT, rng.uniform(-90, 90)) ],
+            "Health": nbt.Tag(nbt.TAG_FLOAT, 20.0),
+            "foodLevel": 20,
+            "XpLevel": rng.randint(0, 50),
+            "XpTotal": rng.randint(0, 5000),
+            "playerGameType": 0,
+            "Dimension": "minecraft:overworld",
+            "Inventory": [ { "Slot": nbt.byte(slot), "id": rng.choice(items), "Count": nbt.byte(rng.randint(1, 64)) } for slot in range(rng.randint(5, 36)) ],
+            "EnderItems": [],
+            "UUID": nbt.Tag(nbt.TAG_INT_ARRAY, list(struct.unpack(">4i", playerId.bytes))),
+        })
+        with gzip.open(os.path.join(worldDir, "playerdata", "{0}.dat".format(playerId)), "wb") as f:
+            f.write(data)
+        stats = { "stats": { "minecraft:custom": { "minecraft:play_time": rng.randint(0, 10000000), "minecraft:jump": rng.randint(0, 10000) },
+                             "minecraft:mined": { "minecraft:stone": rng.randint(0, 100000), "minecraft:dirt": rng.randint(0, 10000) } }, "DataVersion": DATA_VERSION }
+        with open(os.path.join(worldDir, "stats", "{0}.json".format(playerId)), "w") as f:
+            json.dump(stats, f)
+        advancements = { "minecraft:story/root": { "criteria": { "crafting_table": "2023-06-12 10:00:00 +0000" }, "done": True }, "DataVersion": DATA_VERSION }
+        with open(os.path.join(worldDir, "advancements", "{0}.json".format(playerId)), "w") as f:
+            json.dump(advancements, f)
+
+    def generate(self, serverDir, regions=4, chunks=anvil.CHUNK_COUNT, players=10, levelName="world"):
+        """
+        Generate a server directory: server.properties and the world levelName with regions region files
+        of chunks chunks each and players players. Returns the description of the world.
+        """
+        worldDir = os.path.join(serverDir, levelName)
+        for d in [ "region", "playerdata", "stats", "advancements", "data" ]:
+            os.makedirs(os.path.join(worldDir, d), exist_ok=True)
+        with open(os.path.join(serverDir, "server.properties"), "w") as f:
+            f.write("level-name={0}\n".format(levelName))
+        self.levelDat(os.path.join(worldDir, "level.dat"), levelName)
+        # the regions around the spawn
+        coords = sorted([ (x, z) for x in range(-8, 8) for z in range(-8, 8) ], key=lambda c: (max(abs(c[0] + 0.5), abs(c[1] + 0.5)), c))[:regions]
+        for rx, rz in coords:
+            self.region(os.path.join(worldDir, "region", "r.{0}.{1}.mca".format(rx, rz)), rx, rz, chunks)
+        for i in range(players):
+            self.player(worldDir, uuid.UUID(int=self.random.getrandbits(128), version=4))
+        return describe(serverDir)
+
+    def touch(self, serverDir, regions=1, chunks=32, levelName="world"):
+        """
+        Modify chunks like a running server: chunks chunks of the first regions regions are generated again and
+        saved in place (their sectors are reused when the new chunk fits). Returns the number of chunks modified.
+        """
+        regionDir = os.path.join(serverDir, levelName, "region")
+        modified = 0
+        for name in sorted(os.listdir(regionDir))[:regions]:
+            path = os.path.join(regionDir, name)
+            with anvil.RegionReader(path) as reader:
+                locations = reader.locations
+                timestamps = reader.timestamps
+            present = [ i for i in range(anvil.CHUNK_COUNT) if locations[i][0] >= 2 and locations[i][1] > 0 ]
+            with open(path, "r+b") as f:
+                end = f.seek(0, os.SEEK_END) // anvil.SECTOR_SIZE
+                for index in self.random.sample(present, min(chunks, len(present))):
+                    raw = self.rawChunk(index % 32, index // 32)
+                    offset, count = locations[index]
+                    needed = (len(raw) + anvil.SECTOR_SIZE - 1) // anvil.SECTOR_SIZE
+                    if needed > count:
+                        # does not fit: appended at the end of the file like the game does
+                        offset, count, end = end, needed, end + needed
+                    f.seek(offset * anvil.SECTOR_SIZE)
+                    f.write(raw + b"\x00" * (count * anvil.SECTOR_SIZE - len(raw)))
+                    f.seek(index * 4)
+                    f.write(struct.pack(">I", offset)[1:] + struct.pack(">B", count))
+                    f.seek(anvil.SECTOR_SIZE + index * 4)
+                    f.write(struct.pack(">i", int(time.time())))
+                    modified += 1
+        return modified
+
+def _spiral():
+    """The chunk indexes of a region from its center"""
+    return sorted(range(anvil.CHUNK_COUNT), key=lambda i: (max(abs(i % 32 - 15.5), abs(i // 32 - 15.5)), i))
+
+def describe(serverDir):
+    files = 0
+    size = 0
+    regions = 0
+    for root, dirnames, filenames in os.walk(serverDir):
+        for f in filenames:
+            files += 1
+            size += os.path.getsize(os.path.join(root, f))
+            regions += f.endswith(".mca")
+    return { "files": files, "size": size, "regions": regions }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output", help="the server directory to generate")
+    parser.add_argument("--regions", default=4, type=int, help="the number of region files")
+    parser.add_argument("--chunks", default=anvil.CHUNK_COUNT, type=int, help="the number of chunks per region file (1024 max)")
+    parser.add_argument("--players", default=10, type=int, help="the number of players")
+    parser.add_argument("--seed", default=1, type=int, help="the seed of the world")
+    args = parser.parse_args()
+    start = time.monotonic()
+    world = WorldGenerator(args.seed).generate(args.output, args.regions, min(args.chunks, anvil.CHUNK_COUNT), args.players)
+    world["seconds"] = round(time.monotonic() - start, 3)
+    print(json.dumps(world))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+"""
+Anvil region files (.mca)
+A region file stores 32x32 chunks:
+    - 4KiB of locations: for each chunk 3 bytes for the offset (in 4KiB sectors) and 1 byte for the sector count
+    - 4KiB of timestamps: for each chunk the time of its last save (big endian int, seconds)
+    - the chunks: a 4 bytes length, 1 byte for the compression type and the compressed data
+      (a chunk too big for the region file is stored in a c.<x>.<z>.mcc file next to it, its compression type has the bit 128)
+(https://minecraft.wiki/w/Region_file_format)
+"""
+
+import gzip
+import os
+import re
+import struct
+import zlib
+
+SECTOR_SIZE = 4096
+CHUNK_COUNT = 1024
+HEADER_SIZE = 2 * SECTOR_SIZE
+COMPRESSION_GZIP = 1
+COMPRESSION_ZLIB = 2
+COMPRESSION_NONE = 3
+EXTERNAL = 0x80
+REGION_NAME_PATTERN = re.compile(r"^r\.(-?\d+)\.(-?\d+)\.mca$")
+
+class RegionError(Exception):
+    """For region file error management"""
+
+    def __init__(self, *args):
+        if args :
+            self.message = args[0]
+        else:
+            self.message = None
+
+    def __str__(self):
+        if self.message:
+            return 'Error: {0}'.format(self.message)
+        else:
+            return 'Region error'
+
+class RegionReader:
+    """
+    Read the header and the raw chunks of a region file.
+    A raw chunk is returned as stored in the file: length, compression type and compressed data.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            header = self.file.read(HEADER_SIZE)
+            if len(header) != HEADER_SIZE:
+                raise RegionError("{0} is not a region file: header too short".format(path))
+            self.locations = []
+            for i in range(CHUNK_COUNT):
+                offset, count = struct.unpack_from(">IB", b"\x00" + header[i*4:i*4+4])
+                self.locations.append((offset, count))
+            self.timestamps = list(struct.unpack_from(">{0}i".format(CHUNK_COUNT), header, SECTOR_SIZE))
+        except:
+            self.file.close()
+            raise
+
+    def hasChunk(self, index):
+        offset, count = self.locations[index]
+        return offset >= 2 and count > 0
+
+    def _readLength(self, index):
+        offset, count = self.locations[index]
+        self.file.seek(offset * SECTOR_SIZE)
+        head = self.file.read(4)
+        if len(head) != 4:
+            raise RegionError("{0}: chunk {1} is out of the file".format(self.path, index))
+        length = struct.unpack(">i", head)[0]
+        if length <= 0 or length + 4 > count * SECTOR_SIZE:
+            raise RegionError("{0}: chunk {1} has an invalid length {2}".format(self.path, index, length))
+        return head, length
+
+    def chunkSize(self, index):
+        """
+        The size of the raw chunk at index (as returned by readChunk) or None if the chunk was never generated.
+        Only the length of the chunk is read.
+        """
+        if not self.hasChunk(index):
+            return None
+        return self._readLength(index)[1] + 4
+
+    def readChunk(self, index):
+        """
+        Returns the raw chunk at index or None if the chunk was never generated.
+        """
+        if not self.hasChunk(index):
+            return None
+        head, length = self._readLength(index)
+        data = self.file.read(length)
+        if len(data) != length:
+            raise RegionError("{0}: chunk {1} is truncated".format(self.path, index))
+        return head + data
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class RegionWriter:
+    """
+    Write a region file without fragmentation: the chunks are written one after the other in the order of the calls to writeChunk.
+    The header is written on close.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "wb")
+        self.locations = [ (0, 0) ] * CHUNK_COUNT
+        self.timestamps = [ 0 ] * CHUNK_COUNT
+        self.sector = 2
+        self.file.write(b"\x00" * HEADER_SIZE)
+
+    def writeChunk(self, index, raw, timestamp):
+        count = (len(raw) + SECTOR_SIZE - 1) // SECTOR_SIZE
+        if count > 255:
+            raise RegionError("{0}: chunk {1} is too big ({2} bytes)".format(self.path, index, len(raw)))
+        self.file.write(raw)
+        self.file.write(b"\x00" * (count * SECTOR_SIZE - len(raw)))
+        self.locations[index] = (self.sector, count)
+        self.timestamps[index] = timestamp
+        self.sector += count
+
+    def close(self):
+        if self.file.closed:
+            return
+        header = bytearray()
+        for offset, count in self.locations:
+            header += struct.pack(">I", offset)[1:] + struct.pack(">B", count)
+        header += struct.pack(">{0}i".format(CHUNK_COUNT), *self.timestamps)
+        self.file.seek(0)
+        self.file.write(header)
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def externalPath(regionPath, index):
+    """The path of the .mcc file of the chunk at index of a region file (r.<x>.<z>.mca)"""
+    match = REGION_NAME_PATTERN.match(os.path.basename(regionPath))
+    if not match:
+        raise RegionError("{0} is not named like a region file".format(regionPath))
+    x = int(match.group(1)) * 32 + index % 32
+    z = int(match.group(2)) * 32 + index // 32
+    return os.path.join(os.path.dirname(regionPath), "c.{0}.{1}.mcc".format(x, z))
+
+def chunkData(regionPath, index, raw):
+    """The uncompressed NBT of the raw chunk at index of the region file"""
+    compression = raw[4]
+    data = raw[5:]
+    if compression & EXTERNAL:
+        with open(externalPath(regionPath, index), "rb") as f:
+            data = f.read()
+        compression &= ~EXTERNAL
+    if compression == COMPRESSION_ZLIB:
+        return zlib.decompress(data)
+    if compression == COMPRESSION_GZIP:
+        return gzip.decompress(data)
+    if compression == COMPRESSION_NONE:
+        return data
+    raise RegionError("{0}: chunk {1} has an unsupported compression {2}".format(regionPath, index, compression))
+
+def compact(path, drop=(), dryRun=False):
+    """
+    Rewrite the region file without its free sectors, and without the chunks whose index is in drop.
+    The file is removed when no chunk is left. Nothing is written with dryRun.
+    Returns the size of the file before and after, the number of chunks kept and dropped.
+    """
+    sizeBefore = os.path.getsize(path)
+    with RegionReader(path) as reader:
+        chunks = [ (i, reader.readChunk(i), reader.timestamps[i]) for i in range(CHUNK_COUNT) if reader.hasChunk(i) ]
+    kept = [ c for c in chunks if c[0] not in drop ]
+    dropped = [ c for c in chunks if c[0] in drop ]
+    sizeAfter = HEADER_SIZE + sum((len(raw) + SECTOR_SIZE - 1) // SECTOR_SIZE * SECTOR_SIZE for i, raw, timestamp in kept) if kept else 0
+    res = { "bytes_before": sizeBefore, "bytes_after": sizeAfter, "chunks": len(kept), "chunks_dropped": len(dropped), "rewritten": False, "removed": False }
+    if dryRun or (sizeAfter == sizeBefore and not dropped):
+        return res
+    if kept:
+        # written next to the region file and renamed: an interrupted compaction never leaves a truncated region
+        partPath = "{0}.part".format(path)
+        try:
+            with RegionWriter(partPath) as writer:
+                for i, raw, timestamp in kept:
+                    writer.writeChunk(i, raw, timestamp)
+            os.replace(partPath, path)
+        finally:
+            if os.path.isfile(partPath):
+                os.remove(partPath)
+        res["rewritten"] = True
+    else:
+        os.remove(path)
+        res["removed"] = True
+    for i, raw, timestamp in dropped:
+        if raw[4] & EXTERNAL and os.path.isfile(externalPath(path, i)):
+            os.remove(externalPath(path, i))
+    return res
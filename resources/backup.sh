@@ -1,7 +0,0 @@
-#!/bin/bash
-
-# Backup minecraft world
-minecraft backup
-
-
-# End of script
@@ -0,0 +1,259 @@
+"""
+Compression codecs of the backup archives.
+    - gzip: parallel gzip (pgzip), always available
+    - xz: lzma of the standard library, always available. Slow but the best ratio
+    - zstd: requires the zstandard module. Multi-threaded, a much better speed to ratio tradeoff than gzip
+    - lz4: requires the lz4 module. The fastest, the lowest ratio
+    - none: a plain tar
+The archives are named <backup>.tar.<extension> and the codec of an archive is detected from its magic bytes on restore.
+"""
+
+import lzma
+import re
+import time
+import zlib
+import pgzip
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+ARCHIVE_PATTERN = re.compile(r"\.tar(\.(gz|zst|xz|lz4))?$")
+MAGIC_SIZE = 6
+READ_SIZE = 1024 * 1024
+
+class CodecError(Exception):
+    """For codec error management"""
+
+    def __init__(self, *args):
+        if args :
+            self.message = args[0]
+        else:
+            self.message = None
+
+    def __str__(self):
+        if self.message:
+            return 'Error: {0}'.format(self.message)
+        else:
+            return 'Codec error'
+
+class PassThrough:
+    """A file object that writes to fileobj and is closed without closing fileobj"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    def write(self, data):
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def close(self):
+        pass
+
+class CountingWriter:
+    """A write only file object that counts the bytes written to fileobj"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.size = 0
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+class PeekReader:
+    """A read only file object that reads again the bytes already peeked from fileobj"""
+
+    def __init__(self, fileobj, head):
+        self.fileobj = fileobj
+        self.head = head
+
+    def read(self, size=-1):
+        if not self.head:
+            return self.fileobj.read(size)
+        if size is None or size < 0:
+            data = self.head + self.fileobj.read()
+            self.head = b""
+            return data
+        data = self.head[:size]
+        self.head = self.head[size:]
+        if len(data) < size:
+            data += self.fileobj.read(size - len(data))
+        return data
+
+class Codec:
+    """
+    A compression codec.
+    writer(fileobj, level, threads) returns a write only file object, its close() does not close fileobj.
+    reader(fileobj) returns a read only file object of the decompressed data.
+    """
+
+    def __init__(self, name, extension, magic, defaultLevel, levels, writer, reader, module=None):
+        self.name = name
+        self.extension = extension
+        self.magic = magic
+        self.defaultLevel = defaultLevel
+        self.levels = levels
+        self._writer = writer
+        self._reader = reader
+        self.module = module
+
+    def available(self):
+        return self.module is None or globals()[self.module.split(".")[0]] is not None
+
+    def _check(self):
+        if not self.available():
+            raise CodecError("the {0} codec requires the python module {1}".format(self.name, self.module))
+
+    def suffix(self):
+        return ".tar.{0}".format(self.extension) if self.extension else ".tar"
+
+    def writer(self, fileobj, level=None, threads=None):
+        self._check()
+        level = self.defaultLevel if level is None else level
+        if self.levels and not (self.levels[0] <= level <= self.levels[1]):
+            raise CodecError("invalid level {0} for {1}. Expected {2} to {3}".format(level, self.name, self.levels[0], self.levels[1]))
+        return self._writer(fileobj, level, threads)
+
+    def reader(self, fileobj):
+        self._check()
+        return self._reader(fileobj)
+
+def _zstdWriter(fileobj, level, threads):
+    return zstandard.ZstdCompressor(level=level, threads=threads if threads else -1).stream_writer(fileobj, closefd=False)
+
+def _lz4Writer(fileobj, level, threads):
+    return lz4.frame.LZ4FrameFile(fileobj, mode="wb", compression_level=level)
+
+CODECS = { c.name: c for c in [
+    Codec("gzip", "gz", b"\x1f\x8b", 6, (1, 9), lambda f, level, threads: pgzip.ParallelGzipWriter(f, level=level, threads=threads), lambda f: GzipReader(f)),
+    Codec("zstd", "zst", b"\x28\xb5\x2f\xfd", 3, (1, 22), _zstdWriter, lambda f: zstandard.ZstdDecompressor().stream_reader(f, closefd=False), "zstandard"),
+    Codec("xz", "xz", b"\xfd7zXZ\x00", 6, (0, 9), lambda f, level, threads: lzma.LZMAFile(f, mode="wb", preset=level), lambda f: lzma.LZMAFile(f, mode="rb")),
+    Codec("lz4", "lz4", b"\x04\x22\x4d\x18", 0, (0, 16), _lz4Writer, lambda f: lz4.frame.LZ4FrameFile(f, mode="rb"), "lz4.frame"),
+    Codec("none", "", None, None, None, lambda f, level, threads: PassThrough(f), lambda f: f),
+] }
+NAMES = list(CODECS)
+
+class GzipReader:
+    """
+    Streaming gzip decompression of a non seekable file object.
+    Unlike gzip.GzipFile it does not need to seek and reads the concatenated gzip members.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        # the decompressed data not read yet starts at offset: a read does not copy the rest of the buffer
+        self.buffer = bytearray()
+        self.offset = 0
+        self.eof = False
+
+    def read(self, size=-1):
+        while not self.eof and (size is None or size < 0 or len(self.buffer) - self.offset < size):
+            data = self.decompressor.unused_data or self.fileobj.read(READ_SIZE)
+            if self.decompressor.unused_data:
+                # the next gzip member
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            if not data:
+                self.eof = True
+                self.buffer += self.decompressor.flush()
+                break
+            self.buffer += self.decompressor.decompress(data)
+        end = len(self.buffer) if size is None or size < 0 else min(len(self.buffer), self.offset + size)
+        data = bytes(self.buffer[self.offset:end])
+        self.offset = end
+        if self.offset * 2 >= len(self.buffer):
+            # the data read is dropped once it is at least half of the buffer, the moves stay linear in the size read
+            del self.buffer[:self.offset]
+            self.offset = 0
+        return data
+
+def get(name):
+    if name not in CODECS:
+        raise CodecError("unknown codec {0}. Expected one of {1}".format(name, ", ".join(NAMES)))
+    return CODECS[name]
+
+def isArchive(name):
+    return ARCHIVE_PATTERN.search(name) is not None
+
+def archiveBase(name):
+    """The name of an archive without its .tar.<extension>"""
+    return ARCHIVE_PATTERN.sub("", name)
+
+def detect(head):
+    """The codec of an archive from its first bytes. A plain tar if no magic matches"""
+    for codec in CODECS.values():
+        if codec.magic and head.startswith(codec.magic):
+            return codec
+    return CODECS["none"]
+
+def openReader(fileobj):
+    """Detect the codec of the archive read from fileobj. Returns the codec and the decompressed stream"""
+    head = fileobj.read(MAGIC_SIZE)
+    codec = detect(head)
+    return codec, codec.reader(PeekReader(fileobj, head))
+
+def benchmark(sample, codec, level=None, threads=None):
+    """
+    Compress and decompress sample (bytes) with codec.
+    Returns the compression and decompression speeds (MB/s of uncompressed data) and the ratio.
+    """
+    class Sink:
+        def __init__(self):
+            self.parts = []
+        def write(self, data):
+            self.parts.append(bytes(data))
+            return len(data)
+        def flush(self):
+            pass
+
+    sink = Sink()
+    start = time.perf_counter()
+    writer = codec.writer(sink, level, threads)
+    for offset in range(0, len(sample), READ_SIZE):
+        writer.write(sample[offset:offset + READ_SIZE])
+    writer.close()
+    compressSeconds = time.perf_counter() - start
+    compressed = b"".join(sink.parts)
+
+    class Source:
+        def __init__(self, data):
+            self.data = memoryview(data)
+            self.offset = 0
+        def read(self, size=-1):
+            end = len(self.data) if size is None or size < 0 else self.offset + size
+            data = bytes(self.data[self.offset:end])
+            self.offset += len(data)
+            return data
+
+    start = time.perf_counter()
+    reader = codec.reader(Source(compressed))
+    size = 0
+    while True:
+        data = reader.read(READ_SIZE)
+        if not data:
+            break
+        size += len(data)
+    decompressSeconds = time.perf_counter() - start
+    if size != len(sample):
+        raise CodecError("{0} benchmark: {1} bytes decompressed instead of {2}".format(codec.name, size, len(sample)))
+    mb = len(sample) / 1048576
+    return {
+        "codec": codec.name,
+        "level": codec.defaultLevel if level is None else level,
+        "compress_mb_per_s": round(mb / max(compressSeconds, 1e-6), 1),
+        "decompress_mb_per_s": round(mb / max(decompressSeconds, 1e-6), 1),
+        "ratio": round(len(sample) / max(len(compressed), 1), 3),
+    }
@@ -0,0 +1,85 @@
+"""
+Catalog of the backup archives.
+A catalog.json file is kept next to the archives, locally and on the remote.
+Each entry records the name, size, sha256, level name, server version and creation time of an archive.
+The latest backup is found with a single small read and a copy of an archive can be verified against its entry.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+FILE_NAME = "catalog.json"
+CATALOG_VERSION = 1
+
+def newEntry(name, size, sha256, level, version, created=None):
+    return { "name": name, "size": size, "sha256": sha256, "level": level, "version": version, "created": created if created else time.time() }
+
+class Catalog:
+
+    def __init__(self, entries=None):
+        self.entries = { e["name"]: e for e in entries } if entries else {}
+
+    @staticmethod
+    def loads(data):
+        if not data:
+            return Catalog()
+        return Catalog(json.loads(data)["backups"])
+
+    def dumps(self):
+        return json.dumps({ "version": CATALOG_VERSION, "backups": self.list() }, indent=1)
+
+    @staticmethod
+    def load(directory):
+        path = os.path.join(directory, FILE_NAME)
+        if not os.path.isfile(path):
+            return Catalog()
+        with open(path, "r") as f:
+            return Catalog.loads(f.read())
+
+    def save(self, directory):
+        path = os.path.join(directory, FILE_NAME)
+        with open("{0}.part".format(path), "w") as f:
+            f.write(self.dumps())
+        os.rename("{0}.part".format(path), path)
+
+    def add(self, entry):
+        self.entries[entry["name"]] = entry
+
+    def remove(self, name):
+        self.entries.pop(name, None)
+
+    def get(self, name):
+        return self.entries.get(name)
+
+    def list(self):
+        """The entries, oldest first"""
+        return sorted(self.entries.values(), key=lambda e: (e["created"], e["name"]))
+
+    def latest(self):
+        entries = self.list()
+        if not entries:
+            return None
+        return entries[-1]
+
+    def prune(self, directory):
+        """Remove the entries whose archive is not in directory anymore"""
+        for name in [ n for n in self.entries if not os.path.isfile(os.path.join(directory, n)) ]:
+            self.remove(name)
+
+    @staticmethod
+    def verify(path, entry):
+        """
+        Check that the file at path matches the entry: the size first and then the sha256.
+        """
+        if not entry or not os.path.isfile(path) or os.path.getsize(path) != entry["size"]:
+            return False
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            while True:
+                data = f.read(1024 * 1024)
+                if not data:
+                    break
+                sha.update(data)
+        return sha.hexdigest() == entry["sha256"]
@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+"""
+Lightweight command line client of the wrapper: this is the `minecraft` command.
+The client actions (status, backup, command, ...) only import the RCON layer and send the action to the wrapper.
+Anything else (serve, --help, an option of the server) is handed over to minecraft.py with the same arguments.
+"""
+
+import os
+import sys
+
+CLIENT_ACTIONS = ("start", "stop", "backup", "status", "health_status", "command", "property", "config", "set-version", "logs", "perf", "batch", "schedule", "prune", "hibernate", "pregen", "world", "load")
+FORMAT = '%(asctime)-15s [%(name)s][%(levelname)s]: %(message)s'
+
+def parseArgs(argv):
+    """
+    Parse the arguments of a client action.
+    Returns None if the arguments are not for the client, they must then be parsed by minecraft.py
+    """
+    opts = { "action": None, "args": [], "rcon_port": os.getenv("MC_RCON_PORT", "25575"), "rcon_pswd": os.getenv("MC_RCON_PSWD", "rcon-passwd"), "tail": 20, "follow": False, "dry_run": False, "benchmark": False, "min_inhabited": None, "level": None }
+    valued = { "--rcon-port": "rcon_port", "--rcon-pswd": "rcon_pswd", "--tail": "tail", "--min-inhabited": "min_inhabited" }
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        i += 1
+        if arg in ("-v", "--verbose"):
+            opts["level"] = opts["level"] or "INFO"
+        elif arg in ("-vv", "--very-verbose"):
+            opts["level"] = "DEBUG"
+        elif arg == "--follow":
+            opts["follow"] = True
+        elif arg == "--dry-run":
+            opts["dry_run"] = True
+        elif arg == "--benchmark":
+            opts["benchmark"] = True
+        elif arg.split("=", 1)[0] in valued:
+            name, eq, value = arg.partition("=")
+            if not eq:
+                if i >= len(argv):
+                    return None
+                value = argv[i]
+                i += 1
+            opts[valued[name]] = value
+        elif arg.startswith("-") and len(arg) > 1 and not arg[1:].lstrip("-").replace(".", "").isdigit():
+            return None
+        elif opts["action"] is None:
+            opts["action"] = arg
+        else:
+            opts["args"].append(arg)
+    if opts["action"] not in CLIENT_ACTIONS:
+        return None
+    try:
+        opts["rcon_port"] = int(opts["rcon_port"])
+        opts["tail"] = int(opts["tail"])
+    except ValueError:
+        return None
+    return opts
+
+def runAction(action, args, port, passwd, tail=20, follow=False, dryRun=False, benchmark=False, minInhabited=None):
+    """
+    Send a client action to the wrapper over a single RCON session. Returns the exit code.
+    """
+    import json
+    import rcon
+    try:
+        client = rcon.RCONClient("127.0.0.1", port, passwd)
+        if action == "command":
+            print(client.send(" ".join(args)))
+        elif action == "batch":
+            # one command per argument, or per line of the standard input. All of them are pipelined on the session
+            commands = args if args and args != ["-"] else [ line.strip() for line in sys.stdin if line.strip() ]
+            for response in client.sendMany(commands):
+                print(response)
+        elif action == "health_status":
+            resp = client.send("minecraft health_status")
+            print(resp)
+            resp = json.loads(resp)
+            if not resp["code"] == 200:
+                return 1
+        elif action == "logs":
+            resp = json.loads(client.send("minecraft logs --tail {0}".format(tail)))
+            print("\n".join(resp["lines"]))
+            while follow:
+                resp = json.loads(client.send("minecraft logs --follow {0}".format(resp["cursor"])))
+                if resp["lines"]:
+                    print("\n".join(resp["lines"]), flush=True)
+        elif action == "backup" and benchmark:
+            print(client.send("minecraft backup --benchmark"))
+        elif action == "prune":
+            print(client.send("minecraft prune{0}".format(" --dry-run" if dryRun else "")))
+        elif action == "world":
+            options = "{0}{1}".format(" --dry-run" if dryRun else "", " --min-inhabited {0}".format(minInhabited) if minInhabited is not None else "")
+            print(client.send("minecraft world {0}{1}".format(" ".join(args), options)))
+        elif action in ["property", "config", "set-version", "pregen", "load"]:
+            print(client.send("minecraft {action} {args}".format(action=action, args=" ".join(args))))
+        else:
+            print(client.send("minecraft {action}".format(action=action)))
+        client.close()
+        return 0
+    except KeyboardInterrupt:
+        return 130
+    except:
+        sys.stderr.write("service unavailable")
+        return 1
+
+def main(argv):
+    opts = parseArgs(argv)
+    if opts is None:
+        # not a client action: the full command line is parsed by the server module
+        server = os.path.join(os.path.dirname(os.path.realpath(__file__)), "minecraft.py")
+        os.execv(sys.executable, [sys.executable, server] + argv)
+    import logging
+    logging.basicConfig(format=FORMAT, level=opts["level"] or "WARNING")
+    return runAction(opts["action"], opts["args"], opts["rcon_port"], opts["rcon_pswd"], opts["tail"], opts["follow"], opts["dry_run"], opts["benchmark"], opts["min_inhabited"])
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,139 @@
+"""
+Capture of the console of the minecraft java server.
+The output of the JVM is read through a pipe, copied to the standard output of the wrapper (container logs),
+kept in a bounded in-memory ring buffer and written to a rotating log file.
+Some events are parsed from the console and counted:
+    - Can't keep up! Is the server overloaded? Running Xms or Y ticks behind
+    - <player> joined the game / <player> left the game
+    - Done (Xs)! For help, type "help"
+"""
+
+import logging
+import logging.handlers
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+
+MAX_LINES = 10000
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+LAG_PATTERN = re.compile(r"Can't keep up! Is the server overloaded\? Running (\d+)ms or (\d+) ticks behind")
+JOIN_PATTERN = re.compile(r"\]: (\w+) joined the game$")
+LEAVE_PATTERN = re.compile(r"\]: (\w+) left the game$")
+DONE_PATTERN = re.compile(r"\]: Done \((\d+(?:[.,]\d+)?)s\)!")
+
+class ConsoleMonitor:
+
+    def __init__(self, maxLines=MAX_LINES):
+        self.logger = logging.getLogger("CONSOLE")
+        self.lines = deque(maxlen=maxLines)
+        self.seq = 0
+        self._cond = threading.Condition()
+        self._listeners = []
+        self.counters = { "lag_events": 0, "lag_ms": 0, "lag_ticks": 0, "max_lag_ms": 0, "joins": 0, "leaves": 0, "done_seconds": None, "last_lag": None }
+        self.players = set()
+        self.fileLogger = logging.getLogger("CONSOLE-FILE")
+        self.fileLogger.propagate = False
+        self.fileLogger.setLevel(logging.INFO)
+
+    def openLog(self, logPath):
+        """(Re)open the rotating log file where the console is written"""
+        os.makedirs(os.path.dirname(logPath), exist_ok=True)
+        for h in list(self.fileLogger.handlers):
+            self.fileLogger.removeHandler(h)
+            h.close()
+        handler = logging.handlers.RotatingFileHandler(logPath, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self.fileLogger.addHandler(handler)
+
+    def addListener(self, listener):
+        """listener(event, data) is called for each event parsed from the console: lag, join, leave, done"""
+        self._listeners.append(listener)
+
+    def attach(self, stream):
+        """Start a thread reading the console from stream until its end"""
+        thread = threading.Thread(target=self._read, args=(stream,), name="console", daemon=True)
+        thread.start()
+        return thread
+
+    def _read(self, stream):
+        try:
+            for line in stream:
+                sys.stdout.write(line)
+                sys.stdout.flush()
+                self.feed(line.rstrip("\r\n"))
+        except ValueError:
+            # stream closed
+            pass
+        except:
+            self.logger.exception("error while reading the console")
+
+    def reset(self):
+        """Forget the players online, called when the server (re)starts"""
+        with self._cond:
+            self.players = set()
+
+    def feed(self, line):
+        event = None
+        with self._cond:
+            self.seq += 1
+            self.lines.append((self.seq, line))
+            match = LAG_PATTERN.search(line)
+            if match:
+                lagMs, ticks = int(match.group(1)), int(match.group(2))
+                self.counters["lag_events"] += 1
+                self.counters["lag_ms"] += lagMs
+                self.counters["lag_ticks"] += ticks
+                self.counters["max_lag_ms"] = max(self.counters["max_lag_ms"], lagMs)
+                self.counters["last_lag"] = time.time()
+                event = ("lag", { "ms": lagMs, "ticks": ticks })
+            else:
+                match = JOIN_PATTERN.search(line)
+                if match:
+                    self.counters["joins"] += 1
+                    self.players.add(match.group(1))
+                    event = ("join", { "player": match.group(1) })
+                else:
+                    match = LEAVE_PATTERN.search(line)
+                    if match:
+                        self.counters["leaves"] += 1
+                        self.players.discard(match.group(1))
+                        event = ("leave", { "player": match.group(1) })
+                    else:
+                        match = DONE_PATTERN.search(line)
+                        if match:
+                            self.counters["done_seconds"] = float(match.group(1).replace(",", "."))
+                            event = ("done", { "seconds": self.counters["done_seconds"] })
+            self._cond.notify_all()
+        self.fileLogger.info(line)
+        if event:
+            for listener in self._listeners:
+                try:
+                    listener(event[0], event[1])
+                except:
+                    self.logger.exception("console listener failed")
+
+    def tail(self, count):
+        """The last count lines and the cursor to follow the console"""
+        with self._cond:
+            lines = list(self.lines)[-count:] if count > 0 else []
+            return [ l for s, l in lines ], self.seq
+
+    def follow(self, cursor, timeout=5):
+        """
+        The lines after cursor, waits up to timeout seconds for new lines.
+        Returns the lines and the new cursor. Lines already out of the ring buffer are lost.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self.seq > cursor, timeout)
+            return [ l for s, l in self.lines if s > cursor ], self.seq
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self.counters)
+            stats["players"] = sorted(self.players)
+            return stats
@@ -3,70 +3,211 @@
 import json
 import argparse
 import urllib.request
+import urllib.error
+import urllib.parse
 import sys
 import shutil
+import hashlib
 import os.path
 import os
 
 # parse command line arguments
 parser=argparse.ArgumentParser()
-parser.add_argument("-m", "--manifest", default="https://launchermeta.mojang.com/mc/game/version_manifest.json", help="The launcher manifest to get all the available versions")
+parser.add_argument("-m", "--manifest", default="https://launchermeta.mojang.com/mc/game/version_manifest.json", help="The launcher manifest to get all the available versions (an url or the path of a local mirror)")
 parser.add_argument("-v", "--version", type=str, default="latest", help="the version number of the minecraft server or latest (latest-release) or latest-snapshot")
 parser.add_argument("-o", "--output-dir", default="/minecraft", help="output directory for the minecraft server jar")
+parser.add_argument("-c", "--cache-dir", default=None, help="cache directory for the manifests and the server jars. <output-dir>/cache by default")
+parser.add_argument("--offline", action="store_true", help="never use the network, only the cache and the local mirror")
 args=parser.parse_args()
 
-version=""
-versionURL=""
-with urllib.request.urlopen(args.manifest) as response:
-  manifest=json.loads(response.read().decode('utf-8'))
+cacheDir=args.cache_dir if args.cache_dir else os.path.join(args.output_dir, "cache")
+jarStore=os.path.join(cacheDir, "jars")
+versionsDir=os.path.join(cacheDir, "versions")
+manifestPath=os.path.join(cacheDir, "version_manifest.json")
+manifestMetaPath=os.path.join(cacheDir, "version_manifest.meta.json")
+os.makedirs(jarStore, exist_ok=True)
+os.makedirs(versionsDir, exist_ok=True)
 
-  if args.version=="latest" or args.version=="latest-release" :
-    print("looking for the latest minecraft release")
-    versionId=manifest["latest"]["release"]
-    print("version {0} is the latest minecraft release!".format(versionId))
-  elif args.version=="latest-snapshot":
+manifestURL=args.manifest
+if os.path.exists(manifestURL):
+  manifestURL="file://"+os.path.abspath(manifestURL)
+
+def isLocal(url):
+  return url.startswith("file://")
+
+def readJson(path):
+  with open(path, "r") as f:
+    return json.load(f)
+
+def writeJson(path, data):
+  with open(path+".part", "w") as f:
+    json.dump(data, f)
+  os.replace(path+".part", path)
+
+def loadManifest():
+  """
+  Get the launcher manifest from the cache, revalidated with the server (ETag/Last-Modified).
+  Returns the manifest and the index version id -> url, type, sha1 of the version metadata.
+  """
+  meta=readJson(manifestMetaPath) if os.path.isfile(manifestMetaPath) and os.path.isfile(manifestPath) else {}
+  if meta.get("url")!=manifestURL:
+    meta={}
+
+  if not (args.offline and not isLocal(manifestURL)):
+    request=urllib.request.Request(manifestURL)
+    if meta.get("etag"):
+      request.add_header("If-None-Match", meta["etag"])
+    if meta.get("last-modified"):
+      request.add_header("If-Modified-Since", meta["last-modified"])
+    try:
+      with urllib.request.urlopen(request) as response:
+        manifest=json.loads(response.read().decode('utf-8'))
+      meta={ "url": manifestURL, "etag": response.headers.get("ETag"), "last-modified": response.headers.get("Last-Modified") }
+      meta["index"]={ v["id"]: { "url": v["url"], "type": v["type"], "sha1": v.get("sha1") } for v in manifest["versions"] }
+      writeJson(manifestPath, manifest)
+      writeJson(manifestMetaPath, meta)
+      print("launcher manifest downloaded")
+      return manifest, meta["index"]
+    except urllib.error.HTTPError as e:
+      if e.code!=304:
+        if not meta:
+          raise
+        print("Cannot download the launcher manifest ({0}). Using the cached one".format(e), file=sys.stderr)
+      else:
+        print("launcher manifest not modified")
+    except (IOError, ValueError) as e:
+      if not meta:
+        raise
+      print("Cannot download the launcher manifest ({0}). Using the cached one".format(e), file=sys.stderr)
+
+  if not meta:
+    print("no launcher manifest available offline", file=sys.stderr)
+    sys.exit(2)
+  return readJson(manifestPath), meta["index"]
+
+def fetch(url, output=None):
+  """
+  Open an url. urls relative to a local manifest mirror are resolved in the mirror directory.
+  """
+  if isLocal(manifestURL) and not isLocal(url):
+    mirrored=os.path.join(os.path.dirname(manifestURL[7:]), urllib.parse.urlparse(url).path.lstrip("/"))
+    if os.path.isfile(mirrored):
+      url="file://"+mirrored
+  if args.offline and not isLocal(url):
+    raise IOError("{0} not available offline".format(url))
+  return urllib.request.urlopen(url)
+
+def loadVersionMetadata(versionId, entry):
+  """
+  Get the metadata of a version from the cache or download it. The cached file is verified with the sha1 of the manifest.
+  """
+  path=os.path.join(versionsDir, "{0}.json".format(versionId.replace("/", "_")))
+  if os.path.isfile(path):
+    with open(path, "rb") as f:
+      data=f.read()
+    if not entry or not entry.get("sha1") or hashlib.sha1(data).hexdigest()==entry["sha1"]:
+      print("version metadata found in cache")
+      return json.loads(data.decode('utf-8'))
+  if not entry:
+    print("requested version not found!", file=sys.stderr)
+    sys.exit(1)
+
+  print("Start downloading version metadata : {0}".format(entry["url"]))
+  sys.stdout.flush()
+  try:
+    with fetch(entry["url"]) as response:
+      data=response.read()
+  except IOError as e:
+    print("I/O Error. Download aborted "+str(e), file=sys.stderr)
+    sys.exit(2)
+  if entry.get("sha1") and hashlib.sha1(data).hexdigest()!=entry["sha1"]:
+    print("sha1 mismatch for the version metadata. Download aborted", file=sys.stderr)
+    sys.exit(2)
+  with open(path+".part", "wb") as f:
+    f.write(data)
+  os.replace(path+".part", path)
+  return json.loads(data.decode('utf-8'))
+
+def storeJar(url, sha1):
+  """
+  Get the server jar from the content addressed jar store or download it.
+  The sha1 is verified while the jar is streamed to the store.
+  """
+  storePath=os.path.join(jarStore, "{0}.jar".format(sha1))
+  if os.path.isfile(storePath):
+    print("server jar {0} found in cache".format(sha1))
+    return storePath
+
+  print("Start downloading server: {0}".format(url))
+  sys.stdout.flush()
+  try:
+    digest=hashlib.sha1()
+    with fetch(url) as response, open(storePath+".part", 'wb') as jarfile:
+      while True:
+        data=response.read(1024*1024)
+        if not data:
+          break
+        digest.update(data)
+        jarfile.write(data)
+  except IOError as e:
+    print("I/O Error. Download aborted "+str(e), file=sys.stderr)
+    sys.exit(2)
+  if digest.hexdigest()!=sha1:
+    os.remove(storePath+".part")
+    print("sha1 mismatch for the server jar: expected {0} got {1}. Download aborted".format(sha1, digest.hexdigest()), file=sys.stderr)
+    sys.exit(2)
+  os.replace(storePath+".part", storePath)
+  return storePath
+
+def replace(create, path):
+  """Create a file with create(tmpPath) and move it atomically to path"""
+  tmpPath=path+".tmp"
+  if os.path.lexists(tmpPath):
+    os.unlink(tmpPath)
+  create(tmpPath)
+  os.replace(tmpPath, path)
+
+def linkOrCopy(src, dst):
+  try:
+    os.link(src, dst)
+  except OSError:
+    shutil.copyfile(src, dst)
+
+version=""
+index={}
+if args.version=="latest" or args.version=="latest-release" or args.version=="latest-snapshot":
+  manifest, index=loadManifest()
+  if args.version=="latest-snapshot":
     print("looking for the latest minecraft snapshot")
     versionId=manifest["latest"]["snapshot"]
     print("version {0} is the latest minecraft snapshot!".format(versionId))
-  else : 
-    versionId=args.version
+  else:
+    print("looking for the latest minecraft release")
+    versionId=manifest["latest"]["release"]
+    print("version {0} is the latest minecraft release!".format(versionId))
+else :
+  versionId=args.version
+  if not os.path.isfile(os.path.join(versionsDir, "{0}.json".format(versionId.replace("/", "_")))):
+    manifest, index=loadManifest()
 
 print("looking for version {version} in minecraft available versions".format(version=versionId))
-for wVersion in manifest["versions"] :
-  if wVersion["id"]==versionId :
-    version=versionId
-    versionURL=wVersion["url"]
-    print("{type} {version} found!".format(type=wVersion["type"], version=version))
-    break
+entry=index.get(versionId)
+if entry:
+  print("{type} {version} found!".format(type=entry["type"], version=versionId))
+version=versionId
 
 print()
-if not version :
-  print("requested version not found!", file=sys.stderr)
-  sys.exit(1)
-
-print("Start downloading version metadata : {0}".format(versionURL))
-sys.stdout.flush()
-try:
-  with urllib.request.urlopen(versionURL) as response:
-    version_manifest=json.loads(response.read().decode('utf-8'))
-except IOError as e:
-  print("I/O Error. Download aborted "+str(e), file=sys.stderr)
-  sys.exit(2)
+version_manifest=loadVersionMetadata(versionId, entry)
 
 jarURL=version_manifest["downloads"]["server"]["url"]
+jarSha1=version_manifest["downloads"]["server"]["sha1"]
+storePath=storeJar(jarURL, jarSha1)
 
-print("Start downloading server: {0}".format(jarURL))
-sys.stdout.flush()
-try:
-  jarName=os.path.join(args.output_dir, 'minecraft_server.{version}.jar'.format(version=version))
-  jarName=jarName.replace(" ", "_")
-  with urllib.request.urlopen(jarURL) as response, open(jarName, 'wb') as jarfile:
-    shutil.copyfileobj(response, jarfile)
-except IOError as e:
-  print("I/O Error. Download aborted "+str(e), file=sys.stderr)
-  sys.exit(2)
+jarName=os.path.join(args.output_dir, 'minecraft_server.{version}.jar'.format(version=version))
+jarName=jarName.replace(" ", "_")
+if not os.path.isfile(jarName) or not os.path.samefile(jarName, storePath):
+  replace(lambda tmpPath: linkOrCopy(storePath, tmpPath), jarName)
 
 link=os.path.join(args.output_dir, 'minecraft_server.jar')
-if os.path.isfile(link):
-  os.unlink(link)
-os.symlink(jarName, link)
+replace(lambda tmpPath: os.symlink(jarName, tmpPath), link)
+print("minecraft_server.jar now points to {0}".format(jarName))
@@ -0,0 +1,32 @@
+#!/usr/bin/python3
+"""
+Minimal health check of the wrapper, used by the docker HEALTHCHECK.
+Only the RCON layer is imported and the wrapper answers from its cached health probe,
+so the check does not pay for the import of minecraft.py nor for a RCON session with the minecraft server.
+    healthcheck.py [port [password]]
+The port and password default to MC_RCON_PORT and MC_RCON_PSWD, or 25575 and rcon-passwd.
+Exits with 0 when healthy, 1 otherwise.
+"""
+
+import json
+import os
+import sys
+import rcon
+
+def main(argv):
+    port = int(argv[1]) if len(argv) > 1 else int(os.getenv("MC_RCON_PORT", "25575"))
+    passwd = argv[2] if len(argv) > 2 else os.getenv("MC_RCON_PSWD", "rcon-passwd")
+    try:
+        client = rcon.RCONClient("127.0.0.1", port, passwd, timeout=5)
+        try:
+            resp = client.send("minecraft health_status")
+        finally:
+            client.close()
+        print(resp)
+        return 0 if json.loads(resp)["code"] == 200 else 1
+    except Exception as e:
+        sys.stderr.write("service unavailable: {0}\n".format(e))
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,209 @@
+"""
+Server list ping of the minecraft protocol, to answer in place of the JVM while the server hibernates.
+(https://wiki.vg/Server_List_Ping)
+A connection starts with a handshake packet giving the next state:
+    - 1 (status): the client asks the status (motd, version, players) and then sends a ping that is echoed
+    - 2 (login) or 3 (transfer): a player wants to join. The wrapper wakes the server up and disconnects the player
+      with a message asking to reconnect in a moment
+The packets are prefixed by their length and the packet id, as VarInts.
+queryStatus does the client side, to cache the status of the running server before it hibernates.
+"""
+
+import json
+import logging
+import socket
+import struct
+import threading
+
+STATE_STATUS = 1
+STATE_LOGIN = 2
+STATE_TRANSFER = 3
+MAX_PACKET_SIZE = 32768
+TIMEOUT = 5
+MAX_CONNECTIONS = 16
+
+class ProtocolError(Exception):
+    """For minecraft protocol error management"""
+
+    def __init__(self, *args):
+        if args :
+            self.message = args[0]
+        else:
+            self.message = None
+
+    def __str__(self):
+        if self.message:
+            return 'Error: {0}'.format(self.message)
+        else:
+            return 'Protocol error'
+
+def packVarInt(value):
+    value &= 0xffffffff
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def unpackVarInt(data, offset=0):
+    """Returns the value and the offset after the VarInt"""
+    value = 0
+    for i in range(5):
+        if offset >= len(data):
+            raise ProtocolError("truncated VarInt")
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << (7 * i)
+        if not byte & 0x80:
+            return value - (1 << 32) if value & 0x80000000 else value, offset
+    raise ProtocolError("VarInt too big")
+
+def packString(value):
+    data = value.encode("utf-8")
+    return packVarInt(len(data)) + data
+
+def unpackString(data, offset):
+    length, offset = unpackVarInt(data, offset)
+    if length < 0 or offset + length > len(data):
+        raise ProtocolError("truncated string")
+    return data[offset:offset + length].decode("utf-8", errors="replace"), offset + length
+
+def packPacket(packetId, payload=b""):
+    body = packVarInt(packetId) + payload
+    return packVarInt(len(body)) + body
+
+def _recvExactly(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ProtocolError("connection closed")
+        data += chunk
+    return data
+
+def readPacket(sock):
+    """Returns the id and the payload of the next packet"""
+    length = 0
+    for i in range(5):
+        byte = _recvExactly(sock, 1)[0]
+        length |= (byte & 0x7f) << (7 * i)
+        if not byte & 0x80:
+            break
+    else:
+        raise ProtocolError("packet length too big")
+    if length <= 0 or length > MAX_PACKET_SIZE:
+        raise ProtocolError("invalid packet length {0}".format(length))
+    body = _recvExactly(sock, length)
+    packetId, offset = unpackVarInt(body)
+    return packetId, body[offset:]
+
+def queryStatus(host, port, timeout=TIMEOUT):
+    """The status (a dictionary: version, players, description, favicon) of the minecraft server at host:port"""
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        handshake = packVarInt(-1) + packString(host) + struct.pack(">H", port) + packVarInt(STATE_STATUS)
+        sock.sendall(packPacket(0x00, handshake) + packPacket(0x00))
+        packetId, payload = readPacket(sock)
+        if packetId != 0x00:
+            raise ProtocolError("status response expected. packet {0} received".format(packetId))
+        status, offset = unpackString(payload, 0)
+        return json.loads(status)
+
+def defaultStatus(motd, maxPlayers, versionName, protocol=-1):
+    """A status when the status of the running server could not be cached"""
+    return { "version": { "name": versionName or "unknown", "protocol": protocol }, "players": { "max": maxPlayers, "online": 0, "sample": [] }, "description": { "text": motd } }
+
+class PingResponder:
+    """
+    Answer the server list pings on bindAddr:port with status (a dictionary as returned by queryStatus).
+    The number of players online is always 0. onLogin() is called when a player tries to join, it returns
+    the message displayed to the player.
+    """
+
+    def __init__(self, bindAddr, port, status, onLogin):
+        self.logger = logging.getLogger("PING/{0}".format(port))
+        self.status = dict(status)
+        self.status["players"] = dict(self.status.get("players", {}), online=0, sample=[])
+        self.onLogin = onLogin
+        self.s = socket.socket()
+        self.s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.s.bind((bindAddr, port))
+        self.s.listen(MAX_CONNECTIONS)
+        self._slots = threading.BoundedSemaphore(MAX_CONNECTIONS)
+        self._running = True
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="ping-responder", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while self._running:
+            try:
+                c, addr = self.s.accept()
+            except OSError as e:
+                if not self._running:
+                    return
+                self.logger.error("accept error: %s", e)
+                continue
+            if not self._slots.acquire(blocking=False):
+                c.close()
+                continue
+            threading.Thread(target=self._serve, args=(c, addr), name="ping-{0}".format(addr), daemon=True).start()
+
+    def shutdown(self):
+        """Stop listening: the port is free once this method returns"""
+        self._running = False
+        try:
+            self.s.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.s.close()
+
+    def _serve(self, c, addr):
+        try:
+            c.settimeout(TIMEOUT)
+            first = c.recv(1, socket.MSG_PEEK)
+            if first == b"\xfe":
+                # legacy ping (minecraft 1.6 and older): not supported
+                return
+            packetId, payload = readPacket(c)
+            if packetId != 0x00:
+                raise ProtocolError("handshake expected. packet {0} received".format(packetId))
+            protocol, offset = unpackVarInt(payload)
+            address, offset = unpackString(payload, offset)
+            nextState, offset = unpackVarInt(payload, offset + 2)
+            if nextState == STATE_STATUS:
+                self._status(c, protocol)
+            elif nextState in (STATE_LOGIN, STATE_TRANSFER):
+                self.logger.info("login attempt from %s", addr)
+                message = self.onLogin()
+                c.sendall(packPacket(0x00, packString(json.dumps({ "text": message }))))
+            else:
+                raise ProtocolError("invalid next state {0}".format(nextState))
+        except (OSError, ProtocolError) as e:
+            self.logger.debug("connection from %s: %s", addr, e)
+        except:
+            self.logger.exception("connection from %s failed", addr)
+        finally:
+            c.close()
+            self._slots.release()
+
+    def _status(self, c, protocol):
+        while True:
+            packetId, payload = readPacket(c)
+            if packetId == 0x00:
+                status = self.status
+                if status.get("version", {}).get("protocol", -1) < 0:
+                    # no cached protocol: claim the one of the client so it does not display an incompatible version
+                    status = dict(status, version=dict(status.get("version", {}), protocol=protocol))
+                c.sendall(packPacket(0x00, packString(json.dumps(status))))
+            elif packetId == 0x01:
+                # ping: the payload (a long) is echoed and the connection is closed
+                c.sendall(packPacket(0x01, payload))
+                return
+            else:
+                raise ProtocolError("unexpected packet {0} in status state".format(packetId))
@@ -0,0 +1,134 @@
+"""
+Automatic sizing of the JVM heap and garbage collector from the limits of the container.
+The memory and cpu limits are read from the cgroup (v2 or v1) of the container.
+Without a memory limit the host may be shared: the heap keeps the configured --min-heap and --max-heap and is not
+touched at startup, only the garbage collector is tuned.
+"""
+
+import logging
+import math
+import os
+
+MB = 1024 * 1024
+# memory left to the JVM outside of the heap: metaspace, code cache, threads, direct buffers, ...
+MIN_OVERHEAD = 768 * MB
+OVERHEAD_RATIO = 0.2
+# below this heap a minecraft server hardly runs. The heap is never raised to it: the container would be killed
+MIN_HEAP = 256 * MB
+
+# low pause G1 flags for minecraft servers (https://docs.papermc.io/paper/aikars-flags)
+G1_FLAGS = [
+    "-XX:+UseG1GC",
+    "-XX:+ParallelRefProcEnabled",
+    "-XX:MaxGCPauseMillis=200",
+    "-XX:+UnlockExperimentalVMOptions",
+    "-XX:+DisableExplicitGC",
+    "-XX:G1HeapWastePercent=5",
+    "-XX:G1MixedGCCountTarget=4",
+    "-XX:G1MixedGCLiveThresholdPercent=90",
+    "-XX:G1RSetUpdatingPauseTimePercent=5",
+    "-XX:SurvivorRatio=32",
+    "-XX:+PerfDisableSharedMem",
+    "-XX:MaxTenuringThreshold=1",
+]
+G1_SMALL_HEAP_FLAGS = [ "-XX:G1NewSizePercent=30", "-XX:G1MaxNewSizePercent=40", "-XX:G1HeapRegionSize=8M", "-XX:G1ReservePercent=20", "-XX:InitiatingHeapOccupancyPercent=15" ]
+G1_LARGE_HEAP_FLAGS = [ "-XX:G1NewSizePercent=40", "-XX:G1MaxNewSizePercent=50", "-XX:G1HeapRegionSize=16M", "-XX:G1ReservePercent=15", "-XX:InitiatingHeapOccupancyPercent=20" ]
+LARGE_HEAP = 12 * 1024 * MB
+ZGC_HEAP = 16 * 1024 * MB
+
+logger = logging.getLogger("JVM-TUNING")
+
+def _read(path):
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def hostMemory():
+    meminfo = _read("/proc/meminfo")
+    if meminfo:
+        for line in meminfo.splitlines():
+            if line.startswith("MemTotal:"):
+                return int(line.split()[1]) * 1024
+    return None
+
+def memoryLimit(cgroupRoot="/sys/fs/cgroup"):
+    """The memory limit of the container in bytes, None if there is no limit"""
+    host = hostMemory()
+    # cgroup v2
+    value = _read(os.path.join(cgroupRoot, "memory.max"))
+    if value is None:
+        # cgroup v1
+        value = _read(os.path.join(cgroupRoot, "memory", "memory.limit_in_bytes"))
+    if value and value != "max":
+        limit = int(value)
+        # cgroup v1 reports a huge number when there is no limit
+        if host is None or limit < host:
+            return limit
+    return None
+
+def cpuLimit(cgroupRoot="/sys/fs/cgroup"):
+    """The number of cpus available to the container, may be a fraction"""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    quota = None
+    period = None
+    # cgroup v2
+    value = _read(os.path.join(cgroupRoot, "cpu.max"))
+    if value:
+        parts = value.split()
+        if parts[0] != "max":
+            quota, period = int(parts[0]), int(parts[1])
+    else:
+        # cgroup v1
+        value = _read(os.path.join(cgroupRoot, "cpu", "cpu.cfs_quota_us"))
+        if value and int(value) > 0:
+            quota = int(value)
+            period = int(_read(os.path.join(cgroupRoot, "cpu", "cpu.cfs_period_us")) or 100000)
+    if quota and period:
+        return min(cpus, quota / period)
+    return cpus
+
+def tune(memory, cpus, minHeapMB=None, maxHeapMB=None):
+    """
+    Compute the JVM options for a container with memory bytes and cpus processors.
+    memory None means no limit: the heap is minHeapMB to maxHeapMB and is not touched at startup.
+    Returns a dictionary with the heap size (MB), the garbage collector and the list of options.
+    """
+    limited = memory is not None
+    if limited:
+        # a small container can not afford the whole overhead: keep at most half of the memory outside of the heap
+        overhead = max(int(memory * OVERHEAD_RATIO), min(MIN_OVERHEAD, memory // 2))
+        # min heap = max heap: the heap is never resized and is touched at startup
+        minHeapMB = maxHeapMB = max(1, (memory - overhead) // MB)
+    heap = maxHeapMB * MB
+    gcThreads = max(1, int(math.ceil(cpus)))
+    options = [ "-Xms{0}M".format(minHeapMB), "-Xmx{0}M".format(maxHeapMB) ]
+    preTouch = [ "-XX:+AlwaysPreTouch" ] if limited else []
+    if cpus < 2:
+        gc = "serial"
+        options += [ "-XX:+UseSerialGC" ]
+    elif heap >= ZGC_HEAP and cpus >= 4:
+        gc = "z"
+        options += [ "-XX:+UseZGC" ] + preTouch + [ "-XX:+DisableExplicitGC", "-XX:+PerfDisableSharedMem", "-XX:ConcGCThreads={0}".format(max(1, gcThreads // 4)) ]
+    else:
+        gc = "g1"
+        options += G1_FLAGS + preTouch + (G1_LARGE_HEAP_FLAGS if heap >= LARGE_HEAP else G1_SMALL_HEAP_FLAGS)
+        options += [ "-XX:ParallelGCThreads={0}".format(gcThreads), "-XX:ConcGCThreads={0}".format(max(1, gcThreads // 4)) ]
+    res = { "memory_mb": memory // MB if limited else None, "cpus": cpus, "heap_mb": maxHeapMB, "gc": gc, "options": options }
+    if limited and heap < MIN_HEAP:
+        res["warning"] = "the memory limit ({0}MB) leaves a heap under {1}MB: the server may run out of memory".format(memory // MB, MIN_HEAP // MB)
+    return res
+
+def autoTune(minHeapMB, maxHeapMB, cgroupRoot="/sys/fs/cgroup"):
+    """The JVM options for the limits of the container. minHeapMB and maxHeapMB are used when there is no memory limit"""
+    memory = memoryLimit(cgroupRoot)
+    cpus = cpuLimit(cgroupRoot)
+    res = tune(memory, cpus, minHeapMB, maxHeapMB)
+    if memory is None:
+        logger.info("no memory limit found: heap=%d-%dMB. %.2f cpus gc=%s", minHeapMB, maxHeapMB, cpus, res["gc"])
+    else:
+        logger.info("container limits: %dMB, %.2f cpus. heap=%dMB gc=%s", res["memory_mb"], cpus, res["heap_mb"], res["gc"])
+    if "warning" in res:
+        logger.warning("%s", res["warning"])
+    return res
@@ -0,0 +1,175 @@
+"""
+In-memory metrics of the wrapper exposed in the Prometheus text format (http://<host>:<port>/metrics).
+The metrics are updated by the wrapper when something happens (backup, upload, rcon command, ...) and
+the gauges that mirror the state of the wrapper are refreshed by callbacks when scraped.
+A scrape never talks to the minecraft java server.
+"""
+
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{0}="{1}"'.format(n, _escape(v)) for n, v in pairs) + "}"
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Metric:
+
+    def __init__(self, kind, name, help, labels=()):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labelNames = tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.labelNames)
+
+    def render(self):
+        lines = [ "# HELP {0} {1}".format(self.name, self.help), "# TYPE {0} {1}".format(self.name, self.kind) ]
+        with self._lock:
+            for key, value in sorted(self.values.items()):
+                lines.append("{0}{1} {2}".format(self.name, _labels(self.labelNames, key), _number(value)))
+        return lines
+
+class Counter(Metric):
+
+    def __init__(self, name, help, labels=()):
+        Metric.__init__(self, "counter", name, help, labels)
+        if not self.labelNames:
+            self.values[()] = 0
+
+    def get(self, **labels):
+        with self._lock:
+            return self.values.get(self._key(labels), 0)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+
+    def __init__(self, name, help, labels=()):
+        Metric.__init__(self, "gauge", name, help, labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            if value is None:
+                self.values.pop(key, None)
+            else:
+                self.values[key] = value
+
+class Histogram(Metric):
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, "histogram", name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    def render(self):
+        lines = [ "# HELP {0} {1}".format(self.name, self.help), "# TYPE {0} histogram".format(self.name) ]
+        with self._lock:
+            for key, (counts, total) in sorted(self.values.items()):
+                cumulated = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulated += count
+                    lines.append("{0}_bucket{1} {2}".format(self.name, _labels(self.labelNames, key, ("le", _number(float(bound)))), cumulated))
+                lines.append("{0}_sum{1} {2}".format(self.name, _labels(self.labelNames, key), _number(total)))
+                lines.append("{0}_count{1} {2}".format(self.name, _labels(self.labelNames, key), cumulated))
+        return lines
+
+class Registry:
+
+    def __init__(self):
+        self.logger = logging.getLogger("METRICS")
+        self.metrics = []
+        self.callbacks = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def addCallback(self, callback):
+        """callback() is called before each scrape to refresh the gauges from the state of the wrapper"""
+        self.callbacks.append(callback)
+
+    def render(self):
+        for callback in self.callbacks:
+            try:
+                callback()
+            except:
+                self.logger.exception("metrics callback failed")
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+class MetricsServer:
+    """A HTTP server exposing the metrics of a registry on /metrics"""
+
+    def __init__(self, bindAddr, bindPort, registry):
+        self.registry = registry
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.getLogger("METRICS").debug(format, *args)
+
+        self.httpd = ThreadingHTTPServer((bindAddr, bindPort), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="metrics", daemon=True)
+        self.thread.start()
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -4,19 +4,35 @@ import threading
 import subprocess
 import logging
 import rcon
+import backupcodecs
+import hibernate
+import pregen
+import world
+import snapshot
+import staging
+import transport
+import catalog
+import jvmtuning
+import console
+import perf
+import metrics
+import client
+import scheduler
+import retention
+import hashlib
 import argparse
 import os.path
 import re
+import contextlib
 import json
-import copy
 import time
 import tarfile
-import gzip
 import shutil
 import sys
 import traceback
 import distutils.util
-import stat
+import socket
+import io
 from enum import Enum
 from queue import Queue
 
@@ -97,12 +113,61 @@ class MinecraftStatus(Enum):
     UPLOADING = 4
     DOWNLOADING = 5
     LOADING = 6
+    HIBERNATING = 7
+    OPTIMIZING = 8
+    STARTING = 9
+
+class TeeReader:
+    """
+    A read only file object that copies everything read from fileobj to copy (if not None).
+    The size and the sha256 of the data read are computed on the fly.
+    """
+
+    def __init__(self, fileobj, copy=None):
+        self.fileobj = fileobj
+        self.copy = copy
+        self.size = 0
+        self.sha = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        if self.copy is not None:
+            self.copy.write(data)
+        self.size += len(data)
+        self.sha.update(data)
+        return data
+
+class DigestWriter:
+    """
+    A write only file object that computes the size and the sha256 of the data written to fileobj.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.size = 0
+        self.sha = hashlib.sha256()
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.size += len(data)
+        self.sha.update(data)
+        return len(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+def excludedFromBackup(path):
+    """
+    True for the files of the working dir that are not backed up (path is relative to the working dir):
+    the logs and the files of the wrapper (staging copy, restore dir and checkpoint of the pre-generation)
+    """
+    return path.startswith("logs") or path == PREGEN_CHECKPOINT or path.split(os.sep, 1)[0] in (RESTORE_DIR, STAGING_DIR)
 
 def ignorelogs(tarinfo):
     """
     function to exclude the logs from the backups
     """
-    if tarinfo.name.startswith("logs"):
+    if excludedFromBackup(tarinfo.name):
         return None
     return tarinfo
 
@@ -114,25 +179,87 @@ class MinecraftServer:
         self.properties = PropertiesFile(os.path.join(self.args.workdir, "server.properties"))
         self.status = MinecraftStatus.STOPPED
         self._lock = threading.Lock()
+        # held by backup(): a second backup requested meanwhile is refused
+        self._backupLock = threading.Lock()
         self.jvm = None
+        self.rcon = None
+        self.uploads = Queue()
+        self.uploadThread = None
+        self._uploadLock = threading.Lock()
+        self.cdsMode = None
+        self.startupSeconds = None
+        self.console = console.ConsoleMonitor()
+        self.jvmStart = None
+        # held by the I/O heavy jobs (backup, upload) so they never run at the same time
+        self.ioLock = threading.Lock()
+        self.lastBackupTime = self._lastBackupTime()
+        self.lastBackupJoins = 0
+        self._initMetrics()
+
+    def _initMetrics(self):
+        """
+        The metrics of the server, updated in memory when something happens and exposed by the metrics endpoint
+        """
+        self.metrics = metrics.Registry()
+        self.mStatus = self.metrics.gauge("minecraft_status", "1 for the current status of the wrapper", ["status"])
+        self.mJvmUptime = self.metrics.gauge("minecraft_jvm_uptime_seconds", "Seconds since the start of the JVM")
+        self.mJvmStarts = self.metrics.counter("minecraft_jvm_starts_total", "Number of starts of the JVM")
+        self.mJvmRestarts = self.metrics.counter("minecraft_jvm_restarts_total", "Number of starts of the JVM after the first one")
+        self.mPlayers = self.metrics.gauge("minecraft_players", "Number of players online")
+        self.mLag = self.metrics.counter("minecraft_lag_events_total", "Number of 'Can't keep up!' warnings of the server")
+        self.mLagTicks = self.metrics.counter("minecraft_lag_ticks_total", "Number of ticks skipped by the server")
+        self.mRcon = self.metrics.histogram("minecraft_rcon_command_seconds", "Latency of the RCON commands sent to the minecraft server", ["command"])
+        self.mBackups = self.metrics.counter("minecraft_backups_total", "Number of backups", ["result"])
+        self.mBackupDuration = self.metrics.gauge("minecraft_backup_duration_seconds", "Duration of the last backup")
+        self.mBackupSize = self.metrics.gauge("minecraft_backup_size_bytes", "Size of the last backup")
+        self.mBackupRatio = self.metrics.gauge("minecraft_backup_compression_ratio", "Uncompressed size / compressed size of the last backup archive")
+        self.mReadonly = self.metrics.gauge("minecraft_backup_readonly_seconds", "Time spent in save-off during the last backup")
+        self.mReadonlyTotal = self.metrics.counter("minecraft_backup_readonly_seconds_total", "Time spent in save-off during the backups")
+        self.mTransferBytes = self.metrics.counter("minecraft_transfer_bytes_total", "Bytes of the backups uploaded or downloaded", ["direction"])
+        self.mTransferSeconds = self.metrics.counter("minecraft_transfer_seconds_total", "Time spent uploading or downloading the backups", ["direction"])
+        self.mTransferRate = self.metrics.gauge("minecraft_transfer_bytes_per_second", "Throughput of the last upload or download", ["direction"])
+        self.metrics.addCallback(self._refreshMetrics)
+        self.console.addListener(self._consoleEvent)
+
+    def _refreshMetrics(self):
+        current = self.getStatus()
+        for status in MinecraftStatus:
+            self.mStatus.set(1 if status == current else 0, status=status.name)
+        start = self.jvmStart
+        self.mJvmUptime.set(round(time.monotonic() - start, 3) if start is not None else 0)
+        self.mPlayers.set(len(self.console.stats()["players"]))
+
+    def _consoleEvent(self, event, data):
+        if event == "lag":
+            self.mLag.inc()
+            self.mLagTicks.inc(data["ticks"])
+
+    def _recordTransfer(self, direction, size, seconds):
+        if not size or not seconds:
+            return
+        self.mTransferBytes.inc(size, direction=direction)
+        self.mTransferSeconds.inc(seconds, direction=direction)
+        self.mTransferRate.set(round(size / seconds, 1), direction=direction)
 
-    def run(self):
+    def run(self, restore=True):
         try:
             """Start the JVM"""
             logging.info("Server is starting")
 
-            if self.args.auto_download :
+            # the world is not restored when the server wakes up from hibernation
+            restored = False
+            if self.args.auto_download and restore :
                 with self._lock:
                     self.status = MinecraftStatus.DOWNLOADING
-                self._download()
-            # if auto-download of the workdir is empty
-            if self.args.auto_download or not os.listdir(self.args.workdir):
+                restored = self._download()
+            # if auto-download did not restore the world or the workdir is empty
+            if not restored and ((self.args.auto_download and restore) or not [ f for f in os.listdir(self.args.workdir) if not excludedFromBackup(f) ]):
                 with self._lock:
                     self.status = MinecraftStatus.LOADING
                 self._load()
 
             # First lets create the eula.txt file if needed
-            workPath = os.path.abspath(args.workdir)
+            workPath = os.path.abspath(self.args.workdir)
             eulaPath = os.path.join(workPath, "eula.txt")
             if os.path.isfile(eulaPath) == False:
                 with open(eulaPath, "w") as eula:
@@ -140,24 +267,33 @@ class MinecraftServer:
 
             # Then create or update the server.properties
             self._populateProperties()
+            self.rcon = rcon.RCONClientPool("127.0.0.1", self.properties.getProperty("rcon.port"), self.properties.getProperty("rcon.password"))
 
             # Then we can build the java command and run it a subprocess
             command = ["java"]
-            command.append(str.format("-Xmx{MAXHEAP}M", MAXHEAP=self.args.max_heap))
-            command.append(str.format("-Xms{MINHEAP}M", MINHEAP=self.args.min_heap))
-            if not self.args.use_gfirst:
-                command.append(str.format("-XX:ParallelGCThreads={CPU_COUNT}", CPU_COUNT=self.args.gc_threads)) 
-            else:
-                command.append("-XX:+UseG1GC")
+            command.extend(self.jvmOptions())
+            cdsOptions, self.cdsMode = self._cdsOptions()
+            command.extend(cdsOptions)
             command.append("-jar")
-            command.append(args.jar)
-            command.append(args.opt)
+            command.append(self.args.jar)
+            command.append(self.args.opt)
             logging.info(str(command))
+            self.console.openLog(os.path.join(workPath, "logs", "console.log"))
+            self.console.reset()
             with self._lock:
-                self.jvm = subprocess.Popen(command, cwd=workPath)
+                self.startupSeconds = None
+                # the console is read by the wrapper and copied to its standard output
+                self.jvm = subprocess.Popen(command, cwd=workPath, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, errors="replace", bufsize=1)
+                self.jvmStart = time.monotonic()
+            if self.mJvmStarts.get() > 0:
+                self.mJvmRestarts.inc()
+            self.mJvmStarts.inc()
+            consoleThread = self.console.attach(self.jvm.stdout)
+            threading.Thread(target=self._measureStartup, args=(self.jvm, time.monotonic()), name="startup", daemon=True).start()
             with self._lock:
                 self.status = MinecraftStatus.STARTED
             self.jvm.wait()
+            consoleThread.join(5)
 
             if self.args.auto_backup or self.args.auto_upload:
                 with self._lock:
@@ -167,6 +303,8 @@ class MinecraftServer:
                 with self._lock:
                     self.status = MinecraftStatus.UPLOADING
                 self._upload(backup)
+                # wait for the upload before letting the container stop
+                self.uploads.join()
 
         except:
             exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -177,102 +315,681 @@ class MinecraftServer:
             with self._lock:
                 self.status = MinecraftStatus.STOPPED
             self.jvm = None
+            self.jvmStart = None
+            if self.rcon:
+                self.rcon.close()
+                self.rcon = None
             logging.info("Server is stopped")
 
+    def jvmOptions(self):
+        """
+        The heap and garbage collector options of the JVM.
+        With --auto-tune they are computed from the memory and cpu limits of the container.
+        """
+        if self.args.auto_tune:
+            return jvmtuning.autoTune(int(self.args.min_heap), int(self.args.max_heap))["options"]
+        options = []
+        options.append(str.format("-Xmx{MAXHEAP}M", MAXHEAP=self.args.max_heap))
+        options.append(str.format("-Xms{MINHEAP}M", MINHEAP=self.args.min_heap))
+        if not self.args.use_gfirst:
+            options.append(str.format("-XX:ParallelGCThreads={CPU_COUNT}", CPU_COUNT=self.args.gc_threads))
+        else:
+            options.append("-XX:+UseG1GC")
+        return options
+
+    def _cdsOptions(self):
+        """
+        The JVM options for the class data sharing archive of the server jar.
+        The archive is created when the JVM exits after the first run of a jar and reused by the next starts.
+        The archives of the other jars (previous versions) are removed.
+        Returns the options and the cds mode: disabled, dumping or reused.
+        """
+        if self.args.no_cds:
+            return [], "disabled"
+        jar = os.path.realpath(self.args.jar)
+        if not os.path.isfile(jar):
+            return [], "disabled"
+        st = os.stat(jar)
+        archiveName = "{0}-{1}-{2}.jsa".format(os.path.basename(jar)[:-4], st.st_size, st.st_mtime_ns)
+        archive = os.path.join(self.args.cds_dir, archiveName)
+        os.makedirs(self.args.cds_dir, exist_ok=True)
+        for f in os.listdir(self.args.cds_dir):
+            if f.endswith(".jsa") and f != archiveName:
+                logging.info("removing outdated class data sharing archive %s", f)
+                os.remove(os.path.join(self.args.cds_dir, f))
+        if os.path.isfile(archive):
+            return ["-XX:SharedArchiveFile={0}".format(archive)], "reused"
+        return ["-XX:ArchiveClassesAtExit={0}".format(archive)], "dumping"
+
+    def _measureStartup(self, jvm, start):
+        """
+        Wait for the RCON port of the JVM to accept connections and record the startup time.
+        The startup times with and without the class data sharing archive are kept in <cds-dir>/startup.json.
+        """
+        port = int(self.properties.getProperty("rcon.port"))
+        while jvm.poll() is None:
+            try:
+                with socket.create_connection(("127.0.0.1", port), timeout=1):
+                    break
+            except OSError:
+                time.sleep(0.5)
+        if jvm.poll() is not None:
+            return
+        duration = round(time.monotonic() - start, 3)
+        with self._lock:
+            self.startupSeconds = duration
+
+        history = {}
+        historyPath = os.path.join(self.args.cds_dir, "startup.json")
+        try:
+            if os.path.isfile(historyPath):
+                with open(historyPath, "r") as f:
+                    history = json.load(f)
+            history[self.cdsMode] = duration
+            os.makedirs(self.args.cds_dir, exist_ok=True)
+            with open(historyPath, "w") as f:
+                json.dump(history, f)
+        except (OSError, ValueError) as e:
+            logging.warning("cannot update %s: %s", historyPath, e)
+        logging.info("server started in %.1fs (cds: %s). Last startup times: %s", duration, self.cdsMode, history)
+
     def _download(self):
         """
-        Download the latest backup from the remote server
+        Download the latest backup from the remote and extract it on the fly to the working dir.
+        A local copy of the backup is written from the same stream unless --no-download-copy is set.
+        In snapshot mode the missing files of the remote snapshot store are downloaded, the snapshot is restored by _load.
+        Returns True if the world was restored from the download.
         """
-        urlParts = self.args.ssh_remote_url.split(":")
-        userHost = urlParts[0]
-        remotePath = urlParts[1]
-        sshCmd = ["ssh", "-o", "StrictHostKeyChecking=no", userHost, "ls -t {0}/*.tar.gz | head -n 1".format(remotePath)]
-        logging.info("Looking for latest backup: %s", sshCmd)
-        res = subprocess.check_output(sshCmd)
-        lastbackup = res.decode("utf-8").strip()
-        if lastbackup == "":
+        remote = self._transport()
+        if self.args.backup_mode == "snapshot":
+            store = self._snapshotStore()
+            remote.downloadTree("store/objects", store.objectsDir)
+            remote.downloadTree("store/snapshots", store.snapshotsDir)
+            return False
+
+        logging.info("Looking for latest backup on %s", remote)
+        remoteEntry = catalog.Catalog.loads(remote.readText(catalog.FILE_NAME)).latest()
+        if remoteEntry:
+            lastbackup = remoteEntry["name"]
+        else:
+            # no catalog on the remote (backups uploaded by an older version)
+            lastbackup = remote.latest()
+        if not lastbackup:
             logging.info("No backup available on remote server.")
             return False
 
         logging.info("latest backup is: %s", lastbackup)
-        filepath = os.path.join(self.args.backup_dir, str(lastbackup))
+        filepath = os.path.join(self.args.backup_dir, lastbackup)
         if os.path.isfile(filepath):
-            logging.info("latest backup %s is already available locally", lastbackup)
-        else:
-            scpCmd = ["scp", "-o", "StrictHostKeyChecking=no", "{0}:{1}".format(userHost, os.path.join(remotePath, lastbackup)), self.args.backup_dir]
-            logging.info("downloading the latest backup")
-            res = subprocess.check_output(scpCmd)
-            logging.debug("Server response: %s", res)
+            if not remoteEntry:
+                logging.info("latest backup %s is already available locally", lastbackup)
+                return False
+            elif catalog.Catalog.verify(filepath, remoteEntry):
+                logging.info("latest backup %s is already available locally and verified", lastbackup)
+                return False
+            logging.warning("local copy of %s does not match the remote catalog. Downloading it again", lastbackup)
+
+        logging.info("downloading and extracting the latest backup")
+        partPath = "{0}.part".format(filepath)
+        # the world is only replaced once the download is complete and verified
+        restoreDir = self._restoreDir()
+        start = time.monotonic()
+        try:
+            with remote.open(lastbackup) as remoteStream, open(partPath, "wb") if not self.args.no_download_copy else contextlib.nullcontext() as copy:
+                stream = TeeReader(remoteStream, copy)
+                codec, archive = backupcodecs.openReader(stream)
+                logging.info("%s archive", codec.name)
+                with tarfile.open(fileobj=archive, mode='r|') as tar :
+                    tar.extractall(path=restoreDir)
+                # read the end of the stream (padding) for the local copy. A failed transfer raises when the stream is closed
+                while stream.read(1024 * 1024):
+                    pass
+            if remoteEntry and (stream.size != remoteEntry["size"] or stream.sha.hexdigest() != remoteEntry["sha256"]):
+                raise InternalError("download of {0} does not match the remote catalog".format(lastbackup))
+            self._swapWorkdir(restoreDir)
+            if not self.args.no_download_copy:
+                os.rename(partPath, filepath)
+                localCatalog = catalog.Catalog.load(self.args.backup_dir)
+                localCatalog.add(remoteEntry if remoteEntry else catalog.newEntry(lastbackup, stream.size, stream.sha.hexdigest(), None, None))
+                localCatalog.save(self.args.backup_dir)
+            duration = time.monotonic() - start
+            self._recordTransfer("download", stream.size, duration)
+            logging.info("backup %s restored in %.1fs (%.1f MB/s)", lastbackup, duration, stream.size / 1048576 / max(duration, 0.001))
+            return True
+        except:
+            logging.exception("streaming restore of %s failed. The latest local backup will be used", lastbackup)
+            return False
+        finally:
+            if os.path.isfile(partPath):
+                os.remove(partPath)
+            shutil.rmtree(restoreDir, ignore_errors=True)
 
-    def _load(self):
+    def _restoreDir(self):
         """
-        Load the latest local backup to the run directory.
+        An empty directory where a backup is extracted before it replaces the world.
+        It is in the working dir (a volume) so the swap is a rename on the same file system.
         """
-        backups = os.listdir(self.args.backup_dir)
-        if not backups:
-            logging.info("No backup available localy")
-            return False
-
-        backups.sort()
-        lastbackup = backups[-1]
-        logging.info("Latest local backup is: %s", lastbackup)
-        filepath = os.path.join(self.args.backup_dir, lastbackup)
-
+        path = os.path.join(self.args.workdir, RESTORE_DIR)
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        return path
+
+    def _swapWorkdir(self, restoreDir):
+        """Replace the content of the working dir by the content of restoreDir"""
+        self._cleanWorkdir()
+        for f in os.listdir(restoreDir):
+            if f in KEPT_ON_RESTORE:
+                # a stale copy from a backup of an older version
+                os.remove(os.path.join(restoreDir, f))
+                continue
+            os.rename(os.path.join(restoreDir, f), os.path.join(self.args.workdir, f))
+        os.rmdir(restoreDir)
+
+    def _cleanWorkdir(self):
         logging.info("cleaning previous server working dir %s", self.args.workdir)
-        for torm in [ os.path.join(self.args.workdir, f) for f in os.listdir(self.args.workdir)]:
+        for torm in [ os.path.join(self.args.workdir, f) for f in os.listdir(self.args.workdir) if f != RESTORE_DIR and not f in KEPT_ON_RESTORE ]:
             if os.path.isfile(torm):
                 os.remove(torm)
             else:
                 shutil.rmtree(torm)
 
-        logging.info("Extracting backup %s to %s", filepath, self.args.workdir)
-        with tarfile.open(name=filepath, mode='r:gz') as tar :
-            tar.extractall(path=self.args.workdir)
+    def _load(self, name=None):
+        """
+        Load a local backup to the run directory. The latest one by default.
+        Without name, a backup that does not match the catalog or cannot be restored is skipped for the previous one.
+        Returns True if the world was restored.
+        """
+        if self.args.backup_mode == "snapshot":
+            backups = self._snapshotStore().list()
+        else:
+            backups = sorted([ f for f in os.listdir(self.args.backup_dir) if backupcodecs.isArchive(f) ])
+        candidates = [ name ] if name else backups[::-1]
+        if not candidates:
+            logging.info("No backup available localy")
+            return False
+        for backup in candidates:
+            logging.info("Latest local backup is: %s", backup)
+            try:
+                self._restoreBackup(backup)
+                return True
+            except Exception as e:
+                if name:
+                    raise
+                logging.error("backup %s cannot be restored: %s. Trying the previous one", backup, e)
+        logging.error("no local backup could be restored, the world is left as is")
+        return False
+
+    def _restoreBackup(self, name):
+        """
+        Restore the local backup name to the run directory.
+        The archive is checked against the catalog and extracted aside first: the world is only replaced by a complete backup.
+        """
+        restoreDir = self._restoreDir()
+        try:
+            if self.args.backup_mode == "snapshot":
+                logging.info("Restoring snapshot %s to %s", name, self.args.workdir)
+                self._snapshotStore().restore(name, restoreDir)
+            else:
+                filepath = os.path.join(self.args.backup_dir, name)
+                entry = catalog.Catalog.load(self.args.backup_dir).get(name)
+                if entry and not catalog.Catalog.verify(filepath, entry):
+                    raise InternalError("backup {0} does not match the catalog".format(name))
+                logging.info("Extracting backup %s to %s", filepath, self.args.workdir)
+                with open(filepath, "rb") as f:
+                    # the codec is detected from the magic bytes of the archive
+                    codec, archive = backupcodecs.openReader(f)
+                    with tarfile.open(fileobj=archive, mode='r|') as tar :
+                        tar.extractall(path=restoreDir)
+            self._swapWorkdir(restoreDir)
+        finally:
+            shutil.rmtree(restoreDir, ignore_errors=True)
 
     def _backup(self):
+        try:
+            with self.ioLock:
+                joins = self.console.stats()["joins"]
+                backup = self._backupNow()
+                self.lastBackupTime = backup["saved"]
+                self.lastBackupJoins = joins
+        except:
+            self.mBackups.inc(result="failure")
+            raise
+        self.mBackups.inc(result="success")
+        self.mBackupDuration.set(backup["seconds"])
+        self.mBackupSize.set(backup.get("size"))
+        self.mBackupRatio.set(backup.get("compression_ratio"))
+        self.mReadonly.set(backup["readonly_seconds"])
+        self.mReadonlyTotal.inc(backup["readonly_seconds"])
+        return backup
+
+    def _backupNow(self):
         logging.info("backuping world")
         res = []
+        self.properties.read()
+        backupName = self._backupName()
+        readonlyStart = time.monotonic()
         try:
-            # first we save the world and avoid the server from writting the map during the compression
+            # first we save the world and avoid the server from writting the map during the copy
             self.asRcon("say SERVER BACKUP STARTING. Server going readonly...")
             res.append(self.asRcon("save-off"))
-            res.append(self.asRcon("save-all"))
+            # without flush the chunks are only queued to the IO worker of the server: the response of
+            # save-all flush comes once they are all written, the copy starts after it
+            res.append(self.asRcon("save-all flush"))
         except:
             pass
 
-        self.properties.read()
-        tarName = "{0}_{1}.tar".format(self.properties.getProperty("level-name"), time.strftime("%Y-%m-%d_%Hh%M", time.gmtime()))
-        tarFile = os.path.join(self.args.backup_dir, tarName)
-        with tarfile.open(name=tarFile, mode='w') as tar :
-            tar.add(self.args.workdir, arcname="/", filter=ignorelogs)
-
         try:
-            # re-enable the server ability to write the map
-            res.append(self.asRcon("save-on"))
-            self.asRcon("say SERVER BACKUP ENDED. Server going read-write...")
-        except:
-            pass
+            if self.args.no_backup_staging:
+                backup = self._writeBackup(self.args.workdir, backupName)
+            else:
+                # only copy the world while the server is read-only, the compression is done on the copy
+                stagingDir = self._stagingDir()
+                staging.sync(self.args.workdir, stagingDir, exclude=excludedFromBackup, threads=self.args.backup_threads)
+        finally:
+            # the world was saved and copied: a file modified after this time changed since the backup
+            savedAt = time.time()
+            try:
+                # re-enable the server ability to write the map
+                res.append(self.asRcon("save-on"))
+                self.asRcon("say SERVER BACKUP ENDED. Server going read-write...")
+            except:
+                pass
+            readonlyDuration = time.monotonic() - readonlyStart
+            logging.info("the world was read-only for %.3fs", readonlyDuration)
+
+        if not self.args.no_backup_staging:
+            backup = self._writeBackup(stagingDir, backupName)
+        backup["log"] = res
+        backup["saved"] = savedAt
+        backup["readonly_seconds"] = round(readonlyDuration, 3)
+        backup["seconds"] = round(time.monotonic() - readonlyStart, 3)
+        return backup
+
+    def _backupName(self):
+        """
+        The name of a new backup: <level-name>_<YYYY-mm-dd_HHhMMmSS> (UTC).
+        If a backup of this second already exists the next free second is taken: the names stay unique and sorted.
+        """
+        if self.args.backup_mode == "snapshot":
+            taken = set(self._snapshotStore().list())
+        else:
+            # whatever its codec
+            taken = set([ backupcodecs.archiveBase(f) for f in os.listdir(self.args.backup_dir) if backupcodecs.isArchive(f) ]) if os.path.isdir(self.args.backup_dir) else set()
+        when = int(time.time())
+        while True:
+            backupName = "{0}_{1}".format(self.properties.getProperty("level-name"), time.strftime(BACKUP_DATE_FORMAT, time.gmtime(when)))
+            if not backupName in taken:
+                return backupName
+            when += 1
+
+    def _writeBackup(self, srcDir, backupName):
+        """
+        Write the backup of srcDir using the configured backup mode
+        """
+        if self.args.backup_mode == "snapshot":
+            self._snapshotStore().create(srcDir, backupName, exclude=excludedFromBackup)
+            return { "snapshot" : backupName }
+        else:
+            backupFile = "{0}{1}".format(backupName, backupcodecs.get(self.args.backup_codec).suffix())
+            if os.path.exists(os.path.join(self.args.backup_dir, backupFile)):
+                raise InternalError("backup {0} already exists".format(backupFile))
+            size, digest, rawSize = self._archive(srcDir, os.path.join(self.args.backup_dir, backupFile))
+            localCatalog = catalog.Catalog.load(self.args.backup_dir)
+            localCatalog.prune(self.args.backup_dir)
+            localCatalog.add(catalog.newEntry(backupFile, size, digest, self.properties.getProperty("level-name"), self.serverVersion()))
+            localCatalog.save(self.args.backup_dir)
+            return { "file" : backupFile, "size": size, "sha256": digest, "compression_ratio": round(rawSize / size, 3) if size else None }
+
+    def _archive(self, srcDir, backupPath):
+        """
+        Write srcDir to a tar archive compressed with the configured codec
+        Returns the size and the sha256 of the archive, and the size of the uncompressed tar
+        """
+        partPath = "{0}.part".format(backupPath)
+        try:
+            # tar and compress in a single pass, the compression is spread over several threads (gzip, zstd)
+            with open(partPath, 'wb') as f_out:
+                digest = DigestWriter(f_out)
+                writer = backupcodecs.get(self.args.backup_codec).writer(digest, self.args.backup_level, self.args.backup_threads)
+                try:
+                    raw = backupcodecs.CountingWriter(writer)
+                    with tarfile.open(fileobj=raw, mode='w|') as tar :
+                        tar.add(srcDir, arcname="/", filter=ignorelogs)
+                finally:
+                    writer.close()
+            os.rename(partPath, backupPath)
+            return digest.size, digest.sha.hexdigest(), raw.size
+        finally:
+            if os.path.isfile(partPath):
+                os.remove(partPath)
 
-        with open(tarFile, 'rb') as f_in:
-            with gzip.open('{0}.gz'.format(tarFile), 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
+    def benchmarkCodecs(self):
+        """
+        Compress a sample of the current world with each codec and report the speeds and the ratio.
+        The sample is a tar of the region files first (the bulk of a world) and then of the other files.
+        """
+        files = []
+        for root, dirnames, filenames in os.walk(self.args.workdir):
+            if os.path.relpath(root, self.args.workdir) == ".":
+                dirnames[:] = [ d for d in dirnames if not excludedFromBackup(d) ]
+            files += [ os.path.join(root, f) for f in filenames ]
+        files.sort(key=lambda f: (not f.endswith(".mca"), f))
+        with self.ioLock:
+            buffer = io.BytesIO()
+            with tarfile.open(fileobj=buffer, mode='w|') as tar:
+                for f in files:
+                    if buffer.tell() >= BENCHMARK_SAMPLE_SIZE:
+                        break
+                    try:
+                        tar.add(f, arcname=os.path.relpath(f, self.args.workdir))
+                    except OSError:
+                        pass
+            sample = buffer.getvalue()[:BENCHMARK_SAMPLE_SIZE]
+        # the codecs run on the sample in memory: the backups and the uploads are not blocked meanwhile
+        results = []
+        for codec in backupcodecs.CODECS.values():
+            if not codec.available():
+                results.append({ "codec": codec.name, "error": "the python module {0} is not installed".format(codec.module) })
+                continue
+            level = self.args.backup_level if codec.name == self.args.backup_codec else None
+            results.append(backupcodecs.benchmark(sample, codec, level, self.args.backup_threads))
+        return { "sample_size": len(sample), "threads": self.args.backup_threads, "codec": self.args.backup_codec, "results": results }
+
+    def _lastBackupTime(self):
+        """The time of the latest local backup, 0 if there is none"""
+        paths = [ os.path.join(self.args.backup_dir, f) for f in os.listdir(self.args.backup_dir) if backupcodecs.isArchive(f) ] if os.path.isdir(self.args.backup_dir) else []
+        snapshotsDir = os.path.join(self.args.backup_dir, "store", "snapshots")
+        if os.path.isdir(snapshotsDir):
+            paths += [ os.path.join(snapshotsDir, f) for f in os.listdir(snapshotsDir) if f.endswith(".json") ]
+        return max([ os.path.getmtime(p) for p in paths ], default=0)
+
+    def changesSinceBackup(self):
+        """
+        Why the world may have changed since the last backup: a player was online or a file of the world was modified.
+        Returns None if nothing changed.
+        """
+        stats = self.console.stats()
+        if stats["players"] or stats["joins"] > self.lastBackupJoins:
+            return "players online"
+        for root, dirnames, filenames in os.walk(self.args.workdir):
+            if os.path.relpath(root, self.args.workdir) == ".":
+                dirnames[:] = [ d for d in dirnames if not excludedFromBackup(d) ]
+            for f in filenames:
+                if f in AUTOSAVE_FILES:
+                    continue
+                try:
+                    if os.path.getmtime(os.path.join(root, f)) > self.lastBackupTime:
+                        return "{0} modified".format(os.path.relpath(os.path.join(root, f), self.args.workdir))
+                except OSError:
+                    pass
+        return None
 
-        backupFile = "{0}.gz".format(tarName)
+    def retentionPolicy(self):
+        return retention.Policy(self.args.keep_hourly, self.args.keep_daily, self.args.keep_weekly, self.args.keep_monthly, retention.parseSize(self.args.backup_budget))
 
-        os.remove(tarFile)
+    def prune(self, dryRun=False):
+        """
+        Apply the retention policy to the local backups and to the remote (if configured) and remove the old logs.
+        With dryRun nothing is removed, the result only reports what would be removed.
+        """
+        policy = self.retentionPolicy()
+        with self.ioLock:
+            res = { "policy": policy.describe(), "dry_run": dryRun }
+            if self.args.backup_mode == "snapshot":
+                res["local"] = self._pruneSnapshots(policy, dryRun)
+            else:
+                res["local"] = self._pruneArchives(policy, dryRun)
+            if self.args.remote_url or self.args.ssh_remote_url:
+                try:
+                    res["remote"] = self._pruneRemote(policy, dryRun)
+                except Exception as e:
+                    logging.exception("pruning of the remote backups failed")
+                    res["remote"] = { "error": str(e) }
+            res["logs"] = self._pruneLogs(dryRun)
+        return res
+
+    def optimizeWorld(self, minInhabited=None, dryRun=False):
+        """
+        Compact the region files of the world (see world.py). The server must be stopped and cannot start meanwhile.
+        minInhabited: drop the chunks where the players spent less than this number of seconds.
+        """
+        with self._lock:
+            if self.isRunning() or self.status != MinecraftStatus.STOPPED:
+                raise InternalError("the server must be stopped to optimize the world")
+            self.status = MinecraftStatus.OPTIMIZING
+        try:
+            with self.ioLock:
+                self.properties.read()
+                worldDir = os.path.join(self.args.workdir, self.properties.properties.get("level-name") or "world")
+                if not os.path.isdir(worldDir):
+                    raise InternalError("no world in {0}".format(worldDir))
+                logging.info("optimizing the world %s", worldDir)
+                return world.optimize(worldDir, int(minInhabited * perf.DEFAULT_TICK_RATE) if minInhabited else None, dryRun)
+        finally:
+            self.setStatus(MinecraftStatus.STOPPED)
 
-        return { "log": res, "file" : backupFile }
+    def load(self, name):
+        """
+        Restore the local backup name (an archive or a snapshot) to the run directory. The server must be stopped
+        and cannot start meanwhile. The world is only replaced once the backup is fully restored.
+        """
+        with self._lock:
+            if self.isRunning() or self.status != MinecraftStatus.STOPPED:
+                raise InternalError("the server must be stopped to load a backup")
+            self.status = MinecraftStatus.LOADING
+        try:
+            with self.ioLock:
+                if self.args.backup_mode == "snapshot":
+                    backups = self._snapshotStore().list()
+                else:
+                    backups = [ f for f in os.listdir(self.args.backup_dir) if backupcodecs.isArchive(f) ] if os.path.isdir(self.args.backup_dir) else []
+                if not name in backups:
+                    raise InternalError("backup {0} not found".format(name))
+                self._load(name)
+                return { "backup": name }
+        finally:
+            self.setStatus(MinecraftStatus.STOPPED)
+
+    @staticmethod
+    def _pruneReport(kept, removed, freed):
+        describe = lambda b: { "name": b["name"], "date": time.strftime("%Y-%m-%d %H:%M", time.gmtime(b["created"])), "size": b.get("size"), "reason": b["reason"] }
+        return { "kept": [ describe(b) for b in kept ], "removed": [ describe(b) for b in removed ], "bytes_freed": freed }
+
+    def _pruneArchives(self, policy, dryRun):
+        localCatalog = catalog.Catalog.load(self.args.backup_dir)
+        localCatalog.prune(self.args.backup_dir)
+        backups = []
+        for f in [ f for f in os.listdir(self.args.backup_dir) if backupcodecs.isArchive(f) ]:
+            path = os.path.join(self.args.backup_dir, f)
+            entry = localCatalog.get(f)
+            created = entry["created"] if entry else (retention.nameDate(f) or os.path.getmtime(path))
+            backups.append({ "name": f, "created": created, "size": os.path.getsize(path) })
+        kept, removed = policy.select(backups)
+        if not dryRun:
+            for b in removed:
+                logging.info("removing backup %s (%s)", b["name"], b["reason"])
+                os.remove(os.path.join(self.args.backup_dir, b["name"]))
+                localCatalog.remove(b["name"])
+            localCatalog.save(self.args.backup_dir)
+        return self._pruneReport(kept, removed, sum(b["size"] for b in removed))
+
+    def _pruneSnapshots(self, policy, dryRun):
+        store = self._snapshotStore()
+        objects = {}
+        backups = []
+        for name in store.list():
+            objects[name] = store.objects(name)
+            backups.append({ "name": name, "created": store.readManifest(name)["created"] })
+        sizes = {}
+        for digests in objects.values():
+            for digest in digests:
+                if digest not in sizes:
+                    sizes[digest] = store.objectSize(digest)
+        totalSize = lambda names: sum(sizes[d] for d in set().union(*[ objects[n] for n in names ]))
+        for b in backups:
+            b["size"] = totalSize([b["name"]])
+        kept, removed = policy.select(backups, totalSize)
+        if dryRun:
+            freed = totalSize(list(objects)) - totalSize([ b["name"] for b in kept ])
+        else:
+            for b in removed:
+                logging.info("removing snapshot %s (%s)", b["name"], b["reason"])
+                store.remove(b["name"])
+            freed = store.collectGarbage()[1]
+        return self._pruneReport(kept, removed, freed)
+
+    def _pruneRemote(self, policy, dryRun):
+        remote = self._transport()
+        if self.args.backup_mode == "snapshot":
+            return self._pruneRemoteSnapshots(remote, policy, dryRun)
+        remoteCatalog = catalog.Catalog.loads(remote.readText(catalog.FILE_NAME))
+        backups = []
+        for name in remote.list():
+            entry = remoteCatalog.get(name)
+            created = entry["created"] if entry else retention.nameDate(name)
+            if created is None:
+                # unknown backup, left alone
+                continue
+            backups.append({ "name": name, "created": created, "size": entry["size"] if entry else 0 })
+        kept, removed = policy.select(backups)
+        if not dryRun and removed:
+            for b in removed:
+                logging.info("removing remote backup %s (%s)", b["name"], b["reason"])
+                remote.remove(b["name"])
+                remoteCatalog.remove(b["name"])
+            remote.writeText(catalog.FILE_NAME, remoteCatalog.dumps())
+        return self._pruneReport(kept, removed, sum(b["size"] for b in removed))
+
+    def _pruneRemoteSnapshots(self, remote, policy, dryRun):
+        """
+        The retention of the snapshot store uploaded to the remote (store/snapshots and store/objects).
+        The manifests of the removed snapshots are removed first, then the objects no kept snapshot references.
+        """
+        objects = {}
+        backups = []
+        for f in remote.listTree("store/snapshots"):
+            if not f.endswith(".json") or os.path.dirname(f):
+                continue
+            manifest = json.loads(remote.readText(os.path.join("store/snapshots", f)))
+            objects[f[:-5]] = snapshot.manifestObjects(manifest)
+            backups.append({ "name": f[:-5], "created": manifest["created"] })
+        sizes = { snapshot.objectDigest(path): size for path, size in remote.listTree("store/objects").items() if snapshot.objectDigest(path) }
+        totalSize = lambda names: sum(sizes.get(d, 0) for d in set().union(*[ objects[n] for n in names ]))
+        for b in backups:
+            b["size"] = totalSize([b["name"]])
+        kept, removed = policy.select(backups, totalSize)
+        referenced = set().union(*[ objects[b["name"]] for b in kept ])
+        # the objects of the removed snapshots and the ones left by an interrupted upload. Nothing is collected
+        # without any snapshot listed: an empty listing may be a listing that failed
+        garbage = [ digest for digest in sizes if digest not in referenced ] if backups else []
+        if not dryRun:
+            for b in removed:
+                logging.info("removing remote snapshot %s (%s)", b["name"], b["reason"])
+            # the manifests first: a remote snapshot must never reference a missing object
+            remote.removeMany([ "store/snapshots/{0}.json".format(b["name"]) for b in removed ])
+            remote.removeMany([ "store/objects/{0}/{1}".format(d[:2], d[2:]) for d in garbage ])
+        return self._pruneReport(kept, removed, sum(sizes[d] for d in garbage))
+
+    def _pruneLogs(self, dryRun):
+        """Remove the logs of the server older than LOG_RETENTION_DAYS"""
+        logsDir = os.path.join(self.args.workdir, "logs")
+        limit = time.time() - LOG_RETENTION_DAYS * 86400
+        removed = []
+        if os.path.isdir(logsDir):
+            for f in os.listdir(logsDir):
+                path = os.path.join(logsDir, f)
+                if os.path.isfile(path) and os.path.getmtime(path) < limit:
+                    removed.append(f)
+                    if not dryRun:
+                        os.remove(path)
+        return { "removed": removed }
+
+    def _stagingDir(self):
+        """
+        The staging copy of the world. By default in the working dir: a reflink of the world is only possible on
+        the same file system, and the copy is not mistaken for a backup by the budget of the backup dir.
+        """
+        if self.args.staging_dir:
+            return self.args.staging_dir
+        # the default location of the previous versions
+        oldDir = os.path.join(self.args.backup_dir, STAGING_DIR)
+        if os.path.isdir(oldDir):
+            logging.info("removing the staging copy of the previous versions %s", oldDir)
+            shutil.rmtree(oldDir, ignore_errors=True)
+        return os.path.join(self.args.workdir, STAGING_DIR)
+
+    def _snapshotStore(self):
+        return snapshot.SnapshotStore(os.path.join(self.args.backup_dir, "store"), threads=self.args.backup_threads)
 
     def _upload(self, backup):
-        scpCmd = ["scp", "-o", "StrictHostKeyChecking=no", os.path.join(self.args.backup_dir, backup["file"]), self.args.ssh_remote_url]
-        logging.info("uploading world: %s", scpCmd)
-        res = subprocess.check_output(scpCmd)
+        """
+        Queue the backup to be uploaded in background by the upload thread.
+        """
+        with self._uploadLock:
+            if self.uploadThread is None or not self.uploadThread.is_alive():
+                self.uploadThread = threading.Thread(target=self._uploadWorker, name="upload", daemon=True)
+                self.uploadThread.start()
+        self.uploads.put(backup)
+
+    def _uploadWorker(self):
+        while True:
+            backup = self.uploads.get()
+            try:
+                with self.ioLock:
+                    self._uploadNow(backup)
+            except:
+                logging.exception("upload of %s failed", backup)
+            finally:
+                self.uploads.task_done()
+
+    def _uploadNow(self, backup):
+        remote = self._transport()
+        logging.info("uploading world to %s: %s", remote, backup)
+        if "file" in backup:
+            localPath = os.path.join(self.args.backup_dir, backup["file"])
+            stats = remote.upload(localPath)
+            self._recordTransfer("upload", stats.get("bytes", os.path.getsize(localPath)), stats.get("seconds"))
+            # the remote catalog is updated once the archive is complete
+            entry = catalog.Catalog.load(self.args.backup_dir).get(backup["file"])
+            if entry:
+                remoteCatalog = catalog.Catalog.loads(remote.readText(catalog.FILE_NAME))
+                remoteCatalog.add(entry)
+                remote.writeText(catalog.FILE_NAME, remoteCatalog.dumps())
+            return stats
+        else:
+            # objects first: a remote snapshot must never reference a missing object
+            store = self._snapshotStore()
+            remote.uploadTree(store.objectsDir, "store/objects")
+            return remote.uploadTree(store.snapshotsDir, "store/snapshots")
 
-    def start(self):
-        if self.thread and self.thread.is_alive():
-            raise InternalError("Server is already running")
-        self.thread = threading.Thread(target=self.run, args=())
-        self.thread.start()
+    def serverVersion(self):
+        """
+        The version of the server jar, read from the name of the jar file (minecraft_server.<version>.jar)
+        """
+        match = re.match(r"minecraft_server\.(.+)\.jar$", os.path.basename(os.path.realpath(self.args.jar)))
+        if match:
+            return match.group(1)
+        return None
+
+    def _transport(self):
+        url = self.args.remote_url if self.args.remote_url else self.args.ssh_remote_url
+        if not url:
+            raise InternalError("no remote configured")
+        return transport.fromUrl(url)
+
+    def start(self, restore=True):
+        # checked and started under the lock: two concurrent starts, or a start and an optimize or a load of the
+        # world, never run together
+        with self._lock:
+            if self.thread and self.thread.is_alive():
+                raise InternalError("Server is already running")
+            if self.status == MinecraftStatus.OPTIMIZING:
+                raise InternalError("the world is being optimized")
+            if self.status == MinecraftStatus.LOADING:
+                raise InternalError("a backup is being loaded")
+            self.status = MinecraftStatus.STARTING
+            self.thread = threading.Thread(target=self.run, args=(restore,))
+            self.thread.start()
 
     def stop(self):
         """
@@ -285,7 +1002,7 @@ class MinecraftServer:
         res = []
         try:
             self.asRcon("say SERVER SHUTTING DOWN IN 5 SECONDS. Saving map...")
-            res.append(self.asRcon("save-all"))
+            res.append(self.asRcon("save-all flush"))
             res.append(self.asRcon("stop"))
         except:
             self.kill()
@@ -314,35 +1031,27 @@ class MinecraftServer:
             return self.thread.is_alive()
 
     def getStatus(self):
-        status = MinecraftStatus.UNAVAILABLE
-        with self._lock:
-            status = copy.copy(self.status)
-        return status
-
-    def acquireLock(self):
-        """
-        Acquire the status change lock non blockingly.
-        the lock is aquired if and only if True is returned
-        """
-        return self._lock.acquire(False)
+        # the assignment of the status is atomic: it is read without the lock so the health checks and the
+        # metrics never wait for a status change or a backup
+        return self.status
 
-    def releaseLock(self):
-        """
-        Release the status change lock.
-        Call this method after calling aquireLock()
-        """
-        if self._lock.locked():
-            return self._lock.release()
+    def setStatus(self, status):
+        with self._lock:
+            self.status = status
 
     def asRcon(self, command):
         """
-        Open a RCON connection to the minecraft java server if needed and then send the command.
-        Do not forget to call closeRcon when you sent all the commands you wanted to free the resource.
+        Send the command to the minecraft java server using one of the persistent RCON connections.
         """
-        if self.isRunning() :
-            rconCli = rcon.RCONClient("127.0.0.1", self.properties.getProperty("rcon.port"), self.properties.getProperty("rcon.password"))
-            res = rconCli.send(command)
-            return res
+        rconPool = self.rcon
+        if self.isRunning() and rconPool:
+            start = time.monotonic()
+            try:
+                return rconPool.send(command)
+            finally:
+                name = command.split(" ", 1)[0].lower()
+                # the label values stay a fixed set whatever the players and the admins send
+                self.mRcon.observe(time.monotonic() - start, command=name if name in RCON_METRIC_COMMANDS else "other")
         else:
             raise InternalError("Server not started")
 
@@ -350,21 +1059,21 @@ class MinecraftServer:
         """
         Thread safe backup method
         """
+        if not self._backupLock.acquire(False):
+            return { "code" : 503, "status": self.getStatus().name, "error": "Minecraft server is busy. Try again later."}
         try:
-            if not self.acquireLock():
-                return { "code" : 503, "status": self.getStatus().name, "error": "Minecraft server is busy. Try again later."}
-
-            if self.status in [MinecraftStatus.DOWNLOADING, MinecraftStatus.UPLOADING]:
+            if self.status in [MinecraftStatus.DOWNLOADING, MinecraftStatus.LOADING, MinecraftStatus.UPLOADING]:
                 return { "code" : 503, "status": self.status.name, "error": "A backup operation is aleady running. Try again later."}
 
             backup = self._backup()
             if self.args.auto_upload :
                 self._upload(backup)
+                backup["upload"] = "queued"
             backup["code"] = 200
             backup["status"] = self.status.name
             return backup
         finally:
-            self.releaseLock()
+            self._backupLock.release()
 
     def _populateProperties(self):
         """
@@ -397,23 +1106,46 @@ class MinecraftWrapper(rcon.RCONServerHandler):
         self.args = args
         #self.workerThread = MinecraftWorkerThread(args)
         self.minecraftServer = MinecraftServer(args)
+        self.pingResponder = None
+        self.idleSince = None
+        self._hibernateLock = threading.Lock()
+        # the checkpoint is read before the run thread may restore a backup to the working dir
+        self.pregen = pregen.Pregenerator(self.asRcon, os.path.join(self.args.workdir, PREGEN_CHECKPOINT), lambda: self.minecraftServer.console.stats()["lag_events"], self.args.pregen_max_mspt)
         if not self.args.no_auto_start :
             self.minecraftServer.start()
         else:
             logging.info("NOTICE: Automatic start disabled by configuration. Send the 'minecraft start' command to start the server.")
 
-        if self.args.auto_clean :
-            cleanScript="/etc/cron.daily/minecleaning"
-            shutil.copyfile("/usr/local/minecraft/cleaning.sh", cleanScript)
-            st = os.stat(cleanScript)
-            os.chmod(cleanScript, st.st_mode | stat.S_IEXEC)
+        self.perf = None
+        if self.args.perf_interval > 0:
+            self.perf = perf.PerfSampler(self.minecraftServer.asRcon, self.args.perf_interval)
+            self.perf.start()
+        self.health = None
+        self._healthLock = threading.Lock()
+        threading.Thread(target=self._healthLoop, name="health", daemon=True).start()
+
+        self.metricsServer = None
+        if self.args.metrics_port > 0:
+            registry = self.minecraftServer.metrics
+            self.mTps = registry.gauge("minecraft_tps", "Ticks per second of the last performance sample")
+            self.mMspt = registry.gauge("minecraft_mspt", "Milliseconds per tick of the last performance sample")
+            registry.addCallback(self._refreshMetrics)
+            self.metricsServer = metrics.MetricsServer(self.args.metrics_bind, self.args.metrics_port, registry)
+            self.metricsServer.start()
+
+        self.scheduler = scheduler.Scheduler()
+        self.backupJob = None
         if self.args.auto_backup:
-            backupScript="/etc/cron.{frequency}/minebackup".format(frequency=self.args.backup_frequency)
-            shutil.copyfile("/usr/local/minecraft/backup.sh", backupScript)
-            st = os.stat(backupScript)
-            os.chmod(backupScript, st.st_mode | stat.S_IEXEC)
-        if self.args.auto_clean or self.args.auto_backup:
-            self.cron = subprocess.Popen("cron")
+            self.backupJob = self.scheduler.add("backup", scheduler.parseSchedule(self.args.backup_frequency), self._scheduledBackup)
+        if self.args.auto_clean:
+            self.scheduler.add("prune", scheduler.parseSchedule("daily"), self._scheduledPrune)
+        if self.pregen.canResume():
+            logging.info("resuming the pre-generation of the chunks")
+            self.pregen.start()
+
+        if self.args.idle_timeout > 0:
+            self.scheduler.add("idle", scheduler.IntervalSchedule(IDLE_CHECK_INTERVAL), self._idleCheck)
+        self.scheduler.start()
 
         if not os.path.isdir("/root/.ssh"):
             os.mkdir("/root/.ssh")
@@ -429,7 +1161,12 @@ class MinecraftWrapper(rcon.RCONServerHandler):
         """
         Start the minecraft java server thread.
         """
-        self.minecraftServer.start()
+        if self.getStatus() == MinecraftStatus.OPTIMIZING:
+            return { "code" : 409, "status": self.getStatus().name, "error": "the world is being optimized."}
+        if self._leaveHibernation():
+            self.minecraftServer.start(restore=False)
+        else:
+            self.minecraftServer.start()
         time.sleep(0.2)
         return { "code" : 200, "status": self.getStatus().name}
 
@@ -437,6 +1174,9 @@ class MinecraftWrapper(rcon.RCONServerHandler):
         """
         Stop the minecraft java server gracefully if possible.
         """
+        if self._leaveHibernation():
+            self.minecraftServer.setStatus(MinecraftStatus.STOPPED)
+            return { "code" : 200, "status": self.getStatus().name, "log": ["hibernation ended"]}
         try:
             res = self.minecraftServer.stop()
             time.sleep(0.2)
@@ -446,9 +1186,257 @@ class MinecraftWrapper(rcon.RCONServerHandler):
         except InternalError as e :
             return { "code" : 206, "status": self.getStatus().name, "error": e.message}
 
-    def mc_backup(self):
+    def mc_backup(self, args):
+        if "--benchmark" in args:
+            res = self.minecraftServer.benchmarkCodecs()
+            res["code"] = 200
+            res["status"] = self.getStatus().name
+            return res
         return self.minecraftServer.backup()
 
+    def mc_logs(self, args):
+        """
+        The console of the minecraft java server.
+            - logs --tail N : the last N lines
+            - logs --follow CURSOR : the lines after CURSOR (waits up to 5s for new lines)
+        The response contains the cursor to use for the next --follow and the counters of the console events.
+        """
+        monitor = self.minecraftServer.console
+        if len(args) == 2 and args[0] == "--follow":
+            lines, cursor = monitor.follow(int(args[1]))
+        else:
+            count = int(args[1]) if len(args) == 2 and args[0] == "--tail" else 20
+            lines, cursor = monitor.tail(count)
+        return { "code" : 200, "status": self.getStatus().name, "lines": lines, "cursor": cursor, "events": monitor.stats() }
+
+    def _scheduledBackup(self):
+        """
+        The backup job of the scheduler.
+        The backup is skipped if the world did not change since the last one and postponed while the tps is degraded
+        (for --backup-max-delay seconds at most). Returns a delay to postpone the job.
+        """
+        if not self.minecraftServer.isRunning():
+            return "skipped: server not running"
+        reason = self.minecraftServer.changesSinceBackup()
+        if reason is None:
+            return "skipped: no player online and no file modified since the last backup"
+        if self.perf and self.args.backup_min_tps > 0:
+            tps = self.perf.report()["windows"]["1m"]["tps"]
+            if tps and tps["p50"] < self.args.backup_min_tps and self.backupJob.retries * BACKUP_RETRY_DELAY < self.args.backup_max_delay:
+                logging.info("tps degraded (%.1f). backup postponed", tps["p50"])
+                return BACKUP_RETRY_DELAY
+        logging.info("scheduled backup: %s", reason)
+        res = self.minecraftServer.backup()
+        if res["code"] == 503:
+            return BACKUP_RETRY_DELAY
+        if self.args.auto_clean:
+            # keep the backup dir within its budget
+            self._scheduledPrune()
+        return "backup {0}".format(res.get("file", res.get("snapshot")))
+
+    def _scheduledPrune(self):
+        res = self.minecraftServer.prune()
+        removed = len(res["local"]["removed"]) + len(res.get("remote", {}).get("removed", []))
+        return "{0} backups removed, {1} bytes freed locally".format(removed, res["local"]["bytes_freed"])
+
+    def _idleCheck(self):
+        """
+        The idle job of the scheduler: the server hibernates once no player was online for --idle-timeout minutes.
+        """
+        if self.getStatus() != MinecraftStatus.STARTED:
+            self.idleSince = None
+            return "skipped: server not running"
+        if self.pregen.isActive():
+            self.idleSince = None
+            return "skipped: pre-generation running"
+        try:
+            match = perf.PLAYERS_PATTERN.search(self.asRcon("list"))
+        except Exception as e:
+            return "skipped: {0}".format(e)
+        if not match:
+            return "skipped: unknown number of players"
+        if int(match.group(1)) > 0:
+            self.idleSince = None
+            return "{0} players online".format(match.group(1))
+        if self.idleSince is None:
+            self.idleSince = time.time()
+        idle = time.time() - self.idleSince
+        if idle < self.args.idle_timeout * 60:
+            return "no player online for {0}s".format(int(idle))
+        self.hibernate()
+        return "hibernating"
+
+    def hibernate(self):
+        """
+        Stop the JVM (with the backup and the upload done on stop) and answer the server list pings in its place
+        until a player tries to join. The status returned to the pings is the one of the server before it stopped.
+        """
+        properties = self.minecraftServer.properties
+        properties.read()
+        port = int(properties.properties.get("server-port") or 25565)
+        bindAddr = properties.properties.get("server-ip", "")
+        try:
+            status = hibernate.queryStatus("127.0.0.1", port)
+        except Exception as e:
+            logging.warning("cannot query the status of the server: %s. A default status is used", e)
+            status = hibernate.defaultStatus(properties.properties.get("motd", "A Minecraft Server"), int(properties.properties.get("max-players") or 20), self.minecraftServer.serverVersion())
+        logging.info("no player online: the server hibernates")
+        self.minecraftServer.stop()
+        self.minecraftServer.join()
+        self.idleSince = None
+        try:
+            with self._hibernateLock:
+                self.pingResponder = hibernate.PingResponder(bindAddr, port, status, self._wake)
+                self.pingResponder.start()
+                self.minecraftServer.setStatus(MinecraftStatus.HIBERNATING)
+        except OSError as e:
+            # nobody could join the server: it is started again
+            logging.error("cannot listen on the port %d: %s. The server is started again", port, e)
+            self.minecraftServer.start(restore=False)
+            return { "code" : 500, "status": self.getStatus().name, "error": "cannot listen on the port {0}: {1}".format(port, e)}
+        return { "code" : 200, "status": self.getStatus().name}
+
+    def _leaveHibernation(self):
+        """Stop answering the pings so the JVM can bind its port. Returns True if the server was hibernating"""
+        with self._hibernateLock:
+            if self.pingResponder is None:
+                return False
+            self.pingResponder.shutdown()
+            self.pingResponder = None
+            return True
+
+    def _wake(self):
+        """
+        Called by the ping responder when a player tries to join: the JVM is started again.
+        Returns the message displayed to the player
+        """
+        startup = self.minecraftServer.startupSeconds
+        if self._leaveHibernation():
+            logging.info("a player tries to join: waking the server up")
+            self.minecraftServer.start(restore=False)
+        return "The server is waking up. Please reconnect in {0} seconds".format(int(startup) + 5 if startup else 30)
+
+    def mc_pregen(self, args):
+        """
+        The pre-generation of the chunks:
+            - pregen RADIUS [X Z] : generate the chunks within RADIUS blocks of X Z (0 0 by default)
+            - pregen stop : stop after the current tile, resume : continue from the checkpoint, cancel : forget it
+            - pregen or pregen status : the progress
+        """
+        try:
+            if args and args[0] == "stop":
+                self.pregen.stop()
+            elif args and args[0] == "resume":
+                self.pregen.start()
+            elif args and args[0] == "cancel":
+                self.pregen.cancel()
+            elif args and args[0] != "status":
+                if self.pregen.isActive():
+                    raise ValueError("a pre-generation is already running. Stop or cancel it first")
+                center = [ int(v) for v in args[1:3] ] if len(args) >= 3 else [ 0, 0 ]
+                self.pregen.configure(int(args[0]), *center)
+                self.pregen.start()
+        except ValueError as e:
+            return { "code" : 409, "status": self.getStatus().name, "error": str(e)}
+        res = self.pregen.report()
+        res["code"] = 200
+        res["status"] = self.getStatus().name
+        return res
+
+    def mc_world(self, args):
+        """
+        The maintenance of the world files, while the server is stopped:
+            - world optimize [--dry-run] [--min-inhabited SECONDS] : compact the region files and drop the chunks
+              where the players spent less than SECONDS
+        """
+        if not args or args[0] != "optimize":
+            return { "code" : 404, "status": self.getStatus().name, "error": "unknown world action. Expected: optimize"}
+        minInhabited = None
+        if "--min-inhabited" in args:
+            try:
+                minInhabited = float(args[args.index("--min-inhabited") + 1])
+            except (IndexError, ValueError):
+                return { "code" : 400, "status": self.getStatus().name, "error": "--min-inhabited expects a number of seconds"}
+        if self.minecraftServer.isRunning() or self.getStatus() != MinecraftStatus.STOPPED:
+            return { "code" : 409, "status": self.getStatus().name, "error": "the server must be stopped to optimize the world."}
+        res = self.minecraftServer.optimizeWorld(minInhabited, "--dry-run" in args[1:])
+        res["code"] = 200
+        res["status"] = self.getStatus().name
+        return res
+
+    def mc_load(self, args):
+        """
+        Restore a local backup while the server is stopped: the name of an archive of the backup directory, or of a
+        snapshot in snapshot mode
+        """
+        if len(args) != 1:
+            return { "code" : 400, "status": self.getStatus().name, "error": "expected the name of the backup to load"}
+        if self.minecraftServer.isRunning() or self.getStatus() != MinecraftStatus.STOPPED:
+            return { "code" : 409, "status": self.getStatus().name, "error": "the server must be stopped to load a backup."}
+        res = self.minecraftServer.load(args[0])
+        res["code"] = 200
+        res["status"] = self.getStatus().name
+        return res
+
+    def _probeHealth(self):
+        """
+        Check that the minecraft java server answers to RCON and cache the result
+        """
+        if self.minecraftServer.isRunning():
+            try:
+                health = self.fowardCommand("list")
+            except InternalError as e:
+                health = { "code" : 500, "error": e.message }
+            except Exception as e:
+                health = { "code" : 500, "error": str(e) }
+        else:
+            health = { "code" : 200 }
+        health["status"] = self.getStatus().name
+        health["checked"] = time.time()
+        with self._healthLock:
+            self.health = health
+        return health
+
+    def _healthLoop(self):
+        while True:
+            try:
+                self._probeHealth()
+            except:
+                logging.exception("health probe failed")
+            time.sleep(self.args.health_interval)
+
+    def mc_health(self):
+        """
+        The health of the server from the cache refreshed by the health thread.
+        The server is probed immediately if the cached result is too old (the health thread is stuck)
+        or if the server was not running at the time of the last probe.
+        """
+        if not self.minecraftServer.isRunning():
+            return { "code" : 200, "status": self.getStatus().name}
+        with self._healthLock:
+            health = self.health
+        if health is None or ("log" not in health and health["code"] == 200) or time.time() - health["checked"] > 2 * self.args.health_interval:
+            health = self._probeHealth()
+        res = dict(health)
+        res["age"] = round(time.time() - health["checked"], 3)
+        return res
+
+    def _refreshMetrics(self):
+        last = self.perf.last() if self.perf else None
+        self.mTps.set(last["tps"] if last else None)
+        self.mMspt.set(last["mspt"] if last else None)
+
+    def mc_perf(self):
+        """
+        The percentiles of the tps, mspt and players sampled over the last minute, 5 minutes and hour.
+        """
+        if not self.perf:
+            return { "code" : 404, "status": self.getStatus().name, "error": "performance sampling disabled (--perf-interval 0)"}
+        res = self.perf.report()
+        res["code"] = 200
+        res["status"] = self.getStatus().name
+        return res
+
     def fowardCommand(self, command):
         res = self.asRcon(command)
         return { "code" : 200, "log": res}
@@ -464,14 +1452,32 @@ class MinecraftWrapper(rcon.RCONServerHandler):
                 elif action == "stop":
                     return json.dumps(self.mc_stop())
                 elif action == "status":
-                    return json.dumps({ "code" : 200, "status": self.getStatus().name})
+                    return json.dumps({ "code" : 200, "status": self.getStatus().name, "startup_seconds": self.minecraftServer.startupSeconds, "cds": self.minecraftServer.cdsMode})
                 elif action == "backup":
-                    return json.dumps(self.mc_backup())
+                    return json.dumps(self.mc_backup(args[2:]))
+                elif action == "logs":
+                    return json.dumps(self.mc_logs(args[2:]))
+                elif action == "perf":
+                    return json.dumps(self.mc_perf())
+                elif action == "prune":
+                    res = self.minecraftServer.prune("--dry-run" in args[2:])
+                    res["code"] = 200
+                    res["status"] = self.getStatus().name
+                    return json.dumps(res)
+                elif action == "pregen":
+                    return json.dumps(self.mc_pregen(args[2:]))
+                elif action == "world":
+                    return json.dumps(self.mc_world(args[2:]))
+                elif action == "load":
+                    return json.dumps(self.mc_load(args[2:]))
+                elif action == "hibernate":
+                    if self.getStatus() != MinecraftStatus.STARTED:
+                        return json.dumps({ "code" : 409, "status": self.getStatus().name, "error": "the server is not running."})
+                    return json.dumps(self.hibernate())
+                elif action == "schedule":
+                    return json.dumps({ "code" : 200, "status": self.getStatus().name, "jobs": self.scheduler.list()})
                 elif action == "health_status":
-                    if self.minecraftServer.isRunning():
-                        return json.dumps(self.fowardCommand("list"))
-                    else:
-                        return json.dumps({ "code" : 200, "status": self.getStatus().name})
+                    return json.dumps(self.mc_health())
                 elif action == "property" :
                     key = args[2]
                     if len(args) > 3 :
@@ -492,7 +1498,8 @@ class MinecraftWrapper(rcon.RCONServerHandler):
                 elif action == "config":
                     dictArgs = vars(self.args)
                     if len(args) == 2 :
-                        return  json.dumps({ "code" : 200, "status": self.getStatus().name, "config" : dictArgs})
+                        jvmCommand = ["java"] + self.minecraftServer.jvmOptions() + ["-jar", self.args.jar, self.args.opt]
+                        return  json.dumps({ "code" : 200, "status": self.getStatus().name, "config" : dictArgs, "jvm_command": " ".join(jvmCommand)})
                     else:
                         key = args[2]
                         key = key.replace("-", "_")
@@ -541,9 +1548,10 @@ class MinecraftWrapper(rcon.RCONServerHandler):
 
     def serve(self):
         try:
-            rconSrv = rcon.RCONServer('', self.args.rcon_port, self.args.rcon_pswd, self)
+            rconSrv = rcon.RCONServer('', self.args.rcon_port, self.args.rcon_pswd, self, maxConnections=self.args.rcon_max_connections, idleTimeout=self.args.rcon_idle_timeout)
             rconSrv.run()
         finally:
+            self._leaveHibernation()
             if self.minecraftServer.isRunning():
                 self.minecraftServer.stop()
             self.minecraftServer.join()
@@ -551,21 +1559,83 @@ class MinecraftWrapper(rcon.RCONServerHandler):
     def getStatus(self):
         return self.minecraftServer.getStatus()
 
+BACKUP_RETRY_DELAY = 60
+# down to the second: two backups in the same minute must not share a name
+BACKUP_DATE_FORMAT = "%Y-%m-%d_%Hh%Mm%S"
+IDLE_CHECK_INTERVAL = 60
+# the commands with their own label in minecraft_rcon_command_seconds: the ones sent by the wrapper and the usual
+# admin commands. The others are labelled "other"
+RCON_METRIC_COMMANDS = ("list", "say", "save-all", "save-off", "save-on", "stop", "tick", "forceload", "execute",
+                        "op", "deop", "kick", "ban", "pardon", "whitelist", "time", "weather", "gamerule", "difficulty")
+# the files rewritten by each autosave of the server, even without any player online
+AUTOSAVE_FILES = ("session.lock", "level.dat", "level.dat_old")
+# where a backup is extracted in the working dir before it replaces the world
+RESTORE_DIR = ".restore"
+# where the world is copied in the working dir before being compressed by a backup
+STAGING_DIR = ".staging"
+PREGEN_CHECKPOINT = "pregen.json"
+# the files of the wrapper in the working dir that are not replaced when a backup is restored
+KEPT_ON_RESTORE = (PREGEN_CHECKPOINT,)
+LOG_RETENTION_DAYS = 20
+BENCHMARK_SAMPLE_SIZE = 64 * 1024 * 1024
+
 def getBoolEnv(env_var, default=False):
     return bool(distutils.util.strtobool(os.getenv(env_var, str(default))))
 
 FORMAT = '%(asctime)-15s [%(name)s][%(levelname)s]: %(message)s'
 logging.basicConfig(format=FORMAT, level="WARNING")
 
-cronFrequencies = ["daily", "hourly", "monthly", "weekly"]
+backupModes = ["archive", "snapshot"]
 
 MC_SSH_REMOTE_URL = os.getenv("MC_SSH_REMOTE_URL", "")
+MC_REMOTE_URL = os.getenv("MC_REMOTE_URL", "")
 MC_MIN_HEAP = os.getenv("MC_MIN_HEAP", os.getenv("MINHEAP", "2048"))
 MC_MAX_HEAP = os.getenv("MC_MAX_HEAP", os.getenv("MAXHEAP", "6144"))
 MC_BACKUP_FREQUENCY = os.getenv("MC_BACKUP_FREQUENCY", "weekly")
+MC_BACKUP_MODE = os.getenv("MC_BACKUP_MODE", "archive")
+MC_BACKUP_CODEC = os.getenv("MC_BACKUP_CODEC", "gzip")
+MC_BACKUP_LEVEL = os.getenv("MC_BACKUP_LEVEL", None)
+MC_BACKUP_THREADS = os.getenv("MC_BACKUP_THREADS", str(os.cpu_count() or 1))
+MC_PERF_INTERVAL = os.getenv("MC_PERF_INTERVAL", "5")
+MC_METRICS_PORT = os.getenv("MC_METRICS_PORT", "0")
+MC_HEALTH_INTERVAL = os.getenv("MC_HEALTH_INTERVAL", "30")
+MC_RCON_PORT = os.getenv("MC_RCON_PORT", "25575")
+MC_RCON_PSWD = os.getenv("MC_RCON_PSWD", "rcon-passwd")
+
+MC_BACKUP_MIN_TPS = os.getenv("MC_BACKUP_MIN_TPS", "15")
+MC_KEEP_HOURLY = os.getenv("MC_KEEP_HOURLY", "24")
+MC_KEEP_DAILY = os.getenv("MC_KEEP_DAILY", "7")
+MC_KEEP_WEEKLY = os.getenv("MC_KEEP_WEEKLY", "4")
+MC_KEEP_MONTHLY = os.getenv("MC_KEEP_MONTHLY", "12")
+MC_BACKUP_BUDGET = os.getenv("MC_BACKUP_BUDGET", "")
+MC_BACKUP_MAX_DELAY = os.getenv("MC_BACKUP_MAX_DELAY", "3600")
+MC_IDLE_TIMEOUT = os.getenv("MC_IDLE_TIMEOUT", "0")
+MC_PREGEN_MAX_MSPT = os.getenv("MC_PREGEN_MAX_MSPT", "40")
+
+def backupSchedule(value):
+    try:
+        scheduler.parseSchedule(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError("invalid backup frequency {0}: {1}. Expected hourly, daily, weekly, monthly, an interval (30m, 6h, 2d) or a cron expression".format(value, e))
+    return value
+
+def backupCodec(value):
+    codec = backupcodecs.CODECS.get(value)
+    if codec is None:
+        raise argparse.ArgumentTypeError("invalid codec {0}. Expected one of {1}".format(value, ", ".join(backupcodecs.NAMES)))
+    if not codec.available():
+        raise argparse.ArgumentTypeError("the {0} codec requires the python module {1}".format(value, codec.module))
+    return value
+
+def backupBudget(value):
+    try:
+        retention.parseSize(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
 
-if not MC_BACKUP_FREQUENCY in cronFrequencies:
-    logging.FATAL("invalid backup frequency %s. Value must be one of %s", MC_BACKUP_FREQUENCY, cronFrequencies)
+if not MC_BACKUP_MODE in backupModes:
+    logging.FATAL("invalid backup mode %s. Value must be one of %s", MC_BACKUP_MODE, backupModes)
     sys.exit(1)
 
 parser = argparse.ArgumentParser(description='Manage a minecraft java server')
@@ -579,57 +1649,81 @@ parser.add_argument("--min-heap", default=MC_MIN_HEAP, help='The min heap alloca
 parser.add_argument("--max-heap", default=MC_MAX_HEAP, help='The max heap allocated to the jvm')
 parser.add_argument("--use-gfirst", action="store_true", help='Use the G1 Garbage Collector instead of the Parallel Garbage Collector')
 parser.add_argument("--gc-threads", default="3", help='Number of threads allocated to be Garbage Collector')
-parser.add_argument("--rcon-port", default=25575, type=int, help='the listening port for RCON(Remote CONsole)')
-parser.add_argument("--rcon-pswd", default="rcon-passwd", help='the password for RCON(Remote CONsole)')
-parser.add_argument("--backup-frequency", default=MC_BACKUP_FREQUENCY, choices=cronFrequencies, help='the frequeny of the world backups.')
+parser.add_argument("--backup-mode", default=MC_BACKUP_MODE, choices=backupModes, help='archive: a full compressed tar per backup. snapshot: a deduplicated snapshot store in the backup dir')
+parser.add_argument("--backup-codec", default=MC_BACKUP_CODEC, type=backupCodec, help='the compression of the archives: {0}. gzip by default'.format(", ".join(backupcodecs.NAMES)))
+parser.add_argument("--backup-level", default=MC_BACKUP_LEVEL, type=int, help='the compression level of the archives. The default level of the codec by default')
+parser.add_argument("--benchmark", action="store_true", help='backup: compress a sample of the world with each codec and report the speed and the ratio instead of doing a backup')
+parser.add_argument("--backup-threads", default=MC_BACKUP_THREADS, type=int, help='Number of threads used to compress the backups. All the cpus by default')
+parser.add_argument("--no-backup-staging", action="store_true", help='compress the backup directly from the working dir. The server stays read-only during the whole backup')
+parser.add_argument("--staging-dir", default="", help='the directory where the world is copied before being compressed. <workdir>/.staging by default')
+parser.add_argument("--auto-tune", action="store_true", help='compute the heap size and the garbage collector options from the memory and cpu limits of the container. --use-gfirst and --gc-threads are ignored, --min-heap and --max-heap too unless the container has no memory limit')
+parser.add_argument("--no-cds", action="store_true", help='do not use a class data sharing archive to speed up the start of the jvm')
+parser.add_argument("--cds-dir", default="/minecraft/cds", help='the directory of the class data sharing archives')
+parser.add_argument("--rcon-port", default=MC_RCON_PORT, type=int, help='the listening port for RCON(Remote CONsole)')
+parser.add_argument("--rcon-pswd", default=MC_RCON_PSWD, help='the password for RCON(Remote CONsole)')
+parser.add_argument("--rcon-max-connections", default=rcon.RCONServer.MAX_CONNECTIONS, type=int, help='the maximum number of simultaneous RCON connections')
+parser.add_argument("--rcon-idle-timeout", default=rcon.RCONServer.IDLE_TIMEOUT, type=int, help='the number of seconds before an idle RCON connection is closed')
+parser.add_argument("--perf-interval", default=MC_PERF_INTERVAL, type=float, help='the number of seconds between two performance samples (tps, mspt, players). 0 to disable the sampling')
+parser.add_argument("--health-interval", default=MC_HEALTH_INTERVAL, type=float, help='the number of seconds between two health probes of the minecraft server. health_status returns the result of the last probe')
+parser.add_argument("--metrics-port", default=MC_METRICS_PORT, type=int, help='the port of the prometheus metrics endpoint (http://host:port/metrics). 0 to disable it')
+parser.add_argument("--metrics-bind", default="", help='the address of the prometheus metrics endpoint. All the interfaces by default')
+parser.add_argument("--backup-frequency", default=MC_BACKUP_FREQUENCY, type=backupSchedule, help='the frequeny of the world backups: hourly, daily, weekly, monthly, an interval (30m, 6h, 2d) or a cron expression ("0 */4 * * *")')
+parser.add_argument("--backup-min-tps", default=MC_BACKUP_MIN_TPS, type=float, help='the scheduled backups are postponed while the tps of the last minute is under this value. 0 to never postpone them')
+parser.add_argument("--backup-max-delay", default=MC_BACKUP_MAX_DELAY, type=int, help='the maximum number of seconds a scheduled backup can be postponed')
+parser.add_argument("--idle-timeout", default=MC_IDLE_TIMEOUT, type=float, help='hibernate the server after this number of minutes without any player online: the JVM is stopped and the wrapper answers the server list pings until a player tries to join. 0 to never hibernate')
+parser.add_argument("--pregen-max-mspt", default=MC_PREGEN_MAX_MSPT, type=float, help='pregen: the pre-generation slows down while the time per tick is over this number of milliseconds')
 parser.add_argument("--no-auto-start", action="store_true", help='avoid the the minecraft server to starts automaticaly.')
-parser.add_argument("--auto-clean", action="store_true", help="clean the old backups automaticaly. (acts local backup only)")
+parser.add_argument("--auto-clean", action="store_true", help="apply the retention policy to the backups daily and after each scheduled backup. (local and remote backups)")
+parser.add_argument("--keep-hourly", default=MC_KEEP_HOURLY, type=int, help='retention: the number of hours whose latest backup is kept')
+parser.add_argument("--keep-daily", default=MC_KEEP_DAILY, type=int, help='retention: the number of days whose latest backup is kept')
+parser.add_argument("--keep-weekly", default=MC_KEEP_WEEKLY, type=int, help='retention: the number of weeks whose latest backup is kept')
+parser.add_argument("--keep-monthly", default=MC_KEEP_MONTHLY, type=int, help='retention: the number of months whose latest backup is kept')
+parser.add_argument("--backup-budget", default=MC_BACKUP_BUDGET, type=backupBudget, help='retention: the maximum disk usage of the backups (500M, 20G, ...). The oldest backups are removed first. No limit by default')
+parser.add_argument("--dry-run", action="store_true", help='prune: only report the backups that would be removed. world: only report the bytes that would be reclaimed')
+parser.add_argument("--min-inhabited", default=None, type=float, help='world optimize: drop the chunks where the players spent less than this number of seconds (they are generated again from the seed)')
 parser.add_argument("--auto-backup", action="store_true", help='backup the map automaticaly')
 parser.add_argument("--auto-download", action="store_true", help='download the lastet backup of the map before starting')
+parser.add_argument("--no-download-copy", action="store_true", help='do not keep a local copy of the downloaded backup')
 parser.add_argument("--auto-upload", action="store_true", help='upload the backup on a remote server')
 parser.add_argument("--ssh-remote-url", default=MC_SSH_REMOTE_URL, help='the url to access the remote ssh server for backup. ex: backup@backup-instance.fr:/path/to/dir')
-parser.add_argument('action', choices=("start", "stop", "backup", "status", "health_status", "command", "property", "config", "set-version", "serve"), help='The action to perform')
+parser.add_argument("--remote-url", default=MC_REMOTE_URL, help='where to store the backups remotely: user@server:/path/to/dir for a ssh server or /path/to/dir for a local directory. --ssh-remote-url is used if not set')
+parser.add_argument("--tail", default=20, type=int, help='logs: the number of lines to display')
+parser.add_argument("--follow", action="store_true", help='logs: wait for the new lines of the console')
+parser.add_argument('action', choices=("start", "stop", "backup", "status", "health_status", "command", "property", "config", "set-version", "logs", "perf", "batch", "schedule", "prune", "hibernate", "pregen", "world", "load", "serve"), help='The action to perform')
 parser.add_argument('args', nargs='*', help='arguments of the action')
 
-args = parser.parse_args()
-if args.verbose :
-    logging.getLogger('').setLevel("INFO")
-if args.very_verbose:
-    logging.getLogger('').setLevel("DEBUG")
-
-if not args.no_auto_start:
-    args.no_auto_start=getBoolEnv("MC_NO_AUTO_START")
-if not args.auto_clean:
-    args.auto_clean=getBoolEnv("MC_AUTO_CLEAN", getBoolEnv("DOCLEANING"))
-if not args.auto_backup:
-    args.auto_backup=getBoolEnv("MC_AUTO_BACKUP", getBoolEnv("DOBACKUP"))
-if not args.auto_download:
-    args.auto_download=getBoolEnv("MC_AUTO_DOWNLOAD")
-if not args.auto_upload:
-    args.auto_upload=getBoolEnv("MC_AUTO_UPLOAD")
-if not args.use_gfirst:
-    args.use_gfirst=getBoolEnv("MC_USE_GFIRST")
-
-logging.debug(args)
-action=args.action
-if action in ["start", "stop", "status", "backup", "command", "health_status", "property", "config", "set-version"]:
-    try:
-        client = rcon.RCONClient("127.0.0.1", args.rcon_port, args.rcon_pswd)
-        if action == "command":
-            print(client.send(" ".join(args.args)))
-        elif action == "health_status":
-            resp = client.send("minecraft health_status")
-            print(resp)
-            resp = json.loads(resp)
-            if not resp["code"] == 200:
-                sys.exit(1)
-        elif action in ["property", "config", "set-version"]:
-            print(client.send("minecraft {action} {args}".format(action=action, args=" ".join(args.args))))
-        else:
-            print(client.send("minecraft {action}".format(action=action)))
-    except:
-        sys.stderr.write("service unavailable")
-        sys.exit(1)
-elif action == "serve" :
-    wrapper = MinecraftWrapper(args)
-    wrapper.serve()
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.verbose :
+        logging.getLogger('').setLevel("INFO")
+    if args.very_verbose:
+        logging.getLogger('').setLevel("DEBUG")
+
+    if not args.no_auto_start:
+        args.no_auto_start=getBoolEnv("MC_NO_AUTO_START")
+    if not args.auto_clean:
+        args.auto_clean=getBoolEnv("MC_AUTO_CLEAN", getBoolEnv("DOCLEANING"))
+    if not args.auto_backup:
+        args.auto_backup=getBoolEnv("MC_AUTO_BACKUP", getBoolEnv("DOBACKUP"))
+    if not args.auto_download:
+        args.auto_download=getBoolEnv("MC_AUTO_DOWNLOAD")
+    if not args.no_download_copy:
+        args.no_download_copy=getBoolEnv("MC_NO_DOWNLOAD_COPY")
+    if not args.auto_upload:
+        args.auto_upload=getBoolEnv("MC_AUTO_UPLOAD")
+    if not args.no_backup_staging:
+        args.no_backup_staging=getBoolEnv("MC_NO_BACKUP_STAGING")
+    if not args.auto_tune:
+        args.auto_tune=getBoolEnv("MC_AUTO_TUNE")
+    if not args.no_cds:
+        args.no_cds=getBoolEnv("MC_NO_CDS")
+    if not args.use_gfirst:
+        args.use_gfirst=getBoolEnv("MC_USE_GFIRST")
+
+    logging.debug(args)
+    action=args.action
+    if action in client.CLIENT_ACTIONS:
+        sys.exit(client.runAction(action, args.args, args.rcon_port, args.rcon_pswd, args.tail, args.follow, args.dry_run, args.benchmark, args.min_inhabited))
+    elif action == "serve" :
+        wrapper = MinecraftWrapper(args)
+        wrapper.serve()
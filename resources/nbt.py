@@ -0,0 +1,258 @@
+"""
+NBT (Named Binary Tag), the binary format of the minecraft data: chunks, level.dat, playerdata, ...
+(https://minecraft.wiki/w/NBT_format)
+A tag is a type (1 byte), a name (a string) and a payload. The root is a compound, all the numbers are big endian.
+    - decode returns plain python values: dict for a compound, list for a list or an array, int, float, str, bytes
+    - find reads a single value without decoding the rest of the data (the other tags are skipped), this is
+      how the wrapper reads a field of a chunk (InhabitedTime, Status, ...) without the cost of a full decoding
+    - encode writes python values. Their type is guessed (int: TAG_INT, float: TAG_DOUBLE, ...) unless they are
+      wrapped in a Tag
+The strings are decoded as UTF-8 (java uses a modified UTF-8 that only differs for the null character and the
+characters outside of the BMP).
+"""
+
+import gzip
+import struct
+
+TAG_END, TAG_BYTE, TAG_SHORT, TAG_INT, TAG_LONG, TAG_FLOAT, TAG_DOUBLE, TAG_BYTE_ARRAY, TAG_STRING, TAG_LIST, TAG_COMPOUND, TAG_INT_ARRAY, TAG_LONG_ARRAY = range(13)
+# the payload size of the numbers
+SIZES = { TAG_BYTE: 1, TAG_SHORT: 2, TAG_INT: 4, TAG_LONG: 8, TAG_FLOAT: 4, TAG_DOUBLE: 8 }
+FORMATS = { TAG_BYTE: ">b", TAG_SHORT: ">h", TAG_INT: ">i", TAG_LONG: ">q", TAG_FLOAT: ">f", TAG_DOUBLE: ">d" }
+MAX_DEPTH = 512
+
+class NbtError(Exception):
+    """For NBT error management"""
+
+    def __init__(self, *args):
+        if args :
+            self.message = args[0]
+        else:
+            self.message = None
+
+    def __str__(self):
+        if self.message:
+            return 'Error: {0}'.format(self.message)
+        else:
+            return 'NBT error'
+
+class Tag:
+    """A typed value, for the values whose type cannot be guessed from the python type"""
+
+    def __init__(self, type, value):
+        self.type = type
+        self.value = value
+
+class Raw(Tag):
+    """A value already encoded: the payload of a tag of the given type"""
+
+def byte(value):
+    return Tag(TAG_BYTE, value)
+
+def short(value):
+    return Tag(TAG_SHORT, value)
+
+def long(value):
+    return Tag(TAG_LONG, value)
+
+def float32(value):
+    return Tag(TAG_FLOAT, value)
+
+def ints(values):
+    return Tag(TAG_INT_ARRAY, values)
+
+def longs(values):
+    return Tag(TAG_LONG_ARRAY, values)
+
+# decoding
+
+def _check(data, offset, size):
+    if offset + size > len(data):
+        raise NbtError("truncated data at offset {0}".format(offset))
+
+def _readString(data, offset):
+    _check(data, offset, 2)
+    length = struct.unpack_from(">H", data, offset)[0]
+    offset += 2
+    _check(data, offset, length)
+    return bytes(data[offset:offset + length]).decode("utf-8", errors="replace"), offset + length
+
+def _read(type, data, offset, depth=0):
+    """Returns the payload of a tag of type at offset and the offset after it"""
+    if depth > MAX_DEPTH:
+        raise NbtError("too many nested tags")
+    if type in FORMATS:
+        _check(data, offset, SIZES[type])
+        return struct.unpack_from(FORMATS[type], data, offset)[0], offset + SIZES[type]
+    if type == TAG_STRING:
+        return _readString(data, offset)
+    if type in (TAG_BYTE_ARRAY, TAG_INT_ARRAY, TAG_LONG_ARRAY):
+        _check(data, offset, 4)
+        length = struct.unpack_from(">i", data, offset)[0]
+        offset += 4
+        if type == TAG_BYTE_ARRAY:
+            _check(data, offset, length)
+            return bytes(data[offset:offset + length]), offset + length
+        size = 4 if type == TAG_INT_ARRAY else 8
+        _check(data, offset, length * size)
+        return list(struct.unpack_from(">{0}{1}".format(length, "i" if size == 4 else "q"), data, offset)), offset + length * size
+    if type == TAG_LIST:
+        _check(data, offset, 5)
+        itemType, length = struct.unpack_from(">bi", data, offset)
+        offset += 5
+        values = []
+        for i in range(length):
+            value, offset = _read(itemType, data, offset, depth + 1)
+            values.append(value)
+        return values, offset
+    if type == TAG_COMPOUND:
+        values = {}
+        while True:
+            _check(data, offset, 1)
+            itemType = data[offset]
+            offset += 1
+            if itemType == TAG_END:
+                return values, offset
+            name, offset = _readString(data, offset)
+            values[name], offset = _read(itemType, data, offset, depth + 1)
+    raise NbtError("unknown tag type {0} at offset {1}".format(type, offset))
+
+def _skip(type, data, offset, depth=0):
+    """Returns the offset after the payload of a tag of type at offset"""
+    if depth > MAX_DEPTH:
+        raise NbtError("too many nested tags")
+    if type in SIZES:
+        return offset + SIZES[type]
+    if type == TAG_STRING:
+        _check(data, offset, 2)
+        return offset + 2 + struct.unpack_from(">H", data, offset)[0]
+    if type in (TAG_BYTE_ARRAY, TAG_INT_ARRAY, TAG_LONG_ARRAY):
+        _check(data, offset, 4)
+        size = { TAG_BYTE_ARRAY: 1, TAG_INT_ARRAY: 4, TAG_LONG_ARRAY: 8 }[type]
+        return offset + 4 + struct.unpack_from(">i", data, offset)[0] * size
+    if type == TAG_LIST:
+        _check(data, offset, 5)
+        itemType, length = struct.unpack_from(">bi", data, offset)
+        offset += 5
+        if itemType in SIZES:
+            return offset + length * SIZES[itemType]
+        for i in range(length):
+            offset = _skip(itemType, data, offset, depth + 1)
+        return offset
+    if type == TAG_COMPOUND:
+        while True:
+            _check(data, offset, 1)
+            itemType = data[offset]
+            offset += 1
+            if itemType == TAG_END:
+                return offset
+            _check(data, offset, 2)
+            offset += 2 + struct.unpack_from(">H", data, offset)[0]
+            offset = _skip(itemType, data, offset, depth + 1)
+    raise NbtError("unknown tag type {0} at offset {1}".format(type, offset))
+
+def _root(data):
+    """The offset of the payload of the root compound"""
+    if not data or data[0] != TAG_COMPOUND:
+        raise NbtError("the root tag is not a compound")
+    name, offset = _readString(data, 1)
+    return offset
+
+def decode(data):
+    """Decode the whole data. Returns the name and the value (a dict) of the root compound"""
+    offset = _root(data)
+    return _readString(data, 1)[0], _read(TAG_COMPOUND, data, offset)[0]
+
+def find(data, *path):
+    """
+    The value at path (the names of the nested compounds, then the name of the tag) in the root compound,
+    None if there is no such tag. Only this value is decoded.
+    """
+    offset = _root(data)
+    for depth, name in enumerate(path):
+        while True:
+            _check(data, offset, 1)
+            itemType = data[offset]
+            offset += 1
+            if itemType == TAG_END:
+                return None
+            itemName, offset = _readString(data, offset)
+            if itemName != name:
+                offset = _skip(itemType, data, offset)
+                continue
+            if depth == len(path) - 1:
+                return _read(itemType, data, offset)[0]
+            if itemType != TAG_COMPOUND:
+                return None
+            break
+    return None
+
+def readFile(path):
+    """The content of a NBT file, gzip compressed (level.dat, playerdata) or not"""
+    with open(path, "rb") as f:
+        data = f.read()
+    return gzip.decompress(data) if data[:2] == b"\x1f\x8b" else data
+
+# encoding
+
+def _tagType(value):
+    if isinstance(value, Tag):
+        return value.type
+    if isinstance(value, int):
+        return TAG_INT
+    if isinstance(value, float):
+        return TAG_DOUBLE
+    if isinstance(value, str):
+        return TAG_STRING
+    if isinstance(value, (bytes, bytearray)):
+        return TAG_BYTE_ARRAY
+    if isinstance(value, list):
+        return TAG_LIST
+    if isinstance(value, dict):
+        return TAG_COMPOUND
+    raise NbtError("no NBT type for {0}".format(type(value)))
+
+def _string(value):
+    data = value.encode("utf-8")
+    return struct.pack(">H", len(data)) + data
+
+def _write(type, value, out):
+    if isinstance(value, Raw):
+        out += value.value
+        return
+    if isinstance(value, Tag):
+        value = value.value
+    if type in FORMATS:
+        out += struct.pack(FORMATS[type], value)
+    elif type == TAG_BYTE_ARRAY:
+        out += struct.pack(">i", len(value)) + value
+    elif type == TAG_STRING:
+        out += _string(value)
+    elif type == TAG_LIST:
+        itemType = _tagType(value[0]) if value else TAG_END
+        out += struct.pack(">bi", itemType, len(value))
+        for item in value:
+            _write(itemType, item, out)
+    elif type == TAG_COMPOUND:
+        for name, item in value.items():
+            itemType = _tagType(item)
+            out += struct.pack(">b", itemType) + _string(name)
+            _write(itemType, item, out)
+        out += b"\x00"
+    elif type == TAG_INT_ARRAY:
+        out += struct.pack(">i{0}i".format(len(value)), len(value), *value)
+    elif type == TAG_LONG_ARRAY:
+        out += struct.pack(">i{0}q".format(len(value)), len(value), *value)
+    else:
+        raise NbtError("unknown tag type {0}".format(type))
+
+def encodePayload(value):
+    """The payload of value, without the type and the name of the tag"""
+    out = bytearray()
+    _write(_tagType(value), value, out)
+    return bytes(out)
+
+def encode(root, name=""):
+    """The NBT of the compound root"""
+    out = bytearray(struct.pack(">b", TAG_COMPOUND) + _string(name))
+    _write(TAG_COMPOUND, root, out)
+    return bytes(out)
@@ -0,0 +1,130 @@
+"""
+Sampling of the performance of the minecraft java server.
+The JVM is polled over RCON at a fixed interval:
+    - tick query (minecraft 1.20.3+) gives the average time per tick (MSPT) and the target tick rate
+    - list gives the number of players online (and is the only source on the older versions)
+The samples are kept in a fixed size ring buffer covering one hour and summarized as percentiles over several windows.
+"""
+
+import logging
+import math
+import re
+import threading
+import time
+from collections import deque
+
+HISTORY_SECONDS = 3600
+WINDOWS = [ ("1m", 60), ("5m", 300), ("1h", 3600) ]
+# when tick query is not supported it is tried again every TICK_QUERY_RETRY samples (the version may change)
+TICK_QUERY_RETRY = 120
+
+MSPT_PATTERN = re.compile(r"Average time per tick: ([\d.]+)ms")
+TICK_RATE_PATTERN = re.compile(r"Target tick rate: ([\d.]+)")
+PLAYERS_PATTERN = re.compile(r"There are (\d+)")
+DEFAULT_TICK_RATE = 20.0
+
+def percentile(values, p):
+    """The nearest-rank percentile p (0-100) of sorted values"""
+    if not values:
+        return None
+    rank = max(1, int(math.ceil(p / 100.0 * len(values))))
+    return values[rank - 1]
+
+def summarize(values, lowTail=False):
+    """
+    The p50, the worst tail and the min/max of values. The worst tail is p95/p99 when a high value is bad (mspt),
+    p5/p1 with lowTail when a low value is bad (tps)
+    """
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    res = { "p50": percentile(values, 50) }
+    for p in ((5, 1) if lowTail else (95, 99)):
+        res["p{0}".format(p)] = percentile(values, p)
+    res["min"] = values[0]
+    res["max"] = values[-1]
+    return res
+
+class PerfSampler:
+    """
+    Poll the JVM with send(command) every interval seconds.
+    send must raise an exception when the server is not available, the sample is then skipped.
+    """
+
+    def __init__(self, send, interval=5):
+        self.logger = logging.getLogger("PERF")
+        self.send = send
+        self.interval = interval
+        self.samples = deque(maxlen=int(math.ceil(HISTORY_SECONDS / interval)))
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.thread = None
+        self.tickQuery = True
+        self._untilRetry = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="perf", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                self.logger.debug("sample skipped: %s", e)
+
+    def _queryTick(self):
+        """Returns the mspt and the tps, None if tick query is not supported by the server"""
+        if not self.tickQuery:
+            self._untilRetry -= 1
+            if self._untilRetry > 0:
+                return None
+        res = self.send("tick query")
+        match = MSPT_PATTERN.search(res)
+        if not match:
+            if self.tickQuery:
+                self.logger.info("tick query not supported by the server, only the players are sampled")
+            self.tickQuery = False
+            self._untilRetry = TICK_QUERY_RETRY
+            return None
+        self.tickQuery = True
+        mspt = float(match.group(1))
+        match = TICK_RATE_PATTERN.search(res)
+        rate = float(match.group(1)) if match else DEFAULT_TICK_RATE
+        # a tick that takes longer than the target slows down the server
+        tps = min(rate, 1000.0 / mspt) if mspt > 0 else rate
+        return mspt, round(tps, 2)
+
+    def sample(self):
+        tick = self._queryTick()
+        match = PLAYERS_PATTERN.search(self.send("list"))
+        players = int(match.group(1)) if match else None
+        mspt, tps = tick if tick else (None, None)
+        with self._lock:
+            self.samples.append((time.time(), tps, mspt, players))
+
+    def last(self):
+        with self._lock:
+            if not self.samples:
+                return None
+            t, tps, mspt, players = self.samples[-1]
+        return { "time": t, "tps": tps, "mspt": mspt, "players": players }
+
+    def report(self):
+        """The p50 and the worst tail (p5/p1 of the tps, p95/p99 of the mspt and players) over the last minute, 5 minutes and hour"""
+        now = time.time()
+        with self._lock:
+            samples = list(self.samples)
+        windows = {}
+        for name, seconds in WINDOWS:
+            window = [ s for s in samples if s[0] >= now - seconds ]
+            windows[name] = {
+                "samples": len(window),
+                "tps": summarize((s[1] for s in window), lowTail=True),
+                "mspt": summarize(s[2] for s in window),
+                "players": summarize(s[3] for s in window),
+            }
+        return { "interval": self.interval, "source": "tick query" if self.tickQuery else "list", "last": self.last(), "windows": windows }
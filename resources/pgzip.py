@@ -0,0 +1,108 @@
+"""
+Parallel gzip compression (pigz like)
+The stream is split in blocks compressed independently by a pool of threads.
+Each block is primed with the last 32KiB of the previous one so the ratio stays close to a plain gzip.
+The output is a single standard gzip member: it can be read by gzip, tarfile, zcat, ...
+"""
+
+import logging
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+BLOCK_SIZE = 1024 * 1024
+DICT_SIZE = 32 * 1024
+
+def deflateBlock(data, zdict, level, last):
+    """
+    Compress one block as a raw deflate stream.
+    The block ends on a byte boundary (sync flush) so the blocks can be concatenated.
+    Only the last block terminates the deflate stream.
+    """
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY, zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    out = compressor.compress(data)
+    out += compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    return out
+
+class ParallelGzipWriter:
+    """
+    A write only file object that compresses everything written to it in gzip format using several threads.
+    The compressed blocks are written to fileobj in order. fileobj is not closed by close().
+    """
+
+    def __init__(self, fileobj, level=6, threads=None, blockSize=BLOCK_SIZE):
+        self.logger = logging.getLogger("PGZIP")
+        self.fileobj = fileobj
+        self.level = level
+        self.threads = threads if threads and threads > 0 else (os.cpu_count() or 1)
+        self.blockSize = blockSize
+        self.buffer = bytearray()
+        self.zdict = None
+        self.crc = 0
+        self.size = 0
+        self.compressedSize = 0
+        self.closed = False
+        self._pending = deque()
+        self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="pgzip")
+        self._writeHeader()
+
+    def _writeHeader(self):
+        # magic, deflate, no flags, mtime, no extra flags, unknown OS
+        header = b"\x1f\x8b\x08\x00" + struct.pack("<I", int(time.time())) + b"\x00\xff"
+        self._output(header)
+
+    def _output(self, data):
+        self.fileobj.write(data)
+        self.compressedSize += len(data)
+
+    def _submit(self, block, last):
+        self.crc = zlib.crc32(block, self.crc)
+        self.size += len(block)
+        self._pending.append(self._pool.submit(deflateBlock, block, self.zdict, self.level, last))
+        self.zdict = block[-DICT_SIZE:]
+        # bound the memory used by the blocks waiting to be written
+        while len(self._pending) > 2 * self.threads:
+            self._output(self._pending.popleft().result())
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed file")
+        self.buffer += data
+        while len(self.buffer) >= self.blockSize:
+            block = bytes(self.buffer[:self.blockSize])
+            del self.buffer[:self.blockSize]
+            self._submit(block, False)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._submit(bytes(self.buffer), True)
+            self.buffer = bytearray()
+            while self._pending:
+                self._output(self._pending.popleft().result())
+            self._output(struct.pack("<II", self.crc & 0xffffffff, self.size & 0xffffffff))
+            self.logger.debug("compressed %d bytes into %d bytes using %d threads", self.size, self.compressedSize, self.threads)
+        finally:
+            self.closed = True
+            self._pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.closed = True
+            self._pool.shutdown(wait=True, cancel_futures=True)
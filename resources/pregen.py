@@ -0,0 +1,235 @@
+"""
+Pre-generation of the chunks of a world, throttled by the load of the minecraft java server.
+The square of chunks around the center is processed tile by tile (4x4 chunks), in a spiral from the center:
+    - forceload add: the server loads the chunks of the tile, generating the missing ones
+    - execute if loaded: polled until all the chunks of the tile are loaded (minecraft 1.19.4+, a fixed wait otherwise)
+    - forceload remove: the chunks are unloaded
+Before each tile the time per tick (tick query, minecraft 1.20.3+) is checked: the delay between two tiles grows while
+the MSPT is over the target and the job pauses while the server cannot keep up (no MSPT: the lag warnings of the
+console are used instead). A checkpoint is written after each tile, so the job resumes where it stopped after a restart.
+"""
+
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+
+import perf
+
+TILE = 4
+TILE_TIMEOUT = 60
+POLL_INTERVAL = 0.2
+# without execute if loaded (before 1.19.4) each tile is given this time to generate
+TILE_WAIT = 2.0
+# delay after an error (server stopped, restarting, ...)
+RETRY_DELAY = 5
+PAUSE_DELAY = 5
+MIN_DELAY = 0.0
+MAX_DELAY = 10.0
+RATE_WINDOW = 20
+
+def spiral(radius):
+    """The (x, z) offsets of the tiles of a square of radius tiles, in a spiral from the center"""
+    yield 0, 0
+    for ring in range(1, radius + 1):
+        x, z = -ring, -ring
+        for dx, dz in [ (1, 0), (0, 1), (-1, 0), (0, -1) ]:
+            for i in range(2 * ring):
+                yield x, z
+                x, z = x + dx, z + dz
+
+class Pregenerator:
+    """
+    Generate the chunks within radius blocks of (centerX, centerZ) with send(command) (RCON).
+    send must raise an exception while the server is not available: the job then waits for it.
+    lagEvents() returns the number of lag warnings of the console, used when tick query is not supported.
+    """
+
+    def __init__(self, send, checkpointPath, lagEvents=None, maxMspt=40.0):
+        self.logger = logging.getLogger("PREGEN")
+        self.send = send
+        self.checkpointPath = checkpointPath
+        self.lagEvents = lagEvents
+        self.maxMspt = maxMspt
+        self.state = "idle"
+        self.checkpoint = None
+        self.delay = MIN_DELAY
+        self.mspt = None
+        self.loadedQuery = None
+        self._lastLag = None
+        self.recent = deque(maxlen=RATE_WINDOW)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.thread = None
+        if os.path.isfile(checkpointPath):
+            try:
+                with open(checkpointPath) as f:
+                    self.checkpoint = json.load(f)
+            except ValueError as e:
+                self.logger.error("invalid checkpoint %s ignored: %s", checkpointPath, e)
+
+    def configure(self, radius, centerX=0, centerZ=0):
+        """A new job: radius in blocks around the block centerX, centerZ. The previous checkpoint is replaced"""
+        if self.isActive():
+            raise ValueError("a pre-generation is already running")
+        chunkRadius = int(math.ceil(radius / 16.0))
+        # the tile 0, 0 covers the chunks -2 to 1 around the center
+        tileRadius = int(math.ceil(max(chunkRadius - 1, 0) / float(TILE)))
+        self.checkpoint = {
+            "radius": radius,
+            "center": [ centerX, centerZ ],
+            "tile_radius": tileRadius,
+            "tiles_total": (2 * tileRadius + 1) ** 2,
+            "tiles_done": 0,
+            "chunks_done": 0,
+            "chunks_total": (2 * tileRadius + 1) ** 2 * TILE * TILE,
+            "timeouts": 0,
+            "seconds": 0.0,
+            "paused_seconds": 0.0,
+            "done": False,
+        }
+        self._save()
+
+    def isActive(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def canResume(self):
+        return self.checkpoint is not None and not self.checkpoint["done"]
+
+    def start(self):
+        if self.isActive():
+            raise ValueError("a pre-generation is already running")
+        if not self.canResume():
+            raise ValueError("nothing to resume")
+        self._stop.clear()
+        self.recent.clear()
+        self.thread = threading.Thread(target=self._run, name="pregen", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop after the current tile. The checkpoint is kept"""
+        self._stop.set()
+        if self.thread:
+            self.thread.join(TILE_TIMEOUT + 5)
+
+    def cancel(self):
+        self.stop()
+        self.checkpoint = None
+        self.state = "idle"
+        if os.path.isfile(self.checkpointPath):
+            os.remove(self.checkpointPath)
+
+    def _save(self):
+        partPath = "{0}.part".format(self.checkpointPath)
+        with open(partPath, "w") as f:
+            json.dump(self.checkpoint, f)
+        os.rename(partPath, self.checkpointPath)
+
+    def _run(self):
+        cp = self.checkpoint
+        tiles = list(spiral(cp["tile_radius"]))
+        self.logger.info("pre-generation of %d chunks around %s, %d already done", cp["chunks_total"], cp["center"], cp["chunks_done"])
+        while cp["tiles_done"] < len(tiles) and not self._stop.is_set():
+            start = time.monotonic()
+            try:
+                if self._throttle():
+                    self.state = "paused"
+                    self._stop.wait(PAUSE_DELAY)
+                    cp["paused_seconds"] += time.monotonic() - start
+                    continue
+                self.state = "running"
+                tx, tz = tiles[cp["tiles_done"]]
+                timedOut = self._generateTile(cp["center"], tx, tz)
+            except Exception as e:
+                self.state = "waiting"
+                self.logger.debug("server not available: %s", e)
+                self._stop.wait(RETRY_DELAY)
+                continue
+            self._stop.wait(self.delay)
+            with self._lock:
+                cp["tiles_done"] += 1
+                cp["chunks_done"] += TILE * TILE
+                cp["timeouts"] += timedOut
+                cp["seconds"] += time.monotonic() - start
+                self.recent.append((time.monotonic(), TILE * TILE))
+            self._save()
+        if cp["tiles_done"] >= len(tiles):
+            cp["done"] = True
+            self._save()
+            self.state = "done"
+            self.logger.info("pre-generation done: %d chunks in %.0fs", cp["chunks_done"], cp["seconds"])
+        else:
+            self.state = "stopped"
+
+    def _throttle(self):
+        """Adapt the delay between the tiles to the load of the server. Returns True to pause"""
+        res = self.send("tick query")
+        match = perf.MSPT_PATTERN.search(res)
+        if match:
+            self.mspt = float(match.group(1))
+            match = perf.TICK_RATE_PATTERN.search(res)
+            budget = 1000.0 / float(match.group(1)) if match else 1000.0 / perf.DEFAULT_TICK_RATE
+            behind = self.mspt >= budget
+            over = self.mspt > self.maxMspt
+        elif self.lagEvents:
+            # no tick query: a new "Can't keep up!" warning means the server is behind
+            lag = self.lagEvents()
+            behind = over = self._lastLag is not None and lag > self._lastLag
+            self._lastLag = lag
+        else:
+            behind = over = False
+        if over:
+            self.delay = min(MAX_DELAY, max(self.delay * 2, 0.25))
+        else:
+            self.delay = max(MIN_DELAY, self.delay / 2 if self.delay > 0.25 else 0)
+        return behind
+
+    def _generateTile(self, center, tx, tz):
+        """Load the chunks of the tile tx, tz then unload them. Returns True if the chunks were not all loaded in time"""
+        cx = int(math.floor(center[0] / 16.0)) + tx * TILE - TILE // 2
+        cz = int(math.floor(center[1] / 16.0)) + tz * TILE - TILE // 2
+        x1, z1, x2, z2 = cx * 16, cz * 16, (cx + TILE) * 16 - 1, (cz + TILE) * 16 - 1
+        self.send("forceload add {0} {1} {2} {3}".format(x1, z1, x2, z2))
+        timedOut = False
+        try:
+            pending = [ (x, z) for x in range(cx, cx + TILE) for z in range(cz, cz + TILE) ]
+            deadline = time.monotonic() + TILE_TIMEOUT
+            while pending and self.loadedQuery is not False:
+                x, z = pending[0]
+                res = self.send("execute if loaded {0} 0 {1}".format(x * 16 + 8, z * 16 + 8))
+                if "passed" in res:
+                    self.loadedQuery = True
+                    pending.pop(0)
+                elif "failed" in res:
+                    self.loadedQuery = True
+                    if time.monotonic() > deadline:
+                        timedOut = True
+                        break
+                    time.sleep(POLL_INTERVAL)
+                else:
+                    self.logger.info("execute if loaded not supported by the server. Each tile is given %.1fs", TILE_WAIT)
+                    self.loadedQuery = False
+            if self.loadedQuery is False:
+                time.sleep(TILE_WAIT)
+        finally:
+            self.send("forceload remove {0} {1} {2} {3}".format(x1, z1, x2, z2))
+        return timedOut
+
+    def report(self):
+        with self._lock:
+            cp = dict(self.checkpoint) if self.checkpoint else None
+            recent = list(self.recent)
+        res = { "state": self.state, "delay": round(self.delay, 3), "mspt": self.mspt, "max_mspt": self.maxMspt }
+        if cp is None:
+            return res
+        res.update(cp)
+        res["progress"] = round(100.0 * cp["chunks_done"] / cp["chunks_total"], 2)
+        res["chunks_per_second"] = round(cp["chunks_done"] / cp["seconds"], 2) if cp["seconds"] else None
+        if len(recent) >= 2 and self.state == "running":
+            recentRate = sum(chunks for t, chunks in recent[1:]) / max(recent[-1][0] - recent[0][0], 0.001)
+            res["recent_chunks_per_second"] = round(recentRate, 2)
+            res["eta_seconds"] = round((cp["chunks_total"] - cp["chunks_done"]) / recentRate) if recentRate else None
+        return res
@@ -8,12 +8,20 @@ import socket
 import struct
 import binascii
 import sys
+import threading
 import traceback
 
 tRESPONSE=0
 tCOMMAND=2
 tLOGIN=3
 
+# max payload of a response packet. bigger responses are split in several packets
+MAX_FRAGMENT=4096
+# sanity limit on the length of a packet
+MAX_PACKET_LENGTH=1024*1024
+# seconds to wait for a response on a pooled connection: a hung server does not block the callers forever
+POOL_TIMEOUT=60
+
 class RCONError(Exception):
     """For RCON error management"""
 
@@ -38,139 +46,274 @@ class RconPacket:
     - Pad (2 null bytes)"""
 
     def __init__(self,id,type,payload): #constructor
-        self.length=len(payload)+(2*4)+2 #header excluded
+        self.length=len(payload.encode("UTF-8"))+(2*4)+2 #header excluded
         self.id=id
         self.type=type
         self.payload=payload
 
     def serialize(self):
-         paylen=str(len(self.payload))
-         format='<iii'+paylen+'sh' # see python struct to documentation
-         return struct.pack(format, self.length, self.id, self.type,self.payload.encode("UTF-8"),0x0)
+         payload=self.payload.encode("UTF-8")
+         format='<iii'+str(len(payload))+'sh' # see python struct to documentation
+         return struct.pack(format, self.length, self.id, self.type,payload,0x0)
 
     @staticmethod
     def hydrate(bytebuffer):
         paylen=str(len(bytebuffer)-(3*4)-2)
         format='<iii'+paylen+'sh' # see python struct to documentation
         res=RconPacket(0,0,'')
-        res.lentgth, res.id, res.type, res.payload, tail = struct.unpack(format, bytebuffer)
+        res.length, res.id, res.type, res.payload, tail = struct.unpack(format, bytebuffer)
         res.payload = res.payload.decode("UTF-8")
         return res
 
+    @staticmethod
+    def unpackFrom(buffer, offset, length):
+        """
+        Build a packet from a buffer without copying the buffer.
+        offset is the position of the packet (its length field) and length is the value of the length field.
+        """
+        res=RconPacket(0,0,'')
+        res.length = length
+        res.id, res.type = struct.unpack_from('<ii', buffer, offset+4)
+        res.payload = str(memoryview(buffer)[offset+12:offset+4+length-2], "UTF-8")
+        return res
+
+    @staticmethod
+    def fragment(id, type, payload):
+        """
+        Split a response in several packets whose payload is at most MAX_FRAGMENT bytes long.
+        The payload is never split inside an UTF-8 character.
+        """
+        data = payload.encode("UTF-8")
+        packets = []
+        start = 0
+        while True:
+            end = min(start + MAX_FRAGMENT, len(data))
+            # do not cut an UTF-8 sequence: step back while the first byte of the next fragment is a continuation byte
+            while end < len(data) and end > start and (data[end] & 0xC0) == 0x80:
+                end -= 1
+            packets.append(RconPacket(id, type, data[start:end].decode("UTF-8")))
+            start = end
+            if start >= len(data):
+                return packets
+
+class PacketReader:
+    """
+    Buffered reader of length prefixed RCON packets.
+    The data is received directly in a reusable buffer (recv_into) and several packets received at once are all returned one by one.
+    """
+    BUFFER_SIZE = 8192
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray(PacketReader.BUFFER_SIZE)
+        self.start = 0
+        self.end = 0
+
+    def _fill(self, needed):
+        """Receive data until at least needed bytes are available. Returns False if the connection is closed."""
+        while self.end - self.start < needed:
+            if self.start + needed > len(self.buffer):
+                if needed > len(self.buffer):
+                    # the packet is bigger than the buffer
+                    self.buffer.extend(bytearray(needed - len(self.buffer)))
+                # move the pending bytes at the start of the buffer
+                self.buffer[0:self.end - self.start] = self.buffer[self.start:self.end]
+                self.end -= self.start
+                self.start = 0
+            received = self.sock.recv_into(memoryview(self.buffer)[self.end:])
+            if received == 0:
+                return False
+            self.end += received
+        return True
+
+    def read(self):
+        """Returns the next packet or None if the connection was closed"""
+        if not self._fill(4):
+            return None
+        length = struct.unpack_from('<i', self.buffer, self.start)[0]
+        if length < 10 or length > MAX_PACKET_LENGTH:
+            raise RCONError(str.format("invalid packet length {}", length))
+        if not self._fill(4 + length):
+            return None
+        packet = RconPacket.unpackFrom(self.buffer, self.start, length)
+        self.start += 4 + length
+        if self.start == self.end:
+            self.start = 0
+            self.end = 0
+        return packet
+
 class RCONServerHandler:
 
     def handleRequest(self, command):
         return "Error: not implemented"
 
 class RCONServer:
-    """A very simple blocking RCON server"""
-    BUFFER_SIZE = 1024
-
-    def __init__(self, bindAddr, bindPort, passwd, handler):
+    """
+    A threaded RCON server.
+    Each connection is served by its own thread and can send several commands once authenticated.
+    The number of simultaneous connections is limited and an idle connection is closed after idleTimeout seconds.
+    """
+    MAX_CONNECTIONS = 16
+    IDLE_TIMEOUT = 300
+
+    def __init__(self, bindAddr, bindPort, passwd, handler, maxConnections=MAX_CONNECTIONS, idleTimeout=IDLE_TIMEOUT):
         self.bindPort = bindPort
         self.s = socket.socket()
+        self.s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.s.bind((bindAddr, bindPort))
-        self.s.listen(1)
+        self.s.listen(maxConnections)
         self.password = passwd
         self.handler = handler
+        self.maxConnections = maxConnections
+        self.idleTimeout = idleTimeout
+        self.logger = logging.getLogger(str.format("RCON-SRV/{}", self.bindPort))
+        self._slots = threading.BoundedSemaphore(maxConnections)
+        self._running = True
 
     def run(self):
-        while True: 
-            self.logger = logging.getLogger(str.format("RCON-SRV/{}", self.bindPort))
+        while self._running:
             try:
-                # Establish connection with client. 
+                # Establish connection with client.
                 c, addr = self.s.accept()
-                self.logger.info("Got connection from %s", addr )
-                self.processConnection(c, addr)
-                
-            except struct.error as e:
-                self.logger.error("error: %s", e)
-                c.close()
             except KeyboardInterrupt :
                 self.s.close()
                 return
-            except :
+            except OSError as e:
+                if not self._running:
+                    return
+                self.logger.error("accept error: %s", e)
+                continue
+
+            if not self._slots.acquire(blocking=False):
+                self.logger.warning("Too many connections (%d). Connection from %s rejected", self.maxConnections, addr)
                 c.close()
-                exc_type, exc_value, exc_traceback = sys.exc_info()
-                logging.exception(exc_type)
+                continue
+            self.logger.info("Got connection from %s", addr )
+            threading.Thread(target=self._serve, args=(c, addr), name=str.format("rcon-{}", addr), daemon=True).start()
+
+    def shutdown(self):
+        """Stop accepting new connections. The running sessions end on their own."""
+        self._running = False
+        try:
+            self.s.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.s.close()
 
-    def processConnection(self, c, addr):
-        self.logger = logging.getLogger(str.format("RCON-SRV/{}/{}", self.bindPort, addr))
+    def _serve(self, c, addr):
+        logger = logging.getLogger(str.format("RCON-SRV/{}/{}", self.bindPort, addr))
+        try:
+            c.settimeout(self.idleTimeout)
+            self.processConnection(c, addr, logger)
+        except socket.timeout:
+            logger.info("Connection idle for %ds. Closing", self.idleTimeout)
+        except struct.error as e:
+            logger.error("error: %s", e)
+        except :
+            exc_type, exc_value, exc_traceback = sys.exc_info()
+            logging.exception(exc_type)
+        finally:
+            c.close()
+            self._slots.release()
+
+    def processConnection(self, c, addr, logger):
+        reader = PacketReader(c)
         # Get authentication packet
-        auth=self.receive(c)
+        auth=self.receive(reader, logger)
+        if auth is None:
+            return
 
         # check packet type and password
         if auth.type != tLOGIN or auth.payload != self.password:
             # reply authentication error
-            self.logger.info("Authentication failure")
-            self.reply(c, RconPacket(-1, tCOMMAND,""))
-            c.close()
+            logger.info("Authentication failure")
+            self.reply(c, RconPacket(-1, tCOMMAND,""), logger)
             return
 
         # reply authentication OK
-        self.logger.info("Authentication success")
-        self.reply(c, RconPacket(auth.id, tCOMMAND, ""))
-
-        # Get command packet
-        command=self.receive(c)
-
-        # check packet type
-        if command.type != tCOMMAND :
-            # reply authentication error
-            error = str.format("Error: Command packet expected. But type {type} received", type=command.type)
-            self.logger.error(error)
-            self.reply(c, RconPacket(command.id, tRESPONSE, error))
-            c.close()
-            return
-        
-        # process the command
-        self.logger.info("command received. id=%d cmd=%s", command.id, command.payload)
-        try:
-            respStr = self.handler.handleRequest(command.payload)
-        except:
-            exc_type, exc_value, exc_traceback = sys.exc_info()
-            respStr= str.format("Error: exception cautgh. {}", traceback.format_exception(exc_type, exc_value, exc_traceback)[-1])
-            logging.exception(exc_type)
+        logger.info("Authentication success")
+        self.reply(c, RconPacket(auth.id, tCOMMAND, ""), logger)
+
+        # Serve the commands until the client closes the connection
+        while True:
+            command=self.receive(reader, logger)
+            if command is None:
+                logger.info("Connection closed by the client")
+                return
 
-        # build & send the response
-        if respStr is None:
-            respStr = ""
-        self.reply(c, RconPacket(command.id, tRESPONSE, respStr))
-        c.close()
+            # an empty response packet is used by the clients to detect the end of a multi-packet response: mirror it
+            if command.type == tRESPONSE :
+                self.reply(c, RconPacket(command.id, tRESPONSE, ""), logger)
+                continue
+
+            # check packet type
+            if command.type != tCOMMAND :
+                # reply authentication error
+                error = str.format("Error: Command packet expected. But type {type} received", type=command.type)
+                logger.error(error)
+                self.reply(c, RconPacket(command.id, tRESPONSE, error), logger)
+                return
 
-    def receive(self, c):
-        data = c.recv(RCONServer.BUFFER_SIZE)
-        self.logger.debug("receive:%s", binascii.hexlify(data))
-        return RconPacket.hydrate(data)
+            # process the command
+            logger.info("command received. id=%d cmd=%s", command.id, command.payload)
+            try:
+                respStr = self.handler.handleRequest(command.payload)
+            except:
+                exc_type, exc_value, exc_traceback = sys.exc_info()
+                respStr= str.format("Error: exception cautgh. {}", traceback.format_exception(exc_type, exc_value, exc_traceback)[-1])
+                logging.exception(exc_type)
 
-    def reply(self, c, resp):
-        MESSAGE=resp.serialize()
-        self.logger.debug("send:%s", binascii.hexlify(MESSAGE))
-        c.send(MESSAGE)
+            # build & send the response
+            if respStr is None:
+                respStr = ""
+            self.reply(c, RconPacket.fragment(command.id, tRESPONSE, respStr), logger)
+
+    def receive(self, reader, logger):
+        """Returns the next packet or None if the connection was closed"""
+        packet = reader.read()
+        if packet is not None:
+            logger.debug("receive: id=%d type=%d payload=%s", packet.id, packet.type, packet.payload)
+        return packet
+
+    def reply(self, c, resp, logger):
+        """Send a packet or a list of packets"""
+        packets = resp if isinstance(resp, list) else [ resp ]
+        MESSAGE=b"".join([ p.serialize() for p in packets ])
+        logger.debug("send:%s", binascii.hexlify(MESSAGE))
+        c.sendall(MESSAGE)
 
 class RCONClient:
-    """A very simple RCON client"""
-    BUFFER_SIZE = 1024
+    """
+    A RCON client.
+    A response bigger than MAX_FRAGMENT is received in several packets: to find the end of such a response
+    an empty response packet is sent after the command, the server replies to it once the whole response was sent.
+    """
 
-    def __init__(self, serveradress, serverport, passwd):
+    def __init__(self, serveradress, serverport, passwd, timeout=None):
         self.logger = logging.getLogger(str.format("RCON-CLI/{}", serverport))
         self.id = 0;
+        # True once the last command was written: it may have been run by the server
+        self.commandSent = False
         self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.s.settimeout(timeout)
         try:
             self.s.connect((serveradress, int(serverport)))
         except socket.error as e:
             self.logger.error("Cannot connect to server: %s", e.strerror)
+            self.s.close()
             raise e
+        self.reader = PacketReader(self.s)
 
         auth=RconPacket(self.allocateId(), tLOGIN, passwd)
         MESSAGE=auth.serialize()
         self.logger.debug("authentication %s", binascii.hexlify(MESSAGE))
-        self.s.send(MESSAGE)
+        self.s.sendall(MESSAGE)
 
-        answer=self.receive(self.s)
+        answer=self.receive()
 
         # test authentication response
         if answer.type != tCOMMAND or answer.id != auth.id :
+            self.s.close()
             raise RCONError("authentication failure")
 
         self.logger.info("authentication success ")
@@ -183,14 +326,142 @@ class RCONClient:
         packet=RconPacket(self.allocateId(),tCOMMAND,command)
         MESSAGE=packet.serialize()
         self.logger.debug("command %s", binascii.hexlify(MESSAGE))
-        self.s.send(MESSAGE)
+        self.commandSent = False
+        self.s.sendall(MESSAGE)
+        self.commandSent = True
+
+        answer=self.receive()
+        # a fragment is cut at most 3 bytes before MAX_FRAGMENT to keep the UTF-8 characters whole
+        if len(answer.payload.encode("UTF-8")) < MAX_FRAGMENT - 3:
+            return answer.payload
+
+        # the response may continue in other packets. The sentinel is sent only now because some servers (vanilla)
+        # read a single packet per network read and would drop a sentinel sent with the command.
+        sentinel=RconPacket(self.allocateId(), tRESPONSE, "")
+        self.s.sendall(sentinel.serialize())
+        parts=[ answer.payload ]
+        while True:
+            answer=self.receive()
+            if answer.id == sentinel.id:
+                break
+            if answer.id == packet.id:
+                parts.append(answer.payload)
+        return "".join(parts)
+
+    def sendMany(self, commands):
+        """
+        Pipeline several commands on the connection: all the commands are sent at once and then the responses are read.
+        Each command is followed by a sentinel to delimit its response.
+        Requires a server able to read several packets at once, like RCONServer.
+        Returns the list of the responses in the order of the commands.
+        """
+        ids = []
+        MESSAGE = b""
+        for command in commands:
+            packet=RconPacket(self.allocateId(),tCOMMAND,command)
+            sentinel=RconPacket(self.allocateId(), tRESPONSE, "")
+            ids.append((packet.id, sentinel.id))
+            MESSAGE += packet.serialize() + sentinel.serialize()
+        self.logger.debug("commands %s", binascii.hexlify(MESSAGE))
+        self.s.sendall(MESSAGE)
+
+        responses = { packetId: [] for packetId, sentinelId in ids }
+        sentinels = set([ sentinelId for packetId, sentinelId in ids ])
+        while sentinels:
+            answer=self.receive()
+            if answer.id in sentinels:
+                sentinels.remove(answer.id)
+            elif answer.id in responses:
+                responses[answer.id].append(answer.payload)
+        return [ "".join(responses[packetId]) for packetId, sentinelId in ids ]
+
+    def receive(self):
+        answer=self.reader.read()
+        if answer is None:
+            raise RCONError("connection closed by the server")
+        return answer
+
+    def isAlive(self):
+        """
+        False if the server closed the connection (or sent something unexpected) while it was idle.
+        Nothing is consumed from the connection.
+        """
+        timeout = self.s.gettimeout()
+        self.s.settimeout(0)
+        try:
+            self.s.recv(1, socket.MSG_PEEK)
+            return False
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        finally:
+            self.s.settimeout(timeout)
 
-        answer=self.receive(self.s)
-        return answer.payload
+    def close(self):
+        self.s.close()
+
+class RCONClientPool:
+    """
+    A thread safe pool of persistent RCON connections.
+    At most size connections are opened, the callers wait for a free connection.
+    A broken idle connection (the server restarted) is replaced by a new one. A command is only sent again when it
+    could not be written: once written it may have been run, and stop, save-off, op, ... must not run twice.
+    """
+
+    def __init__(self, serveradress, serverport, passwd, size=4, timeout=POOL_TIMEOUT):
+        self.logger = logging.getLogger(str.format("RCON-POOL/{}", serverport))
+        self.serveradress = serveradress
+        self.serverport = serverport
+        self.passwd = passwd
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._closed = False
+
+    def _connect(self):
+        return RCONClient(self.serveradress, self.serverport, self.passwd, timeout=self.timeout)
 
-    def receive(self, c):
-        data = c.recv(RCONClient.BUFFER_SIZE)
-        return RconPacket.hydrate(data)
+    def send(self, command):
+        with self._slots:
+            with self._lock:
+                if self._closed:
+                    raise RCONError("connection pool closed")
+                client = self._idle.pop() if self._idle else None
+
+            if client is not None and not client.isAlive():
+                self.logger.info("idle connection closed by the server. Reconnecting")
+                client.close()
+                client = None
+            try:
+                if client is None:
+                    client = self._connect()
+                try:
+                    res = client.send(command)
+                except (socket.error, RCONError) as e:
+                    if client.commandSent:
+                        raise
+                    # the command was not written: it is safe to send it on a new connection
+                    self.logger.info("connection lost (%s). Reconnecting", e)
+                    client.close()
+                    client = self._connect()
+                    res = client.send(command)
+            except:
+                if client is not None:
+                    client.close()
+                raise
+
+            with self._lock:
+                if self._closed:
+                    client.close()
+                else:
+                    self._idle.append(client)
+            return res
 
     def close(self):
-        self.s.close()
\ No newline at end of file
+        with self._lock:
+            self._closed = True
+            for client in self._idle:
+                client.close()
+            self._idle = []
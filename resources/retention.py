@@ -0,0 +1,79 @@
+"""
+Retention of the backups: grandfather-father-son tiers and a disk usage budget.
+    - the newest backup of each of the last N hours, days, weeks and months is kept (one count per tier)
+    - then, while the kept backups are over the budget, the oldest ones are removed
+The newest backup is always kept, even over the budget.
+"""
+
+import calendar
+import re
+import time
+
+TIERS = [ ("hourly", "%Y-%m-%d %H"), ("daily", "%Y-%m-%d"), ("weekly", "%G-W%V"), ("monthly", "%Y-%m") ]
+SIZE_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?$", re.IGNORECASE)
+SIZE_UNITS = { "": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4 }
+# the name of the backups: <level-name>_<YYYY-mm-dd_HHhMMmSS>, <level-name>_<YYYY-mm-dd_HHhMM> before the seconds were added
+NAME_DATE_PATTERN = re.compile(r"_(\d{4}-\d{2}-\d{2}_\d{2}h\d{2})(?:m(\d{2}))?(?:\.tar(?:\.\w+)?)?$")
+
+def parseSize(value):
+    """Parse a size like 500M, 20G or 1.5T. Returns the number of bytes, None for an empty value"""
+    if value is None or str(value).strip() == "":
+        return None
+    match = SIZE_PATTERN.match(str(value).strip())
+    if not match:
+        raise ValueError("invalid size {0}. Expected a number of bytes or a size like 500M, 20G".format(value))
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+def nameDate(name):
+    """The creation date of a backup from its name (UTC), None if the name has no date"""
+    match = NAME_DATE_PATTERN.search(name)
+    if not match:
+        return None
+    # the seconds were added to the names later: a backup of an older version has none
+    return calendar.timegm(time.strptime(match.group(1), "%Y-%m-%d_%Hh%M")) + int(match.group(2) or 0)
+
+class Policy:
+
+    def __init__(self, hourly=24, daily=7, weekly=4, monthly=12, budget=None):
+        self.counts = { "hourly": hourly, "daily": daily, "weekly": weekly, "monthly": monthly }
+        self.budget = budget
+
+    def describe(self):
+        res = dict(self.counts)
+        res["budget"] = self.budget
+        return res
+
+    def select(self, backups, totalSize=None):
+        """
+        Select the backups to keep and to remove.
+        backups is a list of dictionaries with at least a name, a created timestamp and a size.
+        totalSize(names) is the disk usage of a set of backups, the sum of their sizes by default
+        (the backups of a snapshot store share their objects).
+        Returns the list of the backups kept and the list of the backups removed, each one with the reason.
+        """
+        if totalSize is None:
+            sizes = { b["name"]: b.get("size") or 0 for b in backups }
+            totalSize = lambda names: sum(sizes[n] for n in names)
+        ordered = sorted(backups, key=lambda b: (b["created"], b["name"]), reverse=True)
+        reasons = {}
+        if ordered:
+            reasons[ordered[0]["name"]] = ["latest"]
+        for tier, pattern in TIERS:
+            count = self.counts[tier]
+            buckets = set()
+            for b in ordered:
+                if len(buckets) >= count:
+                    break
+                bucket = time.strftime(pattern, time.gmtime(b["created"]))
+                if bucket in buckets:
+                    continue
+                buckets.add(bucket)
+                reasons.setdefault(b["name"], []).append(tier)
+
+        kept = [ b for b in ordered if b["name"] in reasons ]
+        removed = [ dict(b, reason="tiers") for b in ordered if b["name"] not in reasons ]
+        if self.budget is not None:
+            while len(kept) > 1 and totalSize([ b["name"] for b in kept ]) > self.budget:
+                removed.append(dict(kept.pop(), reason="budget"))
+        kept = [ dict(b, reason=",".join(reasons[b["name"]])) for b in kept ]
+        return kept, removed
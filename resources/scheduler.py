@@ -0,0 +1,198 @@
+"""
+In-process scheduler of the periodic jobs of the wrapper (backups, cleaning, ...).
+A schedule is either:
+    - hourly, daily, weekly or monthly
+    - an interval: 90s, 30m, 6h, 2d
+    - a cron expression: minute hour day-of-month month day-of-week. ex: "*/30 * * * *", "0 4 * * 1-5"
+The jobs run one after the other in a single thread, so two jobs never run at the same time.
+"""
+
+import logging
+import re
+import threading
+import time
+
+ALIASES = { "hourly": "0 * * * *", "daily": "0 0 * * *", "weekly": "0 0 * * 0", "monthly": "0 0 1 * *" }
+INTERVAL_PATTERN = re.compile(r"^(\d+)([smhd])$")
+INTERVAL_UNITS = { "s": 1, "m": 60, "h": 3600, "d": 86400 }
+# name, min, max
+CRON_FIELDS = [ ("minute", 0, 59), ("hour", 0, 23), ("day of month", 1, 31), ("month", 1, 12), ("day of week", 0, 6) ]
+
+class IntervalSchedule:
+
+    def __init__(self, seconds):
+        if seconds <= 0:
+            raise ValueError("the interval must be positive")
+        self.seconds = seconds
+
+    def next(self, after):
+        return after + self.seconds
+
+    def __str__(self):
+        return "every {0}s".format(self.seconds)
+
+class CronSchedule:
+
+    def __init__(self, expression):
+        self.expression = expression
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError("invalid cron expression '{0}': 5 fields expected".format(expression))
+        self.fields = [ self._parseField(part, name, low, high) for part, (name, low, high) in zip(parts, CRON_FIELDS) ]
+        # day of week 7 is sunday too
+        if 7 in self.fields[4]:
+            self.fields[4].add(0)
+        self.anyDom = parts[2] == "*"
+        self.anyDow = parts[4] == "*"
+
+    @staticmethod
+    def _parseField(field, name, low, high):
+        values = set()
+        for item in field.split(","):
+            rangePart, slash, step = item.partition("/")
+            step = int(step) if slash else 1
+            if rangePart == "*":
+                start, end = low, high
+            elif "-" in rangePart:
+                start, end = [ int(v) for v in rangePart.split("-", 1) ]
+            else:
+                start = end = int(rangePart)
+                if slash:
+                    end = high
+            # day of week accepts 7 for sunday
+            if start < low or end > (7 if name == "day of week" else high) or start > end or step < 1:
+                raise ValueError("invalid {0} '{1}'".format(name, item))
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _dayMatches(self, tm):
+        dom = tm.tm_mday in self.fields[2]
+        # tm_wday: monday is 0, cron: sunday is 0
+        dow = (tm.tm_wday + 1) % 7 in self.fields[4]
+        if self.anyDom and self.anyDow:
+            return True
+        if self.anyDom:
+            return dow
+        if self.anyDow:
+            return dom
+        # both restricted: cron runs when either matches
+        return dom or dow
+
+    def next(self, after):
+        """The first minute (local time) matching the expression strictly after the timestamp after"""
+        t = (int(after) // 60 + 1) * 60
+        # at most ~4 years of days are scanned (the 29th of february)
+        limit = t + 4 * 366 * 86400
+        while t < limit:
+            tm = time.localtime(t)
+            if tm.tm_mon not in self.fields[3] or not self._dayMatches(tm):
+                # next day
+                t = time.mktime((tm.tm_year, tm.tm_mon, tm.tm_mday + 1, 0, 0, 0, 0, 0, -1))
+                continue
+            if tm.tm_hour not in self.fields[1]:
+                t = time.mktime((tm.tm_year, tm.tm_mon, tm.tm_mday, tm.tm_hour + 1, 0, 0, 0, 0, -1))
+                continue
+            if tm.tm_min not in self.fields[0]:
+                t += 60
+                continue
+            return t
+        raise ValueError("the cron expression '{0}' never matches".format(self.expression))
+
+    def __str__(self):
+        return self.expression
+
+def parseSchedule(spec):
+    """Build the schedule of spec. Raises ValueError if spec is invalid"""
+    spec = spec.strip()
+    spec = ALIASES.get(spec.lstrip("@"), spec)
+    match = INTERVAL_PATTERN.match(spec)
+    if match:
+        return IntervalSchedule(int(match.group(1)) * INTERVAL_UNITS[match.group(2)])
+    schedule = CronSchedule(spec)
+    schedule.next(time.time())
+    return schedule
+
+class Job:
+
+    def __init__(self, name, schedule, function):
+        self.name = name
+        self.schedule = schedule
+        self.function = function
+        self.nextRun = schedule.next(time.time())
+        self.lastRun = None
+        self.lastResult = None
+        self.retries = 0
+
+    def describe(self):
+        return { "name": self.name, "schedule": str(self.schedule), "next_run": self.nextRun, "last_run": self.lastRun, "last_result": self.lastResult, "retries": self.retries }
+
+class Scheduler:
+    """
+    Run the jobs in a single thread.
+    A job function may return a number of seconds to be retried later (postponed), otherwise it is run again
+    at the next time of its schedule. The result of the last run is kept in lastResult.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger("SCHEDULER")
+        self.jobs = []
+        self._cond = threading.Condition()
+        self._stopped = False
+        self.thread = None
+
+    def add(self, name, schedule, function):
+        with self._cond:
+            job = Job(name, schedule, function)
+            self.jobs.append(job)
+            self._cond.notify_all()
+        self.logger.info("job %s scheduled %s. next run: %s", name, schedule, time.ctime(job.nextRun))
+        return job
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def list(self):
+        with self._cond:
+            return [ job.describe() for job in sorted(self.jobs, key=lambda j: j.nextRun) ]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    job = min(self.jobs, key=lambda j: j.nextRun) if self.jobs else None
+                    delay = job.nextRun - time.time() if job else None
+                    if delay is not None and delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                if self._stopped:
+                    return
+            self._runJob(job)
+
+    def _runJob(self, job):
+        self.logger.info("running job %s", job.name)
+        job.lastRun = time.time()
+        retry = None
+        try:
+            result = job.function()
+            if isinstance(result, (int, float)) and not isinstance(result, bool):
+                retry = result
+                job.lastResult = "postponed"
+            else:
+                job.lastResult = result if result is not None else "done"
+        except Exception as e:
+            self.logger.exception("job %s failed", job.name)
+            job.lastResult = "failed: {0}".format(e)
+        with self._cond:
+            if retry:
+                job.retries += 1
+                job.nextRun = time.time() + retry
+            else:
+                job.retries = 0
+                job.nextRun = job.schedule.next(time.time())
+        self.logger.info("job %s: %s. next run: %s", job.name, job.lastResult, time.ctime(job.nextRun))
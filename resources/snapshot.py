@@ -0,0 +1,330 @@
+"""
+Content addressed snapshot store for the backups.
+Layout of the store:
+    - objects/xx/yyyy... : the content of the files, compressed with zlib and named after the sha256 of the raw content
+    - snapshots/name.json : the manifest of a snapshot, the list of the files with their hash, mode and mtime
+A file that did not change since the parent snapshot (same size and mtime) is not read again.
+The region files (.mca) are stored chunk by chunk: only the chunks whose timestamp, location or length changed since
+the parent snapshot are read and stored together in a pack object, the others reference the packs of the previous snapshots.
+An object is only written if no other snapshot already contains it.
+The objects are only removed by collectGarbage, once no snapshot references them.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+import zlib
+import anvil
+from concurrent.futures import ThreadPoolExecutor
+
+READ_SIZE = 1024 * 1024
+MANIFEST_VERSION = 2
+
+class SnapshotError(Exception):
+    """For snapshot store error management"""
+
+    def __init__(self, *args):
+        if args :
+            self.message = args[0]
+        else:
+            self.message = None
+
+    def __str__(self):
+        if self.message:
+            return 'Error: {0}'.format(self.message)
+        else:
+            return 'Snapshot error'
+
+def manifestObjects(manifest):
+    """The digests of the objects referenced by a manifest"""
+    digests = set()
+    for entry in manifest["files"]:
+        if "chunks" in entry:
+            digests.update(c[2] for c in entry["chunks"])
+        else:
+            digests.add(entry["hash"])
+    return digests
+
+def objectDigest(path):
+    """The digest of the object at path (xx/yyyy...) relative to the objects dir, None for a temporary file"""
+    prefix, name = os.path.split(path)
+    if name.startswith(".tmp-") or len(prefix) != 2:
+        return None
+    return prefix + name
+
+class SnapshotStore:
+
+    def __init__(self, path, threads=None, level=6):
+        self.logger = logging.getLogger("SNAPSHOT")
+        self.path = path
+        self.objectsDir = os.path.join(path, "objects")
+        self.snapshotsDir = os.path.join(path, "snapshots")
+        self.threads = threads if threads and threads > 0 else (os.cpu_count() or 1)
+        self.level = level
+        os.makedirs(self.objectsDir, exist_ok=True)
+        os.makedirs(self.snapshotsDir, exist_ok=True)
+
+    def objectPath(self, digest):
+        return os.path.join(self.objectsDir, digest[:2], digest[2:])
+
+    def manifestPath(self, name):
+        return os.path.join(self.snapshotsDir, "{0}.json".format(name))
+
+    def list(self):
+        """
+        List the name of the available snapshots, oldest first.
+        """
+        names = [ f[:-5] for f in os.listdir(self.snapshotsDir) if f.endswith(".json") ]
+        names.sort()
+        return names
+
+    def latest(self):
+        names = self.list()
+        if not names:
+            return None
+        return names[-1]
+
+    def readManifest(self, name):
+        path = self.manifestPath(name)
+        if not os.path.isfile(path):
+            raise SnapshotError("snapshot {0} not found".format(name))
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def _storeChunks(self, chunks, level):
+        """
+        Hash and compress a sequence of bytes in a single pass. Returns the digest of the content and True if the object is new.
+        The compressed temporary file is kept only if the object is not already in the store.
+        """
+        sha = hashlib.sha256()
+        compressor = zlib.compressobj(level)
+        fd, tmpPath = tempfile.mkstemp(dir=self.objectsDir, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f_out:
+                for data in chunks:
+                    sha.update(data)
+                    f_out.write(compressor.compress(data))
+                f_out.write(compressor.flush())
+            digest = sha.hexdigest()
+            objPath = self.objectPath(digest)
+            if os.path.isfile(objPath):
+                return digest, False
+            os.makedirs(os.path.dirname(objPath), exist_ok=True)
+            os.rename(tmpPath, objPath)
+            return digest, True
+        finally:
+            if os.path.isfile(tmpPath):
+                os.remove(tmpPath)
+
+    def _storeFile(self, path):
+        def read():
+            with open(path, "rb") as f_in:
+                while True:
+                    data = f_in.read(READ_SIZE)
+                    if not data:
+                        return
+                    yield data
+        return self._storeChunks(read(), self.level)
+
+    def _readObject(self, digest):
+        with open(self.objectPath(digest), "rb") as f:
+            return zlib.decompress(f.read())
+
+    def _snapshotRegion(self, entry, absPath, parentEntry):
+        """
+        Store the chunks of a region file that changed since the parent snapshot in a pack object.
+        Each chunk of the manifest entry is [index, timestamp, pack digest, offset in the pack, length, sector, sector count].
+        The timestamp of a chunk only has a one second resolution: a chunk saved again in the second of the parent
+        snapshot keeps its timestamp, but the server writes it to other sectors. A chunk is only reused if its
+        timestamp, its location in the region file and its length did not change.
+        The chunks are already compressed so the pack is not compressed again.
+        """
+        parentChunks = {}
+        if parentEntry and "chunks" in parentEntry:
+            available = set([ d for d in set([ c[2] for c in parentEntry["chunks"] ]) if os.path.isfile(self.objectPath(d)) ])
+            parentChunks = { c[0]: c for c in parentEntry["chunks"] if c[2] in available }
+            if parentEntry["size"] == entry["size"] and parentEntry["mtime"] == entry["mtime"] and len(parentChunks) == len(parentEntry["chunks"]):
+                # the region file did not change at all
+                entry["chunks"] = parentEntry["chunks"]
+                return entry, False
+
+        chunks = []
+        pack = []
+        packSize = 0
+        with anvil.RegionReader(absPath) as region:
+            for index in range(anvil.CHUNK_COUNT):
+                if not region.hasChunk(index):
+                    continue
+                timestamp = region.timestamps[index]
+                sector, sectorCount = region.locations[index]
+                parentChunk = parentChunks.get(index)
+                # the chunks of a version 1 manifest have no location: they are read again
+                if parentChunk and parentChunk[1:2] + parentChunk[5:7] == [timestamp, sector, sectorCount] and parentChunk[4] == region.chunkSize(index):
+                    chunks.append(list(parentChunk))
+                    continue
+                raw = region.readChunk(index)
+                chunks.append([index, timestamp, None, packSize, len(raw), sector, sectorCount])
+                pack.append(raw)
+                packSize += len(raw)
+
+        new = False
+        if pack:
+            digest, new = self._storeChunks(pack, 0)
+            for chunk in chunks:
+                if chunk[2] is None:
+                    chunk[2] = digest
+        entry["chunks"] = chunks
+        return entry, new
+
+    def _snapshotFile(self, entry, absPath, parentEntry):
+        if entry["path"].endswith(".mca") and entry["size"] >= anvil.HEADER_SIZE:
+            try:
+                return self._snapshotRegion(entry, absPath, parentEntry)
+            except anvil.RegionError as e:
+                self.logger.warning("%s is stored as a plain file. %s", entry["path"], e)
+        elif parentEntry and "hash" in parentEntry and parentEntry["size"] == entry["size"] and parentEntry["mtime"] == entry["mtime"] and os.path.isfile(self.objectPath(parentEntry["hash"])):
+            entry["hash"] = parentEntry["hash"]
+            return entry, False
+        entry["hash"], new = self._storeFile(absPath)
+        return entry, new
+
+    def create(self, srcDir, name, exclude=None, parent=None):
+        """
+        Create a snapshot of srcDir.
+        exclude is an optional function called with the relative path of each file/dir, return True to skip it.
+        parent is the name of the snapshot to compare with, the latest one by default.
+        Returns the manifest of the snapshot. An existing snapshot is never replaced.
+        """
+        if os.path.isfile(self.manifestPath(name)):
+            raise SnapshotError("snapshot {0} already exists".format(name))
+        if parent is None:
+            parent = self.latest()
+        parentFiles = {}
+        if parent:
+            parentFiles = { f["path"]: f for f in self.readManifest(parent)["files"] }
+
+        dirs = []
+        files = []
+        for root, dirnames, filenames in os.walk(srcDir):
+            relRoot = os.path.relpath(root, srcDir)
+            if relRoot == ".":
+                relRoot = ""
+            keptDirs = []
+            for d in dirnames:
+                relPath = os.path.join(relRoot, d)
+                if exclude and exclude(relPath):
+                    continue
+                keptDirs.append(d)
+                dirs.append({ "path": relPath, "mode": os.stat(os.path.join(root, d)).st_mode & 0o7777 })
+            dirnames[:] = keptDirs
+            for f in filenames:
+                relPath = os.path.join(relRoot, f)
+                absPath = os.path.join(root, f)
+                if (exclude and exclude(relPath)) or not os.path.isfile(absPath):
+                    continue
+                st = os.stat(absPath)
+                files.append((relPath, absPath, { "path": relPath, "mode": st.st_mode & 0o7777, "size": st.st_size, "mtime": st.st_mtime_ns }))
+
+        newObjects = 0
+        with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="snapshot") as pool:
+            futures = [ pool.submit(self._snapshotFile, entry, absPath, parentFiles.get(relPath)) for relPath, absPath, entry in files ]
+            entries = []
+            for future in futures:
+                entry, new = future.result()
+                entries.append(entry)
+                if new:
+                    newObjects += 1
+
+        manifest = { "version": MANIFEST_VERSION, "name": name, "parent": parent, "created": time.time(), "dirs": dirs, "files": entries }
+        tmpPath = "{0}.part".format(self.manifestPath(name))
+        with open(tmpPath, "w") as f:
+            json.dump(manifest, f)
+        os.rename(tmpPath, self.manifestPath(name))
+        self.logger.info("snapshot %s created: %d files, %d new objects", name, len(entries), newObjects)
+        return manifest
+
+    def objects(self, name):
+        """The digests of the objects referenced by the snapshot name"""
+        return manifestObjects(self.readManifest(name))
+
+    def objectSize(self, digest):
+        try:
+            return os.path.getsize(self.objectPath(digest))
+        except OSError:
+            return 0
+
+    def remove(self, name):
+        """Remove the manifest of a snapshot. The objects are removed by collectGarbage"""
+        os.remove(self.manifestPath(name))
+
+    def collectGarbage(self):
+        """
+        Remove the objects that are not referenced by any snapshot.
+        Returns the number of objects removed and the number of bytes freed.
+        """
+        referenced = set()
+        for name in self.list():
+            referenced.update(self.objects(name))
+        removed = 0
+        freed = 0
+        for prefix in os.listdir(self.objectsDir):
+            prefixDir = os.path.join(self.objectsDir, prefix)
+            if not os.path.isdir(prefixDir):
+                continue
+            for f in os.listdir(prefixDir):
+                # the temporary files may belong to a snapshot being created
+                if f.startswith(".tmp-") or prefix + f in referenced:
+                    continue
+                path = os.path.join(prefixDir, f)
+                freed += os.path.getsize(path)
+                os.remove(path)
+                removed += 1
+        self.logger.info("garbage collection: %d objects removed, %d bytes freed", removed, freed)
+        return removed, freed
+
+    def restore(self, name, destDir):
+        """
+        Rebuild the snapshot name into destDir. destDir is expected to be empty.
+        """
+        manifest = self.readManifest(name)
+        for d in manifest["dirs"]:
+            path = os.path.join(destDir, d["path"])
+            os.makedirs(path, exist_ok=True)
+            os.chmod(path, d["mode"])
+
+        def restoreRegion(entry, path):
+            packs = {}
+            with anvil.RegionWriter(path) as region:
+                for index, timestamp, digest, offset, length in [ c[:5] for c in entry["chunks"] ]:
+                    if not digest in packs:
+                        if not os.path.isfile(self.objectPath(digest)):
+                            raise SnapshotError("object {0} of {1} is missing".format(digest, entry["path"]))
+                        packs[digest] = self._readObject(digest)
+                    region.writeChunk(index, packs[digest][offset:offset+length], timestamp)
+
+        def restoreFile(entry):
+            path = os.path.join(destDir, entry["path"])
+            if "chunks" in entry:
+                restoreRegion(entry, path)
+            else:
+                objPath = self.objectPath(entry["hash"])
+                if not os.path.isfile(objPath):
+                    raise SnapshotError("object {0} of {1} is missing".format(entry["hash"], entry["path"]))
+                decompressor = zlib.decompressobj()
+                with open(objPath, "rb") as f_in, open(path, "wb") as f_out:
+                    while True:
+                        data = f_in.read(READ_SIZE)
+                        if not data:
+                            break
+                        f_out.write(decompressor.decompress(data))
+                    f_out.write(decompressor.flush())
+            os.chmod(path, entry["mode"])
+            os.utime(path, ns=(entry["mtime"], entry["mtime"]))
+
+        with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="restore") as pool:
+            for future in [ pool.submit(restoreFile, entry) for entry in manifest["files"] ]:
+                future.result()
+        self.logger.info("snapshot %s restored to %s: %d files", name, destDir, len(manifest["files"]))
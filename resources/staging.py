@@ -0,0 +1,101 @@
+"""
+Staging copy of the world used to shorten the time the server stays read-only during a backup.
+The staging directory is a mirror of the working dir kept between the backups:
+only the files whose size or mtime changed are copied again.
+A copy is a reflink (copy on write clone) when the filesystem supports it, a plain copy otherwise.
+Hardlinks are not used: the server rewrites the region files in place, it would modify the staged copy.
+"""
+
+import errno
+import fcntl
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+# linux ioctl to clone a file (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+logger = logging.getLogger("STAGING")
+
+def cloneFile(src, dst):
+    """
+    Copy src to dst with its metadata. Try a reflink first.
+    Returns True if the file was cloned, False if it was copied.
+    """
+    cloned = False
+    try:
+        with open(src, "rb") as f_in, open(dst, "wb") as f_out:
+            fcntl.ioctl(f_out.fileno(), FICLONE, f_in.fileno())
+        cloned = True
+    except OSError as e:
+        if not e.errno in (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.ENOSYS, errno.EBADF):
+            raise
+    if not cloned:
+        shutil.copyfile(src, dst)
+    shutil.copystat(src, dst)
+    return cloned
+
+def sync(srcDir, dstDir, exclude=None, threads=None):
+    """
+    Make dstDir a mirror of srcDir.
+    exclude is an optional function called with the relative path of each file/dir, return True to skip it.
+    Returns some statistics about the synchronization.
+    """
+    stats = { "copied": 0, "cloned": 0, "unchanged": 0, "removed": 0, "bytes": 0 }
+    toCopy = []
+    expected = set()
+    os.makedirs(dstDir, exist_ok=True)
+    for root, dirnames, filenames in os.walk(srcDir):
+        relRoot = os.path.relpath(root, srcDir)
+        if relRoot == ".":
+            relRoot = ""
+        dirnames[:] = [ d for d in dirnames if not (exclude and exclude(os.path.join(relRoot, d))) ]
+        for d in dirnames:
+            relPath = os.path.join(relRoot, d)
+            expected.add(relPath)
+            os.makedirs(os.path.join(dstDir, relPath), exist_ok=True)
+        for f in filenames:
+            relPath = os.path.join(relRoot, f)
+            src = os.path.join(root, f)
+            if (exclude and exclude(relPath)) or not os.path.isfile(src):
+                continue
+            expected.add(relPath)
+            dst = os.path.join(dstDir, relPath)
+            srcStat = os.stat(src)
+            if os.path.isfile(dst):
+                dstStat = os.stat(dst)
+                if dstStat.st_size == srcStat.st_size and dstStat.st_mtime_ns == srcStat.st_mtime_ns:
+                    stats["unchanged"] += 1
+                    continue
+            elif os.path.isdir(dst):
+                shutil.rmtree(dst)
+            toCopy.append((src, dst, srcStat.st_size))
+
+    # remove what is not in the source anymore
+    for root, dirnames, filenames in os.walk(dstDir, topdown=False):
+        relRoot = os.path.relpath(root, dstDir)
+        if relRoot == ".":
+            relRoot = ""
+        for name in filenames + dirnames:
+            relPath = os.path.join(relRoot, name)
+            if relPath in expected:
+                continue
+            path = os.path.join(root, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            stats["removed"] += 1
+
+    with ThreadPoolExecutor(max_workers=threads if threads and threads > 0 else (os.cpu_count() or 1), thread_name_prefix="staging") as pool:
+        futures = [ (pool.submit(cloneFile, src, dst), size) for src, dst, size in toCopy ]
+        for future, size in futures:
+            if future.result():
+                stats["cloned"] += 1
+            else:
+                stats["copied"] += 1
+            stats["bytes"] += size
+
+    logger.info("staging %s to %s: %s", srcDir, dstDir, stats)
+    return stats
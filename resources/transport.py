@@ -0,0 +1,441 @@
+"""
+Transports used to store the backups on a remote location.
+    - LocalTransport: a directory (a mounted network share, a second disk, ...)
+    - SshTransport: a directory on a ssh server. user@host:/path/to/dir
+The archives are uploaded in a temporary .part file, verified and then renamed, so an interrupted transfer
+never leaves a corrupted backup and is resumed on the next try.
+When the remote already has a previous backup, it is used as a basis and only the blocks that changed are sent.
+This mostly resumes interrupted transfers: a compressed archive differs from its first changed byte onwards.
+"""
+
+import abc
+import hashlib
+import logging
+import os
+import shlex
+import shutil
+import subprocess
+import time
+import staging
+import backupcodecs
+
+BLOCK_SIZE = 128 * 1024
+# the key of a new host is accepted on the first connection and kept in the persisted ssh dir: a host whose key
+# changed afterwards is refused
+KNOWN_HOSTS = "/minecraft/ssh/known_hosts"
+SSH_OPTIONS = ["-o", "StrictHostKeyChecking=accept-new", "-o", "UserKnownHostsFile={0}".format(KNOWN_HOSTS)]
+
+class TransportError(Exception):
+    """For transport error management"""
+
+    def __init__(self, *args):
+        if args :
+            self.message = args[0]
+        else:
+            self.message = None
+
+    def __str__(self):
+        if self.message:
+            return 'Error: {0}'.format(self.message)
+        else:
+            return 'Transport error'
+
+def fileDigest(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                return sha.hexdigest()
+            sha.update(data)
+
+def blockCopy(src, dst, basis=None):
+    """
+    Make dst identical to src by rewriting only the blocks of dst that differ.
+    If dst does not exist it starts as a copy of basis (when available), this way only the blocks
+    that changed since the basis are written. An existing dst (interrupted transfer) is resumed the same way.
+    Returns the number of bytes written and the number of bytes reused.
+    """
+    if not os.path.isfile(dst):
+        if basis and os.path.isfile(basis):
+            staging.cloneFile(basis, dst)
+        else:
+            open(dst, "wb").close()
+    written = 0
+    reused = 0
+    with open(src, "rb") as f_in, open(dst, "r+b") as f_out:
+        offset = 0
+        while True:
+            block = f_in.read(BLOCK_SIZE)
+            if not block:
+                break
+            f_out.seek(offset)
+            if f_out.read(len(block)) == block:
+                reused += len(block)
+            else:
+                f_out.seek(offset)
+                f_out.write(block)
+                written += len(block)
+            offset += len(block)
+        f_out.truncate(offset)
+    return written, reused
+
+class Transport(abc.ABC):
+    """
+    Base class of the transports.
+    The names are the names of the archives in the remote directory.
+    A transport missing one of the abstract methods cannot be instantiated.
+    """
+
+    @abc.abstractmethod
+    def list(self):
+        """List the archives on the remote, oldest first"""
+
+    def latest(self):
+        names = self.list()
+        if not names:
+            return None
+        return names[-1]
+
+    @abc.abstractmethod
+    def upload(self, localPath):
+        """Upload a local archive to the remote directory. Returns some statistics about the transfer"""
+
+    @abc.abstractmethod
+    def download(self, name, localPath):
+        """Download an archive of the remote directory"""
+
+    @abc.abstractmethod
+    def open(self, name):
+        """
+        Open an archive of the remote directory as a stream. The returned object must be closed: once the stream was
+        read to its end, close raises a TransportError if the transfer failed
+        """
+
+    @abc.abstractmethod
+    def uploadTree(self, localDir, remoteDir):
+        """Copy the files of localDir missing in remoteDir. Used for the immutable files of the snapshot store"""
+
+    @abc.abstractmethod
+    def downloadTree(self, remoteDir, localDir):
+        """Copy the files of remoteDir missing in localDir. Used for the immutable files of the snapshot store"""
+
+    @abc.abstractmethod
+    def listTree(self, remoteDir):
+        """The files of remoteDir (paths relative to it) and their size"""
+
+    @abc.abstractmethod
+    def remove(self, name):
+        """Remove an archive of the remote directory"""
+
+    def removeMany(self, names):
+        """Remove several files of the remote directory"""
+        for name in names:
+            self.remove(name)
+
+    @abc.abstractmethod
+    def readText(self, name):
+        """Read a small text file of the remote directory. Returns None if the file does not exist"""
+
+    @abc.abstractmethod
+    def writeText(self, name, data):
+        """Replace atomically a small text file of the remote directory"""
+
+class LocalTransport(Transport):
+
+    def __init__(self, path):
+        self.logger = logging.getLogger("TRANSPORT/LOCAL")
+        self.path = path
+
+    def __str__(self):
+        return self.path
+
+    def list(self):
+        names = [ f for f in os.listdir(self.path) if backupcodecs.isArchive(f) ]
+        names.sort(key=lambda f: os.path.getmtime(os.path.join(self.path, f)))
+        return names
+
+    def _transfer(self, src, dst, basis):
+        start = time.monotonic()
+        partPath = "{0}.part".format(dst)
+        written, reused = blockCopy(src, partPath, basis)
+        if fileDigest(src) != fileDigest(partPath):
+            # the part file may have been modified by someone else, start from scratch
+            self.logger.warning("checksum mismatch for %s. Transferring again", dst)
+            os.remove(partPath)
+            written, reused = blockCopy(src, partPath)
+            if fileDigest(src) != fileDigest(partPath):
+                raise TransportError("checksum mismatch for {0}".format(dst))
+        shutil.copystat(src, partPath)
+        os.rename(partPath, dst)
+        stats = { "bytes": written + reused, "sent": written, "reused": reused, "seconds": round(time.monotonic() - start, 3) }
+        self.logger.info("%s transferred to %s: %s", src, dst, stats)
+        return stats
+
+    def upload(self, localPath):
+        name = os.path.basename(localPath)
+        basis = self.latest()
+        return self._transfer(localPath, os.path.join(self.path, name), os.path.join(self.path, basis) if basis else None)
+
+    def download(self, name, localPath):
+        return self._transfer(os.path.join(self.path, name), localPath, None)
+
+    def open(self, name):
+        return open(os.path.join(self.path, name), "rb")
+
+    def _copyTree(self, srcDir, dstDir):
+        copied = 0
+        for root, dirnames, filenames in os.walk(srcDir):
+            relRoot = os.path.relpath(root, srcDir)
+            os.makedirs(os.path.join(dstDir, relRoot), exist_ok=True)
+            for f in filenames:
+                dst = os.path.join(dstDir, relRoot, f)
+                if f.startswith(".tmp-") or os.path.isfile(dst):
+                    continue
+                shutil.copy2(os.path.join(root, f), "{0}.part".format(dst))
+                os.rename("{0}.part".format(dst), dst)
+                copied += 1
+        self.logger.info("%d files copied from %s to %s", copied, srcDir, dstDir)
+        return { "files": copied }
+
+    def uploadTree(self, localDir, remoteDir):
+        return self._copyTree(localDir, os.path.join(self.path, remoteDir))
+
+    def downloadTree(self, remoteDir, localDir):
+        return self._copyTree(os.path.join(self.path, remoteDir), localDir)
+
+    def listTree(self, remoteDir):
+        root = os.path.join(self.path, remoteDir)
+        files = {}
+        for dirpath, dirnames, filenames in os.walk(root):
+            for f in filenames:
+                path = os.path.join(dirpath, f)
+                files[os.path.relpath(path, root)] = os.path.getsize(path)
+        return files
+
+    def remove(self, name):
+        os.remove(os.path.join(self.path, name))
+
+    def readText(self, name):
+        path = os.path.join(self.path, name)
+        if not os.path.isfile(path):
+            return None
+        with open(path, "r") as f:
+            return f.read()
+
+    def writeText(self, name, data):
+        path = os.path.join(self.path, name)
+        with open("{0}.part".format(path), "w") as f:
+            f.write(data)
+        os.rename("{0}.part".format(path), path)
+
+class SshStream:
+    """
+    A stream on the standard output of a ssh command.
+    The end of the stream is also the end of a failed command: once read to its end, close checks the exit status.
+    """
+
+    def __init__(self, command):
+        self.command = command
+        self.proc = subprocess.Popen(command, stdout=subprocess.PIPE)
+        self.eof = False
+
+    def read(self, size=-1):
+        data = self.proc.stdout.read(size)
+        if not data and size != 0:
+            self.eof = True
+        return data
+
+    def close(self):
+        if self.proc.stdout.closed:
+            return
+        # a stream closed before its end is an aborted transfer
+        if self.proc.poll() is None and not self.eof:
+            self.proc.kill()
+        self.proc.stdout.close()
+        self.proc.wait()
+        if self.eof and self.proc.returncode != 0:
+            raise TransportError("{0} failed. returncode={1}".format(" ".join(self.command[-2:]), self.proc.returncode))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class SshTransport(Transport):
+    """
+    The transfers are done by rsync over ssh when rsync is installed locally and on the remote (probed once):
+    interrupted transfers are resumed (--partial-dir), rsync verifies the checksum of each transfered file
+    and the latest remote backup is used as a basis for the delta transfer (--fuzzy).
+    Otherwise scp is used: the whole archive is sent to a .part file, verified with sha256sum and then renamed.
+    """
+
+    def __init__(self, url):
+        self.logger = logging.getLogger("TRANSPORT/SSH")
+        urlParts = url.split(":", 1)
+        if len(urlParts) != 2:
+            raise TransportError("invalid ssh url {0}. Expected user@host:/path/to/dir".format(url))
+        self.userHost = urlParts[0]
+        self.path = urlParts[1]
+        self.rsync = None
+
+    def __str__(self):
+        return "{0}:{1}".format(self.userHost, self.path)
+
+    def hasRsync(self):
+        """True if rsync is installed locally and on the remote. The remote is probed on the first call"""
+        if self.rsync is None:
+            if shutil.which("rsync") is None:
+                self.rsync = False
+            else:
+                sshCmd = ["ssh"] + SSH_OPTIONS + [self.userHost, "command -v rsync"]
+                res = subprocess.run(sshCmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                if res.returncode == 255:
+                    # ssh failed: the next call probes again
+                    raise TransportError("cannot connect to {0}".format(self.userHost))
+                self.rsync = res.returncode == 0
+            if not self.rsync:
+                self.logger.info("rsync is not installed locally or on %s. scp is used", self.userHost)
+        return self.rsync
+
+    def ssh(self, command):
+        sshCmd = ["ssh"] + SSH_OPTIONS + [self.userHost, command]
+        self.logger.debug("%s", sshCmd)
+        return subprocess.check_output(sshCmd).decode("utf-8")
+
+    def remotePath(self, name):
+        return "{0}:{1}".format(self.userHost, os.path.join(self.path, name))
+
+    def list(self):
+        res = self.ssh("ls -1tr {0} 2>/dev/null || true".format(shlex.quote(self.path)))
+        return [ os.path.basename(line.strip()) for line in res.splitlines() if backupcodecs.isArchive(line.strip()) ]
+
+    def _rsync(self, options, src, dst):
+        command = ["rsync", "-e", " ".join(["ssh"] + SSH_OPTIONS), "--times", "--partial-dir=.rsync-partial", "--stats"] + options + [src, dst]
+        self.logger.info("%s", command)
+        start = time.monotonic()
+        res = subprocess.check_output(command).decode("utf-8")
+        stats = { "seconds": round(time.monotonic() - start, 3) }
+        for line in res.splitlines():
+            if line.startswith("Total file size:"):
+                stats["bytes"] = int(line.split(":")[1].split()[0].replace(",", ""))
+            elif line.startswith("Literal data:"):
+                stats["sent"] = int(line.split(":")[1].split()[0].replace(",", ""))
+            elif line.startswith("Matched data:"):
+                stats["reused"] = int(line.split(":")[1].split()[0].replace(",", ""))
+        return stats
+
+    def _scp(self, src, dst):
+        command = ["scp"] + SSH_OPTIONS + [src, dst]
+        self.logger.info("%s", command)
+        start = time.monotonic()
+        subprocess.check_output(command)
+        return { "seconds": round(time.monotonic() - start, 3) }
+
+    def remoteDigest(self, name):
+        """The sha256 of a file of the remote directory. Fails if sha256sum is not available on the remote"""
+        res = self.ssh("sha256sum {0}".format(shlex.quote(os.path.join(self.path, name))))
+        return res.split(" ", 1)[0]
+
+    def _scpUpload(self, localPath):
+        """
+        scp has no resume and no checksum: the archive is sent to a .part file and only renamed once its
+        sha256 on the remote matches the local one. An interrupted upload never leaves a backup under its real name.
+        """
+        name = os.path.basename(localPath)
+        partName = "{0}.part".format(name)
+        stats = self._scp(localPath, self.remotePath(partName))
+        if self.remoteDigest(partName) != fileDigest(localPath):
+            self.remove(partName)
+            raise TransportError("checksum mismatch for {0} on {1}".format(name, self))
+        self.ssh("mv {0} {1}".format(shlex.quote(os.path.join(self.path, partName)), shlex.quote(os.path.join(self.path, name))))
+        stats["bytes"] = os.path.getsize(localPath)
+        return stats
+
+    def _scpDownload(self, name, localPath):
+        partPath = "{0}.part".format(localPath)
+        try:
+            stats = self._scp(self.remotePath(name), partPath)
+            if fileDigest(partPath) != self.remoteDigest(name):
+                raise TransportError("checksum mismatch for {0} downloaded from {1}".format(name, self))
+            os.rename(partPath, localPath)
+        finally:
+            if os.path.isfile(partPath):
+                os.remove(partPath)
+        stats["bytes"] = os.path.getsize(localPath)
+        return stats
+
+    def upload(self, localPath):
+        if self.hasRsync():
+            stats = self._rsync(["--fuzzy"], localPath, self.remotePath(""))
+        else:
+            stats = self._scpUpload(localPath)
+        self.logger.info("%s uploaded to %s: %s", localPath, self, stats)
+        return stats
+
+    def download(self, name, localPath):
+        if self.hasRsync():
+            stats = self._rsync([], self.remotePath(name), localPath)
+        else:
+            stats = self._scpDownload(name, localPath)
+        self.logger.info("%s downloaded from %s: %s", name, self, stats)
+        return stats
+
+    def open(self, name):
+        return SshStream(["ssh"] + SSH_OPTIONS + [self.userHost, "cat {0}".format(shlex.quote(os.path.join(self.path, name)))])
+
+    def uploadTree(self, localDir, remoteDir):
+        if not self.hasRsync():
+            raise TransportError("rsync is required to upload a directory")
+        return self._rsync(["--recursive", "--ignore-existing", "--exclude=.tmp-*"], os.path.join(localDir, ""), self.remotePath(os.path.join(remoteDir, "")))
+
+    def downloadTree(self, remoteDir, localDir):
+        if not self.hasRsync():
+            raise TransportError("rsync is required to download a directory")
+        return self._rsync(["--recursive", "--ignore-existing", "--exclude=.tmp-*"], self.remotePath(os.path.join(remoteDir, "")), os.path.join(localDir, ""))
+
+    def listTree(self, remoteDir):
+        res = self.ssh("cd {0} 2>/dev/null && find . -type f -exec stat -c '%s %n' {{}} + || true".format(shlex.quote(os.path.join(self.path, remoteDir))))
+        files = {}
+        for line in res.splitlines():
+            size, sep, path = line.partition(" ")
+            if sep:
+                files[os.path.normpath(path)] = int(size)
+        return files
+
+    def remove(self, name):
+        self.ssh("rm -f {0}".format(shlex.quote(os.path.join(self.path, name))))
+
+    def removeMany(self, names):
+        if not names:
+            return
+        # the paths are given on the standard input: a single ssh session whatever their number
+        sshCmd = ["ssh"] + SSH_OPTIONS + [self.userHost, "cd {0} && xargs -0 rm -f".format(shlex.quote(self.path))]
+        self.logger.debug("%s", sshCmd)
+        subprocess.run(sshCmd, input="\0".join(names).encode("utf-8"), check=True)
+
+    def readText(self, name):
+        path = shlex.quote(os.path.join(self.path, name))
+        res = self.ssh("if [ -f {0} ]; then echo found; cat {0}; fi".format(path))
+        if not res.startswith("found\n"):
+            return None
+        return res[6:]
+
+    def writeText(self, name, data):
+        path = shlex.quote(os.path.join(self.path, name))
+        sshCmd = ["ssh"] + SSH_OPTIONS + [self.userHost, "cat > {0}.part && mv {0}.part {0}".format(path)]
+        self.logger.debug("%s", sshCmd)
+        subprocess.run(sshCmd, input=data.encode("utf-8"), check=True)
+
+def fromUrl(url):
+    """
+    Build the transport for an url:
+        - /path/to/dir or file:///path/to/dir for a local directory
+        - user@host:/path/to/dir for a ssh server
+    """
+    if url.startswith("file://"):
+        return LocalTransport(url[7:])
+    if url.startswith("/"):
+        return LocalTransport(url)
+    return SshTransport(url)
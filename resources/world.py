@@ -0,0 +1,93 @@
+"""
+Offline optimization of the region files of a world, the minecraft java server must be stopped.
+The game never shrinks a region file: a chunk saved bigger than its sectors is appended at the end of the file and
+its old sectors stay unused. optimize rewrites each .mca file with its chunks packed after the header.
+With minInhabited, the chunks where the players spent less than minInhabited ticks in total (InhabitedTime) are
+dropped as well: the game generates them again from the seed when a player comes close. The entities and the poi
+of a dropped chunk (the files of the same name in the entities and poi directories) are dropped with it.
+"""
+
+import logging
+import os
+import time
+import zlib
+
+import anvil
+import nbt
+
+REGION_DIRS = [ "region", "entities", "poi" ]
+
+def dimensionDirs(worldDir):
+    """The directories of the dimensions of the world: the ones containing a region directory"""
+    for root, dirnames, filenames in os.walk(worldDir):
+        if "region" in dirnames:
+            yield root
+
+def inhabitedTime(data):
+    """The InhabitedTime of the NBT of a chunk (in the Level compound before minecraft 1.18), None if not found"""
+    value = nbt.find(data, "InhabitedTime")
+    if value is None:
+        value = nbt.find(data, "Level", "InhabitedTime")
+    return value
+
+def unvisitedChunks(path, minInhabited):
+    """The indexes of the chunks of the region file inhabited less than minInhabited ticks"""
+    drop = set()
+    with anvil.RegionReader(path) as reader:
+        for i in range(anvil.CHUNK_COUNT):
+            if not reader.hasChunk(i):
+                continue
+            inhabited = inhabitedTime(anvil.chunkData(path, i, reader.readChunk(i)))
+            # a chunk without InhabitedTime is kept: its age is unknown
+            if inhabited is not None and inhabited < minInhabited:
+                drop.add(i)
+    return drop
+
+def optimize(worldDir, minInhabited=None, dryRun=False):
+    """
+    Compact the region files of the world and drop the chunks inhabited less than minInhabited ticks.
+    Nothing is written with dryRun, the report gives what would be reclaimed.
+    A region file that cannot be read is left untouched and reported in errors.
+    """
+    logger = logging.getLogger("WORLD")
+    start = time.monotonic()
+    report = { "dry_run": dryRun, "min_inhabited_ticks": minInhabited, "files": 0, "files_rewritten": 0, "files_removed": 0,
+               "chunks": 0, "chunks_dropped": 0, "bytes_before": 0, "bytes_after": 0, "dimensions": {}, "errors": [] }
+    for dimensionDir in sorted(dimensionDirs(worldDir)):
+        dimension = os.path.relpath(dimensionDir, worldDir)
+        if dimension == ".":
+            dimension = "overworld"
+        totals = report["dimensions"][dimension] = { "files": 0, "chunks_dropped": 0, "bytes_before": 0, "bytes_after": 0 }
+        drops = {}
+        for name in REGION_DIRS:
+            regionDir = os.path.join(dimensionDir, name)
+            if not os.path.isdir(regionDir):
+                continue
+            for filename in sorted(os.listdir(regionDir)):
+                if not anvil.REGION_NAME_PATTERN.match(filename):
+                    continue
+                path = os.path.join(regionDir, filename)
+                try:
+                    if name == "region" and minInhabited:
+                        drops[filename] = unvisitedChunks(path, minInhabited)
+                    res = anvil.compact(path, drops.get(filename, ()), dryRun)
+                except (OSError, EOFError, zlib.error, anvil.RegionError, nbt.NbtError) as e:
+                    logger.error("%s skipped: %s", path, e)
+                    report["errors"].append("{0}: {1}".format(os.path.relpath(path, worldDir), e))
+                    # its entities and poi are not dropped either
+                    drops[filename] = ()
+                    continue
+                report["files"] += 1
+                report["files_rewritten"] += res["rewritten"]
+                report["files_removed"] += res["removed"]
+                report["chunks"] += res["chunks"]
+                totals["files"] += 1
+                for key in [ "chunks_dropped", "bytes_before", "bytes_after" ]:
+                    report[key] += res[key]
+                    totals[key] += res[key]
+        totals["bytes_reclaimed"] = totals["bytes_before"] - totals["bytes_after"]
+    report["bytes_reclaimed"] = report["bytes_before"] - report["bytes_after"]
+    report["seconds"] = round(time.monotonic() - start, 3)
+    logger.info("%s%d region files: %d bytes reclaimed, %d chunks dropped in %.1fs", "dry run, " if dryRun else "",
+                report["files"], report["bytes_reclaimed"], report["chunks_dropped"], report["seconds"])
+    return report
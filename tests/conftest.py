@@ -0,0 +1,7 @@
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+# the modules of the wrapper are installed flat in /usr/local/minecraft, the tests import them the same way
+sys.path.insert(0, os.path.join(ROOT, "resources"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
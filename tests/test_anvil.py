@@ -0,0 +1,81 @@
+import gzip
+import os
+import struct
+import zlib
+import pytest
+import anvil
+import worldgen
+
+def rawChunk(data, compression=anvil.COMPRESSION_ZLIB):
+    return struct.pack(">iB", len(data) + 1, compression) + data
+
+def readAll(path):
+    with anvil.RegionReader(path) as region:
+        return { i: (region.readChunk(i), region.timestamps[i]) for i in range(anvil.CHUNK_COUNT) if region.hasChunk(i) }
+
+def test_write_read_round_trip(tmp_path):
+    path = str(tmp_path / "r.0.0.mca")
+    chunks = { 0: (rawChunk(zlib.compress(b"a" * 100)), 100), 31: (rawChunk(os.urandom(9000)), 200), 1023: (rawChunk(b"x"), 300) }
+    with anvil.RegionWriter(path) as region:
+        for index, (raw, timestamp) in chunks.items():
+            region.writeChunk(index, raw, timestamp)
+    assert readAll(path) == chunks
+    with anvil.RegionReader(path) as region:
+        assert region.chunkSize(31) == len(chunks[31][0])
+        assert region.chunkSize(1) is None
+        assert region.readChunk(1) is None
+        # packed one after the other after the header
+        assert region.locations[0] == (2, 1)
+        assert region.locations[31] == (3, 3)
+        assert region.locations[1023] == (6, 1)
+    assert os.path.getsize(path) == 7 * anvil.SECTOR_SIZE
+
+def test_generated_region_is_readable(tmp_path):
+    path = str(tmp_path / "r.0.0.mca")
+    worldgen.WorldGenerator().region(path, 0, 0, chunks=16)
+    chunks = readAll(path)
+    assert len(chunks) == 16
+    for index, (raw, timestamp) in chunks.items():
+        assert anvil.chunkData(path, index, raw).startswith(b"\x0a")
+
+def test_header_too_short(tmp_path):
+    path = str(tmp_path / "r.0.0.mca")
+    with open(path, "wb") as f:
+        f.write(b"\x00" * 100)
+    with pytest.raises(anvil.RegionError):
+        anvil.RegionReader(path)
+
+def test_invalid_chunk_length(tmp_path):
+    path = str(tmp_path / "r.0.0.mca")
+    with anvil.RegionWriter(path) as region:
+        region.writeChunk(5, rawChunk(b"abc"), 1)
+    with open(path, "r+b") as f:
+        f.seek(2 * anvil.SECTOR_SIZE)
+        f.write(struct.pack(">i", anvil.SECTOR_SIZE * 2))
+    with anvil.RegionReader(path) as region:
+        with pytest.raises(anvil.RegionError):
+            region.readChunk(5)
+
+def test_chunk_too_big(tmp_path):
+    with anvil.RegionWriter(str(tmp_path / "r.0.0.mca")) as region:
+        with pytest.raises(anvil.RegionError):
+            region.writeChunk(0, b"\x00" * (256 * anvil.SECTOR_SIZE), 1)
+
+def test_chunk_data_compressions(tmp_path):
+    path = str(tmp_path / "r.-1.2.mca")
+    assert anvil.chunkData(path, 0, rawChunk(zlib.compress(b"zlib"))) == b"zlib"
+    assert anvil.chunkData(path, 0, rawChunk(gzip.compress(b"gzip"), anvil.COMPRESSION_GZIP)) == b"gzip"
+    assert anvil.chunkData(path, 0, rawChunk(b"none", anvil.COMPRESSION_NONE)) == b"none"
+    with pytest.raises(anvil.RegionError):
+        anvil.chunkData(path, 0, rawChunk(b"", 9))
+    # a chunk too big for the region file is in c.<x>.<z>.mcc
+    index = 3 + 5 * 32
+    external = anvil.externalPath(path, index)
+    assert os.path.basename(external) == "c.-29.69.mcc"
+    with open(external, "wb") as f:
+        f.write(zlib.compress(b"external"))
+    assert anvil.chunkData(path, index, rawChunk(b"", anvil.COMPRESSION_ZLIB | anvil.EXTERNAL)) == b"external"
+
+def test_external_path_of_a_badly_named_file():
+    with pytest.raises(anvil.RegionError):
+        anvil.externalPath("/tmp/region.mca", 0)
@@ -0,0 +1,100 @@
+import gzip
+import io
+import os
+import tarfile
+import pytest
+import backupcodecs
+
+class SlowSource:
+    """A non seekable stream returning at most size bytes per read, like a pipe"""
+
+    def __init__(self, data, size=7):
+        self.data = data
+        self.offset = 0
+        self.size = size
+
+    def read(self, size=-1):
+        size = self.size if size is None or size < 0 else min(size, self.size)
+        data = self.data[self.offset:self.offset + size]
+        self.offset += len(data)
+        return data
+
+def readAll(reader, size):
+    parts = []
+    while True:
+        data = reader.read(size)
+        if not data:
+            return b"".join(parts)
+        assert len(data) <= size
+        parts.append(data)
+
+def tarOf(files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w|") as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+@pytest.mark.parametrize("name", backupcodecs.NAMES)
+def test_round_trip(name, tmp_path):
+    codec = backupcodecs.get(name)
+    if not codec.available():
+        pytest.skip("the python module {0} is not installed".format(codec.module))
+    files = { "world/level.dat": os.urandom(5000), "world/region/r.0.0.mca": b"chunk" * 100000, "empty": b"" }
+    raw = tarOf(files)
+    out = io.BytesIO()
+    writer = codec.writer(out, threads=2)
+    for offset in range(0, len(raw), 65536):
+        writer.write(raw[offset:offset + 65536])
+    writer.close()
+    compressed = out.getvalue()
+    assert backupcodecs.detect(compressed[:backupcodecs.MAGIC_SIZE]) is codec
+
+    detected, reader = backupcodecs.openReader(SlowSource(compressed))
+    assert detected is codec
+    assert readAll(reader, 13) == raw
+
+    detected, reader = backupcodecs.openReader(SlowSource(compressed, 4096))
+    with tarfile.open(fileobj=reader, mode="r|") as tar:
+        restored = { m.name: tar.extractfile(m).read() for m in tar if m.isfile() }
+    assert restored == files
+
+def test_concatenated_gzip_members():
+    members = [ b"first member " * 1000, b"", os.urandom(300000), b"last" ]
+    compressed = b"".join(gzip.compress(m) for m in members)
+    codec, reader = backupcodecs.openReader(SlowSource(compressed, 1000))
+    assert codec.name == "gzip"
+    assert readAll(reader, 777) == b"".join(members)
+    codec, reader = backupcodecs.openReader(io.BytesIO(compressed))
+    assert reader.read() == b"".join(members)
+
+def test_empty_stream():
+    codec, reader = backupcodecs.openReader(io.BytesIO(b""))
+    assert codec.name == "none"
+    assert reader.read(10) == b""
+    assert backupcodecs.detect(b"").name == "none"
+
+def test_empty_gzip():
+    out = io.BytesIO()
+    backupcodecs.get("gzip").writer(out).close()
+    codec, reader = backupcodecs.openReader(SlowSource(out.getvalue()))
+    assert codec.name == "gzip"
+    assert reader.read() == b""
+
+def test_plain_tar_is_detected():
+    raw = tarOf({ "a": b"data" })
+    codec, reader = backupcodecs.openReader(SlowSource(raw))
+    assert codec.name == "none"
+    assert readAll(reader, 5) == raw
+
+def test_names():
+    assert backupcodecs.isArchive("world_2026-03-10_12h30m15.tar.zst")
+    assert backupcodecs.isArchive("world.tar")
+    assert not backupcodecs.isArchive("world.tar.gz.part")
+    assert backupcodecs.archiveBase("world_2026-03-10_12h30m15.tar.gz") == "world_2026-03-10_12h30m15"
+    with pytest.raises(backupcodecs.CodecError):
+        backupcodecs.get("brotli")
+    with pytest.raises(backupcodecs.CodecError):
+        backupcodecs.get("gzip").writer(io.BytesIO(), level=42)
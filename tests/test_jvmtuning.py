@@ -0,0 +1,39 @@
+import jvmtuning
+
+MB = jvmtuning.MB
+
+def heapOptions(res):
+    return [ o for o in res["options"] if o.startswith("-Xm") ]
+
+def test_heap_fits_in_a_small_container():
+    res = jvmtuning.tune(300 * MB, 1)
+    # half of the memory is left outside of the heap, the heap is not raised to MIN_HEAP
+    assert res["heap_mb"] == 150
+    assert heapOptions(res) == [ "-Xms150M", "-Xmx150M" ]
+    assert "warning" in res
+
+def test_overhead():
+    assert jvmtuning.tune(2048 * MB, 2)["heap_mb"] == 2048 - 768
+    assert jvmtuning.tune(4096 * MB, 2)["heap_mb"] == 3276
+    assert jvmtuning.tune(16384 * MB, 4)["heap_mb"] == 13107
+    assert "warning" not in jvmtuning.tune(1024 * MB, 2)
+
+def test_no_memory_limit_keeps_the_configured_heap():
+    res = jvmtuning.tune(None, 4, 1024, 4096)
+    assert heapOptions(res) == [ "-Xms1024M", "-Xmx4096M" ]
+    assert "-XX:+AlwaysPreTouch" not in res["options"]
+    assert "warning" not in res
+
+def test_garbage_collector():
+    assert jvmtuning.tune(4096 * MB, 1)["gc"] == "serial"
+    assert jvmtuning.tune(4096 * MB, 4)["gc"] == "g1"
+    assert jvmtuning.tune(32768 * MB, 8)["gc"] == "z"
+    assert "-XX:ParallelGCThreads=3" in jvmtuning.tune(4096 * MB, 2.5)["options"]
+
+def test_cgroup_v2_limits(tmp_path):
+    (tmp_path / "memory.max").write_text("314572800\n")
+    (tmp_path / "cpu.max").write_text("150000 100000\n")
+    assert jvmtuning.memoryLimit(str(tmp_path)) == 300 * MB
+    assert jvmtuning.cpuLimit(str(tmp_path)) == min(1.5, jvmtuning.cpuLimit(str(tmp_path / "none")))
+    (tmp_path / "memory.max").write_text("max\n")
+    assert jvmtuning.memoryLimit(str(tmp_path)) is None
@@ -0,0 +1,81 @@
+import gzip
+import struct
+import pytest
+import nbt
+import worldgen
+
+VALUE = {
+    "byte": nbt.byte(-3),
+    "short": nbt.short(1000),
+    "int": 123456,
+    "long": nbt.long(-(1 << 40)),
+    "float": nbt.float32(0.5),
+    "double": 1.25,
+    "bytes": b"\x00\x01\xff",
+    "string": "héllo",
+    "list": [ "a", "b" ],
+    "empty": [],
+    "ints": nbt.ints([ 1, -2, 3 ]),
+    "longs": nbt.longs([ 1 << 50, -1 ]),
+    "nested": { "compounds": [ { "x": 1 }, { "x": 2 } ], "InhabitedTime": nbt.long(42) },
+    "InhabitedTime": nbt.long(7),
+}
+
+def test_encode_decode_round_trip():
+    name, value = nbt.decode(nbt.encode(VALUE, "root"))
+    assert name == "root"
+    assert value == {
+        "byte": -3, "short": 1000, "int": 123456, "long": -(1 << 40), "float": 0.5, "double": 1.25,
+        "bytes": b"\x00\x01\xff", "string": "héllo", "list": [ "a", "b" ], "empty": [], "ints": [ 1, -2, 3 ],
+        "longs": [ 1 << 50, -1 ], "nested": { "compounds": [ { "x": 1 }, { "x": 2 } ], "InhabitedTime": 42 }, "InhabitedTime": 7,
+    }
+
+def test_raw_payload():
+    payload = nbt.encodePayload([ 1, 2, 3 ])
+    assert payload == struct.pack(">bi3i", nbt.TAG_INT, 3, 1, 2, 3)
+    assert nbt.decode(nbt.encode({ "list": nbt.Raw(nbt.TAG_LIST, payload) }))[1] == { "list": [ 1, 2, 3 ] }
+
+def test_find():
+    data = nbt.encode(VALUE)
+    # the tags before it are skipped, whatever their type
+    assert nbt.find(data, "InhabitedTime") == 7
+    assert nbt.find(data, "nested", "InhabitedTime") == 42
+    assert nbt.find(data, "nested", "compounds") == [ { "x": 1 }, { "x": 2 } ]
+    assert nbt.find(data, "missing") is None
+    assert nbt.find(data, "nested", "missing") is None
+    # not a compound
+    assert nbt.find(data, "int", "InhabitedTime") is None
+
+def test_find_in_a_generated_chunk():
+    data = worldgen.WorldGenerator().chunk(3, -4)
+    assert nbt.find(data, "xPos") == 3
+    assert nbt.find(data, "zPos") == -4
+    assert nbt.find(data, "Status") == "minecraft:full"
+    assert nbt.find(data, "InhabitedTime") == nbt.decode(data)[1]["InhabitedTime"]
+
+def test_truncated_data():
+    data = nbt.encode(VALUE)
+    with pytest.raises(nbt.NbtError):
+        nbt.decode(data[:-10])
+    with pytest.raises(nbt.NbtError):
+        nbt.find(data[:-10], "InhabitedTime")
+
+def test_root_is_not_a_compound():
+    with pytest.raises(nbt.NbtError):
+        nbt.decode(b"\x08\x00\x00")
+    with pytest.raises(nbt.NbtError):
+        nbt.find(b"", "x")
+
+def test_too_deep():
+    data = b"\x0a\x00\x00" + b"\x0a\x00\x01a" * (nbt.MAX_DEPTH + 2) + b"\x00" * (nbt.MAX_DEPTH + 3)
+    with pytest.raises(nbt.NbtError):
+        nbt.decode(data)
+
+def test_read_file(tmp_path):
+    data = nbt.encode({ "Data": { "LevelName": "world" } })
+    with gzip.open(str(tmp_path / "level.dat"), "wb") as f:
+        f.write(data)
+    with open(str(tmp_path / "raw.dat"), "wb") as f:
+        f.write(data)
+    assert nbt.readFile(str(tmp_path / "level.dat")) == data
+    assert nbt.readFile(str(tmp_path / "raw.dat")) == data
@@ -0,0 +1,56 @@
+import gzip
+import io
+import os
+import random
+import struct
+import zlib
+import pytest
+import pgzip
+
+def sample(size):
+    """Compressible data whose repetitions cross the block boundaries: they reference the dictionary of the previous block"""
+    rng = random.Random(size)
+    words = [ rng.randbytes(rng.randint(3, 40)) for i in range(500) ]
+    out = bytearray()
+    while len(out) < size:
+        out += rng.choice(words)
+        if rng.random() < 0.01:
+            out += os.urandom(rng.randint(1, 2000))
+    return bytes(out[:size])
+
+def compress(data, threads, writeSize=100000, blockSize=pgzip.BLOCK_SIZE):
+    out = io.BytesIO()
+    writer = pgzip.ParallelGzipWriter(out, level=6, threads=threads, blockSize=blockSize)
+    for offset in range(0, len(data), writeSize):
+        writer.write(data[offset:offset + writeSize])
+    writer.close()
+    return out.getvalue()
+
+@pytest.mark.parametrize("size", [ 0, 1, 1000, pgzip.BLOCK_SIZE - 1, pgzip.BLOCK_SIZE, pgzip.BLOCK_SIZE + 1, 3 * pgzip.BLOCK_SIZE + 12345 ])
+@pytest.mark.parametrize("threads", [ 1, 4 ])
+def test_round_trip(size, threads):
+    data = sample(size)
+    compressed = compress(data, threads)
+    assert gzip.decompress(compressed) == data
+    # the trailer: crc32 and size of the uncompressed data
+    assert struct.unpack("<II", compressed[-8:]) == (zlib.crc32(data), size)
+
+def test_threads_do_not_change_the_output():
+    data = sample(3 * pgzip.BLOCK_SIZE + 777)
+    single, parallel = compress(data, 1), compress(data, 8, writeSize=33333)
+    # the header contains the time
+    assert single[10:] == parallel[10:]
+
+def test_dictionary_is_carried_between_blocks():
+    data = sample(4 * 65536)
+    small = compress(data, 4, blockSize=65536)
+    assert gzip.decompress(small) == data
+    # primed with the previous block, the ratio stays close to a single deflate stream
+    assert len(small) < len(zlib.compress(data, 6)) * 1.02
+
+def test_write_after_close():
+    writer = pgzip.ParallelGzipWriter(io.BytesIO())
+    writer.close()
+    writer.close()
+    with pytest.raises(ValueError):
+        writer.write(b"data")
@@ -0,0 +1,94 @@
+import socket
+import threading
+import pytest
+import rcon
+
+PASSWORD = "test"
+
+class EchoHandler(rcon.RCONServerHandler):
+
+    def handleRequest(self, command):
+        if command.startswith("repeat "):
+            text, count = command[7:].rsplit(" ", 1)
+            return text * int(count)
+        return command
+
+@pytest.fixture
+def server():
+    server = rcon.RCONServer("127.0.0.1", 0, PASSWORD, EchoHandler())
+    threading.Thread(target=server.run, daemon=True).start()
+    yield server.s.getsockname()[1]
+    server.shutdown()
+
+def test_fragment():
+    payload = "a" * (rcon.MAX_FRAGMENT * 2 + 10)
+    packets = rcon.RconPacket.fragment(7, rcon.tRESPONSE, payload)
+    assert [ len(p.payload) for p in packets ] == [ rcon.MAX_FRAGMENT, rcon.MAX_FRAGMENT, 10 ]
+    assert all(p.id == 7 and p.type == rcon.tRESPONSE for p in packets)
+    assert len(rcon.RconPacket.fragment(7, rcon.tRESPONSE, "")) == 1
+
+def test_fragment_keeps_the_utf8_characters_whole():
+    # 3 bytes per character: a fragment boundary falls inside a character
+    payload = "€" * 3000
+    packets = rcon.RconPacket.fragment(1, rcon.tRESPONSE, payload)
+    assert "".join(p.payload for p in packets) == payload
+    assert all(len(p.payload.encode("UTF-8")) <= rcon.MAX_FRAGMENT for p in packets)
+    assert len(packets[0].payload.encode("UTF-8")) > rcon.MAX_FRAGMENT - 3
+
+def test_packet_reader_splits_and_joins_the_packets():
+    a, b = socket.socketpair()
+    try:
+        reader = rcon.PacketReader(b)
+        big = "x" * (rcon.PacketReader.BUFFER_SIZE * 2)
+        data = b"".join(rcon.RconPacket(i, rcon.tCOMMAND, p).serialize() for i, p in enumerate([ "one", "two", big, "three" ]))
+        # several packets in one read, then a packet received in pieces
+        a.sendall(data[:40])
+        assert (reader.read().id, reader.read().payload) == (0, "two")
+        sender = threading.Thread(target=lambda: [ a.sendall(data[i:i + 1000]) for i in range(40, len(data), 1000) ])
+        sender.start()
+        assert reader.read().payload == big
+        assert reader.read().payload == "three"
+        sender.join()
+        a.close()
+        assert reader.read() is None
+    finally:
+        a.close()
+        b.close()
+
+def test_packet_reader_rejects_an_invalid_length():
+    a, b = socket.socketpair()
+    try:
+        a.sendall(b"\x02\x00\x00\x00")
+        with pytest.raises(rcon.RCONError):
+            rcon.PacketReader(b).read()
+    finally:
+        a.close()
+        b.close()
+
+def test_multi_packet_response(server):
+    client = rcon.RCONClient("127.0.0.1", server, PASSWORD, timeout=10)
+    try:
+        assert client.send("hello") == "hello"
+        big = client.send("repeat é€ 5000")
+        assert big == "é€" * 5000
+        # the connection is still in sync after the sentinel
+        assert client.send("after") == "after"
+        assert client.sendMany([ "a", "repeat b 10000", "c" ]) == [ "a", "b" * 10000, "c" ]
+    finally:
+        client.close()
+
+def test_authentication_failure(server):
+    with pytest.raises(rcon.RCONError):
+        rcon.RCONClient("127.0.0.1", server, "wrong", timeout=10)
+
+def test_concurrent_sessions(server):
+    clients = [ rcon.RCONClient("127.0.0.1", server, PASSWORD, timeout=10) for i in range(4) ]
+    try:
+        # a session stays open while the others send their commands
+        for i, client in enumerate(clients):
+            assert client.send("client {0}".format(i)) == "client {0}".format(i)
+        for i, client in enumerate(reversed(clients)):
+            assert client.send("again {0}".format(i)) == "again {0}".format(i)
+    finally:
+        for client in clients:
+            client.close()
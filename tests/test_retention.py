@@ -0,0 +1,79 @@
+import calendar
+import time
+import pytest
+import retention
+
+def utc(year, month, day, hour=0, minute=0):
+    return calendar.timegm((year, month, day, hour, minute, 0, 0, 0, 0))
+
+def backups(dates, size=100):
+    return [ { "name": "world_{0}".format(time.strftime("%Y-%m-%d_%Hh%Mm%S", time.gmtime(d))), "created": d, "size": size } for d in dates ]
+
+def names(selected):
+    return sorted(b["name"] for b in selected)
+
+def test_parse_size():
+    assert retention.parseSize("") is None
+    assert retention.parseSize(None) is None
+    assert retention.parseSize("1024") == 1024
+    assert retention.parseSize("500M") == 500 * 1024 ** 2
+    assert retention.parseSize("1.5G") == int(1.5 * 1024 ** 3)
+    assert retention.parseSize("2TiB") == 2 * 1024 ** 4
+    assert retention.parseSize("20g") == 20 * 1024 ** 3
+    with pytest.raises(ValueError):
+        retention.parseSize("twenty")
+
+def test_name_date():
+    assert retention.nameDate("world_2026-03-10_12h30m15.tar.gz") == utc(2026, 3, 10, 12, 30) + 15
+    assert retention.nameDate("world_2026-03-10_12h30m15") == utc(2026, 3, 10, 12, 30) + 15
+    # the names of the older versions have no seconds
+    assert retention.nameDate("my_world_2026-03-10_12h30.tar.gz") == utc(2026, 3, 10, 12, 30)
+    assert retention.nameDate("world.tar.gz") is None
+
+def test_tiers():
+    # every 30 minutes for 3 days
+    now = utc(2026, 3, 10, 12, 0)
+    candidates = backups([ now - i * 1800 for i in range(3 * 48) ])
+    kept, removed = retention.Policy(hourly=3, daily=2, weekly=0, monthly=0).select(candidates)
+    assert len(kept) + len(removed) == len(candidates)
+    reasons = { b["name"]: b["reason"] for b in kept }
+    latest = candidates[0]["name"]
+    # the newest backup of the last 3 hours, and of the last 2 days
+    assert reasons[latest] == "latest,hourly,daily"
+    assert names(b for b in kept if "hourly" in b["reason"]) == names(backups([ now, now - 1800, now - 5400 ]))
+    assert names(b for b in kept if "daily" in b["reason"]) == names(backups([ now, utc(2026, 3, 9, 23, 30) ]))
+    assert len(kept) == 4
+    assert all(b["reason"] == "tiers" for b in removed)
+
+def test_weekly_and_monthly():
+    now = utc(2026, 3, 10)
+    candidates = backups([ now - i * 86400 for i in range(90) ])
+    kept, removed = retention.Policy(hourly=0, daily=0, weekly=2, monthly=3).select(candidates)
+    # 2026-03-10 is a tuesday: the newest of this week is today, of the previous week sunday 2026-03-08
+    assert names(b for b in kept if "weekly" in b["reason"]) == names(backups([ now, utc(2026, 3, 8) ]))
+    assert names(b for b in kept if "monthly" in b["reason"]) == names(backups([ now, utc(2026, 2, 28), utc(2026, 1, 31) ]))
+
+def test_budget_removes_the_oldest():
+    now = utc(2026, 3, 10)
+    candidates = backups([ now - i * 86400 for i in range(5) ])
+    kept, removed = retention.Policy(hourly=0, daily=5, weekly=0, monthly=0, budget=250).select(candidates)
+    assert names(kept) == names(candidates[:2])
+    assert names(b for b in removed if b["reason"] == "budget") == names(candidates[2:])
+
+def test_latest_is_always_kept():
+    candidates = backups([ utc(2026, 3, 10), utc(2026, 3, 9) ], size=1000)
+    kept, removed = retention.Policy(0, 0, 0, 0, budget=10).select(candidates)
+    assert names(kept) == names(candidates[:1])
+    assert kept[0]["reason"] == "latest"
+    assert retention.Policy().select([]) == ([], [])
+
+def test_shared_size():
+    """The snapshots of a store share their objects: the budget uses the size of the union"""
+    now = utc(2026, 3, 10)
+    candidates = backups([ now - i * 86400 for i in range(4) ])
+    objects = { b["name"]: { "shared", b["name"] } for b in candidates }
+    sizes = dict({ "shared": 1000 }, **{ b["name"]: 10 for b in candidates })
+    totalSize = lambda selected: sum(sizes[o] for o in set().union(*[ objects[n] for n in selected ]))
+    kept, removed = retention.Policy(hourly=0, daily=4, weekly=0, monthly=0, budget=1030).select(candidates, totalSize)
+    assert names(kept) == names(candidates[:3])
+    assert names(removed) == names(candidates[3:])
@@ -0,0 +1,74 @@
+import time
+import pytest
+import scheduler
+
+def localTime(year, month, day, hour=0, minute=0):
+    return time.mktime((year, month, day, hour, minute, 0, 0, 0, -1))
+
+def test_intervals():
+    assert scheduler.parseSchedule("90s").next(1000) == 1090
+    assert scheduler.parseSchedule("30m").next(1000) == 1000 + 1800
+    assert scheduler.parseSchedule("6h").seconds == 6 * 3600
+    assert scheduler.parseSchedule(" 2d ").seconds == 2 * 86400
+    with pytest.raises(ValueError):
+        scheduler.IntervalSchedule(0)
+
+def test_aliases():
+    assert str(scheduler.parseSchedule("hourly")) == "0 * * * *"
+    assert str(scheduler.parseSchedule("@daily")) == "0 0 * * *"
+    assert str(scheduler.parseSchedule("weekly")) == "0 0 * * 0"
+    assert str(scheduler.parseSchedule("monthly")) == "0 0 1 * *"
+
+@pytest.mark.parametrize("spec", [ "", "* * * *", "60 * * * *", "* 24 * * *", "* * 0 * *", "* * * 13 *", "* * * * 8",
+                                   "5-1 * * * *", "*/0 * * * *", "a * * * *", "0 0 31 2 *" ])
+def test_invalid(spec):
+    with pytest.raises(ValueError):
+        scheduler.parseSchedule(spec)
+
+def test_fields():
+    cron = scheduler.CronSchedule("*/15 1,3-4 * * 1-5/2")
+    assert cron.fields[0] == { 0, 15, 30, 45 }
+    assert cron.fields[1] == { 1, 3, 4 }
+    assert cron.fields[4] == { 1, 3, 5 }
+    assert scheduler.CronSchedule("5/20 * * * *").fields[0] == { 5, 25, 45 }
+    # 7 is sunday too
+    assert 0 in scheduler.CronSchedule("0 0 * * 7").fields[4]
+
+def test_next():
+    cron = scheduler.parseSchedule("*/30 * * * *")
+    assert cron.next(localTime(2026, 3, 10, 12, 0)) == localTime(2026, 3, 10, 12, 30)
+    assert cron.next(localTime(2026, 3, 10, 12, 0) - 1) == localTime(2026, 3, 10, 12, 0)
+    assert cron.next(localTime(2026, 3, 10, 23, 45)) == localTime(2026, 3, 11, 0, 0)
+    # monday to friday at 4:00. 2026-03-13 is a friday
+    cron = scheduler.parseSchedule("0 4 * * 1-5")
+    assert cron.next(localTime(2026, 3, 13, 5, 0)) == localTime(2026, 3, 16, 4, 0)
+    assert cron.next(localTime(2026, 12, 31, 12, 0)) == localTime(2027, 1, 1, 4, 0)
+    # the 29th of february
+    assert scheduler.parseSchedule("0 0 29 2 *").next(localTime(2026, 3, 1)) == localTime(2028, 2, 29)
+
+def test_day_of_month_or_day_of_week():
+    # both restricted: the 1st of the month or a sunday. 2026-03-01 is a sunday
+    cron = scheduler.parseSchedule("0 0 1 * 0")
+    assert cron.next(localTime(2026, 3, 1)) == localTime(2026, 3, 8)
+    assert cron.next(localTime(2026, 3, 29)) == localTime(2026, 4, 1)
+
+def test_jobs_run_and_are_postponed():
+    sched = scheduler.Scheduler()
+    runs = []
+    def job():
+        runs.append(time.time())
+        return 0.05 if len(runs) == 1 else "ran"
+    added = sched.add("job", scheduler.IntervalSchedule(3600), job)
+    added.nextRun = time.time()
+    sched.start()
+    try:
+        deadline = time.time() + 5
+        while sched.list()[0]["last_result"] != "ran" and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        sched.stop()
+    assert len(runs) == 2
+    description = sched.list()[0]
+    assert description["last_result"] == "ran"
+    assert description["retries"] == 0
+    assert description["next_run"] > time.time() + 3000
@@ -0,0 +1,60 @@
+import os
+import struct
+import anvil
+import snapshot
+import worldgen
+
+def regionChunks(path):
+    with anvil.RegionReader(path) as region:
+        return { i: (region.readChunk(i), region.timestamps[i]) for i in range(anvil.CHUNK_COUNT) if region.hasChunk(i) }
+
+def test_restore_is_identical(tmp_path):
+    worldgen.WorldGenerator().generate(str(tmp_path / "server"), regions=1, chunks=64, players=1)
+    store = snapshot.SnapshotStore(str(tmp_path / "store"), threads=2)
+    store.create(str(tmp_path / "server"), "first")
+    store.restore("first", str(tmp_path / "restored"))
+    region = os.path.join("world", "region", "r.-1.-1.mca")
+    assert regionChunks(str(tmp_path / "restored" / region)) == regionChunks(str(tmp_path / "server" / region))
+    with open(str(tmp_path / "server" / "world" / "level.dat"), "rb") as a, open(str(tmp_path / "restored" / "world" / "level.dat"), "rb") as b:
+        assert a.read() == b.read()
+
+def test_chunk_saved_in_the_same_second_is_stored(tmp_path):
+    """A chunk saved again with the same timestamp as in the parent snapshot must not be reused from the parent"""
+    gen = worldgen.WorldGenerator()
+    gen.generate(str(tmp_path / "server"), regions=1, chunks=64, players=0)
+    store = snapshot.SnapshotStore(str(tmp_path / "store"), threads=2)
+    store.create(str(tmp_path / "server"), "first")
+
+    path = str(tmp_path / "server" / "world" / "region" / "r.-1.-1.mca")
+    with anvil.RegionReader(path) as region:
+        index = next(i for i in range(anvil.CHUNK_COUNT) if region.hasChunk(i))
+        timestamp = region.timestamps[index]
+    # saved like the game: written at the end of the file, the timestamp of the header is unchanged
+    raw = gen.rawChunk(1000, 1000)
+    count = (len(raw) + anvil.SECTOR_SIZE - 1) // anvil.SECTOR_SIZE
+    with open(path, "r+b") as f:
+        sector = f.seek(0, os.SEEK_END) // anvil.SECTOR_SIZE
+        f.write(raw + b"\x00" * (count * anvil.SECTOR_SIZE - len(raw)))
+        f.seek(index * 4)
+        f.write(struct.pack(">I", sector)[1:] + struct.pack(">B", count))
+
+    store.create(str(tmp_path / "server"), "second")
+    store.restore("second", str(tmp_path / "restored"))
+    restored = regionChunks(str(tmp_path / "restored" / "world" / "region" / "r.-1.-1.mca"))
+    assert restored[index] == (raw, timestamp)
+    assert restored == regionChunks(path)
+
+def test_unchanged_chunks_are_reused(tmp_path):
+    gen = worldgen.WorldGenerator()
+    gen.generate(str(tmp_path / "server"), regions=1, chunks=64, players=0)
+    store = snapshot.SnapshotStore(str(tmp_path / "store"), threads=2)
+    first = store.create(str(tmp_path / "server"), "first")
+    gen.touch(str(tmp_path / "server"), regions=1, chunks=4)
+    second = store.create(str(tmp_path / "server"), "second")
+
+    regionEntry = lambda manifest: next(f for f in manifest["files"] if f["path"].endswith(".mca"))
+    parentDigests = set(c[2] for c in regionEntry(first)["chunks"])
+    stored = [ c for c in regionEntry(second)["chunks"] if c[2] not in parentDigests ]
+    assert 1 <= len(stored) <= 4
+    store.restore("second", str(tmp_path / "restored"))
+    assert regionChunks(str(tmp_path / "restored" / "world" / "region" / "r.-1.-1.mca")) == regionChunks(str(tmp_path / "server" / "world" / "region" / "r.-1.-1.mca"))
@@ -0,0 +1,130 @@
+import os
+import shutil
+import struct
+import zlib
+import anvil
+import nbt
+import world
+import worldgen
+
+MIN_INHABITED = 50000
+
+def readAll(path):
+    with anvil.RegionReader(path) as region:
+        return { i: (region.readChunk(i), region.timestamps[i]) for i in range(anvil.CHUNK_COUNT) if region.hasChunk(i) }
+
+def fragmentedRegion(tmp_path, chunks=64):
+    """
+    A generated region file where half of the chunks were saved again bigger by a server: they were moved to the end
+    of the file and their old sectors are free
+    """
+    worldgen.WorldGenerator().generate(str(tmp_path / "server"), regions=1, chunks=chunks, players=0)
+    regionDir = str(tmp_path / "server" / "world" / "region")
+    path = os.path.join(regionDir, os.listdir(regionDir)[0])
+    with anvil.RegionReader(path) as region:
+        moved = [ (i, region.locations[i][1], region.readChunk(i)) for i in range(anvil.CHUNK_COUNT) if region.hasChunk(i) ][::2]
+    with open(path, "r+b") as f:
+        for index, count, raw in moved:
+            sector = f.seek(0, os.SEEK_END) // anvil.SECTOR_SIZE
+            f.write(raw + b"\x00" * (count * anvil.SECTOR_SIZE - len(raw)))
+            f.seek(index * 4)
+            f.write(struct.pack(">I", sector)[1:] + struct.pack(">B", count))
+    return path
+
+def setExternal(path, index):
+    """Mark the chunk at index as stored in its .mcc file"""
+    with anvil.RegionReader(path) as region:
+        sector = region.locations[index][0]
+    with open(path, "r+b") as f:
+        f.seek(sector * anvil.SECTOR_SIZE + 4)
+        f.write(bytes([ anvil.COMPRESSION_ZLIB | anvil.EXTERNAL ]))
+    with open(anvil.externalPath(path, index), "wb") as f:
+        f.write(zlib.compress(b"external"))
+
+def test_compact_keeps_the_chunks_byte_identical(tmp_path):
+    path = fragmentedRegion(tmp_path)
+    before = readAll(path)
+    sizeBefore = os.path.getsize(path)
+    res = anvil.compact(path)
+    assert res["rewritten"] and not res["removed"]
+    assert res["bytes_before"] == sizeBefore
+    assert res["bytes_after"] == os.path.getsize(path) < sizeBefore
+    assert readAll(path) == before
+    # nothing left to reclaim
+    assert not anvil.compact(path)["rewritten"]
+
+def test_compact_drops_chunks(tmp_path):
+    path = fragmentedRegion(tmp_path)
+    before = readAll(path)
+    drop = set(sorted(before)[::3])
+    # the first dropped chunk is stored in a .mcc file, the one of a kept chunk is left alone
+    droppedExternal = anvil.externalPath(path, min(drop))
+    keptExternal = anvil.externalPath(path, min(set(before) - drop))
+    setExternal(path, min(drop))
+    setExternal(path, min(set(before) - drop))
+    before = readAll(path)
+
+    res = anvil.compact(path, drop)
+    after = readAll(path)
+    assert res["chunks"] == len(before) - len(drop)
+    assert res["chunks_dropped"] == len(drop)
+    assert set(after) == set(before) - drop
+    assert after == { i: c for i, c in before.items() if i not in drop }
+    assert not os.path.exists(droppedExternal)
+    assert os.path.exists(keptExternal)
+
+def test_compact_removes_an_empty_region(tmp_path):
+    path = fragmentedRegion(tmp_path, chunks=8)
+    res = anvil.compact(path, set(readAll(path)))
+    assert res["removed"] and res["bytes_after"] == 0
+    assert not os.path.exists(path)
+
+def test_compact_dry_run_writes_nothing(tmp_path):
+    path = fragmentedRegion(tmp_path)
+    with open(path, "rb") as f:
+        content = f.read()
+    res = anvil.compact(path, set(sorted(readAll(path))[:3]), dryRun=True)
+    assert res["bytes_after"] < res["bytes_before"]
+    assert not res["rewritten"]
+    with open(path, "rb") as f:
+        assert f.read() == content
+
+def test_optimize_drops_unvisited_chunks_with_their_entities_and_poi(tmp_path):
+    path = fragmentedRegion(tmp_path)
+    worldDir = str(tmp_path / "server" / "world")
+    name = os.path.basename(path)
+    for d in [ "entities", "poi" ]:
+        os.makedirs(os.path.join(worldDir, d))
+        shutil.copy(path, os.path.join(worldDir, d, name))
+    # a second dimension
+    os.makedirs(os.path.join(worldDir, "DIM-1", "region"))
+    shutil.copy(path, os.path.join(worldDir, "DIM-1", "region", name))
+    before = readAll(path)
+    unvisited = set(i for i, (raw, timestamp) in before.items() if nbt.find(anvil.chunkData(path, i, raw), "InhabitedTime") < MIN_INHABITED)
+    assert 0 < len(unvisited) < len(before)
+
+    report = world.optimize(worldDir, MIN_INHABITED, dryRun=True)
+    assert report["chunks_dropped"] == 4 * len(unvisited)
+    assert readAll(path) == before
+
+    report = world.optimize(worldDir, MIN_INHABITED)
+    assert not report["errors"]
+    assert report["files"] == 4
+    assert report["chunks_dropped"] == 4 * len(unvisited)
+    assert set(report["dimensions"]) == { "overworld", "DIM-1" }
+    expected = { i: c for i, c in before.items() if i not in unvisited }
+    for d in [ "region", "entities", "poi", os.path.join("DIM-1", "region") ]:
+        assert readAll(os.path.join(worldDir, d, name)) == expected
+
+def test_optimize_skips_an_unreadable_region(tmp_path):
+    path = fragmentedRegion(tmp_path)
+    worldDir = str(tmp_path / "server" / "world")
+    os.makedirs(os.path.join(worldDir, "entities"))
+    shutil.copy(path, os.path.join(worldDir, "entities", os.path.basename(path)))
+    entities = readAll(os.path.join(worldDir, "entities", os.path.basename(path)))
+    with open(path, "r+b") as f:
+        f.truncate(100)
+    report = world.optimize(worldDir, MIN_INHABITED)
+    assert len(report["errors"]) == 1
+    # the entities of a region that could not be read are not dropped
+    assert readAll(os.path.join(worldDir, "entities", os.path.basename(path))) == entities